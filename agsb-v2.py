@@ -1,93 +1,495 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+# cat/status 常被监控脚本反复调用: 快速路径 (fast_main) 只依赖下面几个启动开销最小的模块,
+# 直接读取状态快照并询问守护进程, 命中后退出, 不再导入其余模块
 import os
 import sys
 import json
+import socket
+
+AGSB_HOME = os.path.join(os.path.expanduser("~"), ".agsb") # 即 INSTALL_DIR, 快速路径不导入 pathlib
+STATE_PATH = os.path.join(AGSB_HOME, "state.json") # 状态存储: 配置、域名、节点链接, 整个文件原子替换
+STATE_VERSION = 1 # 状态存储格式版本, 不一致时由完整流程迁移
+SUPERVISOR_SOCK_PATH = os.path.join(AGSB_HOME, "supervisor.sock")
+SCRIPT_COPY_PATH = os.path.join(AGSB_HOME, "agsb.py") # 安装目录内的脚本副本, 即 SUPERVISOR_SCRIPT
+# 提示中让用户运行的脚本: 经快速入口运行预编译的 agsb.pyc 时指向安装目录内的 agsb.py, 不能对 .pyc 执行 install
+SCRIPT_HINT = SCRIPT_COPY_PATH if __file__.endswith(".pyc") else os.path.basename(__file__)
+
+# 脚本信息
+def print_info():
+    print("\033[36m╭───────────────────────────────────────────────────────────────╮\033[0m")
+    print("\033[36m│             \033[33m✨ ArgoSB Python3 自定义域名版 ✨              \033[36m│\033[0m")
+    print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
+    print("\033[36m│ \033[32m作者: 康康                                                  \033[36m│\033[0m")
+    print("\033[36m│ \033[32mGithub: https://github.com/zhumengkang/                    \033[36m│\033[0m")
+    print("\033[36m│ \033[32mYouTube: https://www.youtube.com/@康康的V2Ray与Clash         \033[36m│\033[0m")
+    print("\033[36m│ \033[32mTelegram: https://t.me/+WibQp7Mww1k5MmZl                   \033[36m│\033[0m")
+    print("\033[36m│ \033[32m版本: 25.7.0 (支持Argo Token及交互式输入)                 \033[36m│\033[0m")
+    print("\033[36m╰───────────────────────────────────────────────────────────────╯\033[0m")
+
+# 向守护进程发送一条命令, 返回解析后的 JSON 响应; 守护进程未运行时返回 None,
+# 已连接但超时未应答时返回 {"ok": False, "error": "timeout"} (守护进程仍在运行, 不能当作未运行处理)
+def supervisor_request(command, timeout=2.0):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(SUPERVISOR_SOCK_PATH)
+            sock.sendall(command.encode() + b"\n")
+            data = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        return json.loads(data)
+    except socket.timeout:
+        return {"ok": False, "error": "timeout"}
+    except (OSError, ValueError):
+        return None
+
+# 读取状态存储, 不存在、损坏或版本不符时返回 None
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get("version") == STATE_VERSION else None
+
+# cat: 输出所有单行节点链接
+def show_nodes(state):
+    if state and state.get("links"):
+        print("\n".join(state["links"]))
+    else:
+        print(f"\033[31m节点文件 {STATE_PATH} 未找到。请先安装或运行 status。\033[0m")
+
+# 检查脚本运行状态: 服务信息由守护进程直接回答, 域名和链接来自状态快照, 无需启动任何shell
+def check_status(state=None):
+    state = load_state() if state is None else state
+    status = supervisor_request("status")
+    services = status.get("services", {}) if status else {}
+    sb_running = services.get("sing-box", {}).get("running", False)
+    links = state.get("links") if state else None # 重新安装过程中链接尚未生成
+    tunnel = state.get("tunnel", True) if state else True
+    # 多实例时所有 cloudflared 分片都运行才算正常; 只启用直连协议时不需要 cloudflared
+    cf_services = {name: info for name, info in services.items() if name.startswith("cloudflared")}
+    cf_running = not tunnel or (bool(cf_services) and all(info["running"] for info in cf_services.values()))
+
+    if sb_running and cf_running and links:
+        print("\033[36m╭───────────────────────────────────────────────────────────────╮\033[0m")
+        print("\033[36m│                \033[33m✨ ArgoSB 运行状态 ✨                    \033[36m│\033[0m")
+        print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
+        print("\033[36m│ \033[32m服务状态: \033[33m正在运行 (" + ("sing-box & cloudflared" if tunnel else "sing-box") + ")\033[0m")
+        print(f"\033[36m│ \033[32m协议后端: \033[0m{', '.join(state['backends'])}")
+        for name, info in services.items():
+            print(f"\033[36m│ \033[32m{name}: \033[0mPID {info['pid']}, 已运行 {int(info['uptime'])}秒, 重启 {info['restarts']} 次")
+        if tunnel and state["domains"]:
+            print(f"\033[36m│ \033[32m当前使用域名: \033[0m{', '.join(state['domains'])}")
+        elif tunnel: # 直连协议没有隧道域名
+            print("\033[36m│ \033[31m域名信息未找到或未生成，请检查配置或日志。\033[0m")
+
+        print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
+        print("\033[36m│ \033[33m节点链接 (部分示例):\033[0m")
+        for link in links[:3]:
+            print(f"\033[36m│ \033[0m{link[:70]}...") # 打印部分链接
+        if len(links) > 3:
+            print("\033[36m│ \033[32m... 更多节点请使用 'cat' 命令查看 ...\033[0m")
+        print("\033[36m╰───────────────────────────────────────────────────────────────╯\033[0m")
+        return True
+    
+    status_msgs = []
+    if not status: status_msgs.append("守护进程未运行")
+    elif "services" not in status: status_msgs.append("守护进程无响应")
+    if not sb_running: status_msgs.append("sing-box 未运行")
+    if not cf_running:
+        stopped = [name for name, info in cf_services.items() if not info["running"]]
+        status_msgs.append(f"{', '.join(stopped) or 'cloudflared'} 未运行")
+    if not links: status_msgs.append("节点信息未生成")
+
+    print("\033[36m╭───────────────────────────────────────────────────────────────╮\033[0m")
+    print("\033[36m│                \033[33m✨ ArgoSB 运行状态 ✨                    \033[36m│\033[0m")
+    print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
+    if status_msgs:
+        print("\033[36m│ \033[31mArgoSB 服务异常:\033[0m")
+        for msg in status_msgs:
+            print(f"\033[36m│   - {msg}\033[0m")
+        print("\033[36m│ \033[32m尝试重新安装或检查日志: \033[33mpython3 " + SCRIPT_HINT + " install\033[0m")
+    else: # Should be caught by first if, but as a fallback
+         print("\033[36m│ \033[31mArgoSB 未运行或配置不完整。\033[0m")
+         print("\033[36m│ \033[32m运行 \033[33mpython3 " + SCRIPT_HINT + "\033[32m 开始安装。\033[0m")
+    print("\033[36m╰───────────────────────────────────────────────────────────────╯\033[0m")
+    return False
+
+# --no-banner 或 AGSB_NO_BANNER=1 时不打印脚本信息框
+def banner_enabled(no_banner=False):
+    return not no_banner and os.environ.get("AGSB_NO_BANNER") != "1"
+
+# cat/status 快速路径: 只接受 [--no-banner] cat|status, 且状态快照已存在; 返回 False 时交给完整流程
+def fast_main(argv):
+    options = [arg for arg in argv if arg.startswith("-")]
+    actions = [arg for arg in argv if not arg.startswith("-")]
+    if actions not in (["cat"], ["status"]) or any(option != "--no-banner" for option in options):
+        return False
+    state = load_state()
+    if state is None:
+        return False # 旧版本安装需要先迁移状态存储, 交给完整流程
+    if banner_enabled("--no-banner" in options):
+        print_info()
+    if actions[0] == "cat":
+        show_nodes(state)
+    else:
+        check_status(state)
+    return True
+
+if __name__ == "__main__" and fast_main(sys.argv[1:]):
+    sys.exit(0)
+
 import random
 import time
 import shutil
 import re
 import base64
-import socket
 import subprocess
 import platform
 from datetime import datetime
+from dataclasses import dataclass
 import uuid
 from pathlib import Path
 import urllib.request
+import urllib.error
 import ssl
 import tempfile
 import argparse
+import tarfile
+import threading
+import queue
+import hashlib
+import fcntl
+import select
+import ctypes
+import signal
+import socketserver
+import statistics
+import logging
+import logging.handlers
+import atexit
+import unicodedata
+import ipaddress
+from contextlib import contextmanager
+import asyncio
+import gzip
+import http.server
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from artifact_cache import ArtifactCache, CACHE_DIR
+except ImportError: # 单独复制或下载的 agsb-v2.py 没有缓存模块: 照常安装, 只是不使用下载缓存
+    CACHE_DIR = None
+
+    class ArtifactCache:
+        """缺少 artifact_cache.py 时的替身, 从不命中也不写入"""
+        def latest_version(self, tool, arch):
+            return None
+
+        def set_latest(self, tool, arch, version):
+            pass
+
+        def get(self, tool, version, arch, target_path):
+            return False
+
+        def put(self, tool, version, arch, source_path):
+            pass
 
 # 全局变量
-INSTALL_DIR = Path.home() / ".agsb"  # 用户主目录下的隐藏文件夹，避免root权限
+INSTALL_DIR = Path(AGSB_HOME)  # 用户主目录下的隐藏文件夹，避免root权限
+STATE_FILE = Path(STATE_PATH)
+STATE_LOCK = INSTALL_DIR / "state.lock" # 状态存储读-改-写时持有的文件锁
+# 旧版本分散保存状态的文件, 首次读取状态存储时迁移并删除
 CONFIG_FILE = INSTALL_DIR / "config.json"
-SB_PID_FILE = INSTALL_DIR / "sbpid.log"
-ARGO_PID_FILE = INSTALL_DIR / "sbargopid.log"
+CUSTOM_DOMAIN_FILE = INSTALL_DIR / "custom_domain.txt"
 LIST_FILE = INSTALL_DIR / "list.txt"
+SB_PID_FILE = INSTALL_DIR / "sbpid.log" # 旧版启动脚本写入的PID文件, 迁移后记录在 legacy_pids 中供卸载时停止
+ARGO_PID_FILE = INSTALL_DIR / "sbargopid.log"
+LEGACY_STATE_FILES = [CONFIG_FILE, CUSTOM_DOMAIN_FILE, LIST_FILE, INSTALL_DIR / "allnodes.txt", INSTALL_DIR / "jh.txt",
+                      SB_PID_FILE, ARGO_PID_FILE]
+SUPERVISOR_SCRIPT = Path(SCRIPT_COPY_PATH) # 安装时复制的脚本副本, 供守护进程和开机自启使用
+SUPERVISOR_SOCK = Path(SUPERVISOR_SOCK_PATH) # 守护进程状态/控制套接字
+SUPERVISOR_PID_FILE = INSTALL_DIR / "supervisor.pid" # 内容为 "PID 启动时间", 用于校验进程身份
+SUPERVISOR_LOG = INSTALL_DIR / "supervisor.log"
+SB_LOG_FILE = INSTALL_DIR / "sb.log"
 LOG_FILE = INSTALL_DIR / "argo.log"
 DEBUG_LOG = INSTALL_DIR / "python_debug.log"
-CUSTOM_DOMAIN_FILE = INSTALL_DIR / "custom_domain.txt" # 存储最终使用的域名
+FAST_LAUNCHER = INSTALL_DIR / "agsb" # cat/status 快速入口 (sh), 执行预编译的 FAST_PYC
+FAST_PYC = INSTALL_DIR / "agsb.pyc"
+TRYCLOUDFLARE_RE = re.compile(rb'https://([a-zA-Z0-9.-]+\.trycloudflare\.com)')
+TUNNEL_DOMAIN_TIMEOUT = 45 # 等待临时隧道域名的最长时间(秒)
+EDGE_PROBE_FILE = INSTALL_DIR / "edge_probe.json" # Cloudflare 优选IP测速结果缓存
+EDGE_PROBE_TTL = int(os.environ.get("AGSB_EDGE_TTL", "21600")) # 测速结果有效期(秒)
+EDGE_PROBE_ATTEMPTS = 4 # 每个候选地址的探测次数, 用于估算丢包率
+CF_TLS_PORTS = {443, 2053, 2083, 2087, 2096, 8443} # Cloudflare 支持的 HTTPS 端口, 其余视为 HTTP
+HOSTNAME_RE = re.compile(r"(?=.{1,253}$)([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)*[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?")
+DEFAULT_EDGE_CANDIDATES = [
+    "104.16.0.0:443", "104.17.0.0:8443", "104.18.0.0:2053", "104.19.0.0:2083", "104.20.0.0:2087",
+    "104.21.0.0:80", "104.22.0.0:8080", "104.24.0.0:8880",
+]
+SUB_LISTEN = os.environ.get("AGSB_SUB_LISTEN", "0.0.0.0:18080") # 订阅服务默认监听地址
+METRICS_LISTEN = os.environ.get("AGSB_METRICS_LISTEN", "127.0.0.1:9101") # Prometheus 指标服务默认监听地址
+RESTART_BACKOFF_MIN = 1 # 子进程异常退出后的重启等待(秒), 每次连续失败翻倍
+RESTART_BACKOFF_MAX = 60
+RESTART_STABLE_SECS = 30 # 子进程持续运行超过该时间后重置退避
+READY_TIMEOUT = 30 # 等待 sing-box / cloudflared 就绪的最长时间(秒)
+SUPERVISOR_CONTROL_TIMEOUT = 20 # restart/sync 命令的应答超时(秒), 守护进程需等待子进程退出后再重新启动
+
+# cloudflared 传输参数自动调优 (tune 命令): 逐个组合启动临时隧道, 测量握手时间和吞吐量
+CF_TUNE_PROTOCOLS = ["quic", "http2"]
+CF_TUNE_EDGE_IP_VERSIONS = ["4", "6"]
+CF_TUNE_HA_CONNECTIONS = [4, 2] # 第一项为 cloudflared 默认值, 先用它比较协议和IP版本, 再对最优组合比较其余连接数
+CF_TUNE_HANDSHAKES = 5 # 每个组合测量的 WebSocket 握手次数 (取中位数)
+CF_TUNE_PAYLOAD = int(os.environ.get("AGSB_TUNE_MB", "8")) * 1024 * 1024 # 吞吐测试的下载量
+CF_TUNE_SECONDS = 10 # 吞吐测试的最长时间(秒)
+CF_TUNE_READY_TIMEOUT = 45 # 等待临时隧道可用 (域名生成、DNS 生效) 的最长时间(秒)
+CF_TUNE_PATH = "/__agsb_tune" # 调优源站上的测速下载路径, 其余请求转发给 sing-box
+
+# sing-box 性能配置档 (--perf-profile 或配置中的 perf_profile), balanced 即原有配置:
+# multiplex 入站多路复用, sniff 流量嗅探, early_data WebSocket 早期数据 (同时决定链接中的 ?ed=),
+# tcp_fast_open 入站 TFO, outbound_tcp_fast_open 出站 TFO (None 表示不设置), log_level 日志级别
+PERF_PROFILES = {
+    "balanced": {"multiplex": False, "sniff": True, "early_data": 2048, "tcp_fast_open": True,
+                 "outbound_tcp_fast_open": None, "log_level": "info"},
+    "throughput": {"multiplex": True, "sniff": False, "early_data": 0, "tcp_fast_open": True,
+                   "outbound_tcp_fast_open": True, "log_level": "warn"},
+    "low-latency": {"multiplex": False, "sniff": False, "early_data": 4096, "tcp_fast_open": True,
+                    "outbound_tcp_fast_open": True, "log_level": "warn"},
+    "low-cpu": {"multiplex": False, "sniff": False, "early_data": 0, "tcp_fast_open": False,
+                "outbound_tcp_fast_open": None, "log_level": "error"},
+}
+DEFAULT_PERF_PROFILE = "balanced"
+MUX_MAX_CONNECTIONS = 4 # 开启多路复用的配置档在订阅 (Clash / sing-box) 中为客户端设置的最大底层连接数
+
+# 协议后端 (--backends 或配置中的 backends), 均以 sing-box 入站实现:
+# vmess-argo 经 cloudflared 隧道, 其余直接监听公网端口 (需放行对应 TCP/UDP 端口)
+DEFAULT_BACKENDS = ["vmess-argo"]
+TLS_CERT_FILE = INSTALL_DIR / "cert.pem" # hysteria2 / tuic 使用的自签证书
+TLS_KEY_FILE = INSTALL_DIR / "private.key"
+TLS_SNI = "www.bing.com" # 自签证书的 CN, 客户端需允许不安全证书
+REALITY_SNI = os.environ.get("reym", "www.cloudflare.com") # Reality 握手目标站点
+
+# 日志: python_debug.log 为 JSON 行格式, 与 argo.log / sb.log / supervisor.log 一样由守护进程按大小轮转
+LOG_MAX_BYTES = int(os.environ.get("AGSB_LOG_MAX_MB", "5")) * 1024 * 1024
+LOG_BACKUPS = 3 # 保留的轮转文件数 (.1 .. .3)
+LOG_ROTATE_INTERVAL = 10 # 守护进程检查子进程日志大小的间隔(秒)
+LOG_SPANS = os.environ.get("AGSB_LOG_SPANS") == "1" # 记录各安装阶段耗时的 span 日志
+PROFILE_FILE = INSTALL_DIR / "install_profile.json" # install --profile 生成的阶段耗时报告
+
+# 下载相关参数
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+MIRROR_PREFIX = "https://github.91chi.fun/" # GitHub 加速镜像, 与主地址同时竞速
+GITHUB_API = os.environ.get("AGSB_GITHUB_API", "https://api.github.com").rstrip("/") # 可指向本地测试服务器 (见 benchmark.py)
+GITHUB_BASE = os.environ.get("AGSB_GITHUB_BASE", "https://github.com").rstrip("/")
+DOWNLOAD_TIMEOUT = 30 # 单次连接/读取超时(秒)
+DOWNLOAD_RETRIES = 3 # 断点续传重试次数
+DOWNLOAD_CHUNK = 64 * 1024
+
+CACHE_MODULE = Path(__file__).resolve().with_name("artifact_cache.py") # 与 app.py 共用的下载缓存模块, 安装时一并复制
 
 # 添加命令行参数解析
 def parse_args():
     parser = argparse.ArgumentParser(description="ArgoSB Python3 一键脚本 (支持自定义域名和Argo Token)")
     parser.add_argument("action", nargs="?", default="install",
-                        choices=["install", "status", "update", "del", "uninstall", "cat"],
-                        help="操作类型: install(安装), status(状态), update(更新), del(卸载), cat(查看节点)")
+                        choices=["install", "status", "update", "del", "uninstall", "cat", "reload", "supervise", "probe", "serve", "metrics", "tune"],
+                        help="操作类型: install(安装), status(状态), update(更新), del(卸载), cat(查看节点), reload(热更新配置), supervise(前台运行守护进程), probe(优选IP测速并重排节点), serve(运行订阅服务), metrics(运行Prometheus指标服务), tune(cloudflared传输参数调优)")
     parser.add_argument("--domain", "-d", dest="agn", help="设置自定义域名 (例如: xxx.trycloudflare.com 或 your.custom.domain)")
     parser.add_argument("--uuid", "-u", help="设置自定义UUID")
     parser.add_argument("--port", "-p", dest="vmpt", type=int, help="设置自定义Vmess端口")
     parser.add_argument("--agk", "--token", dest="agk", help="设置 Argo Tunnel Token (用于Cloudflare Zero Trust命名隧道)")
+    parser.add_argument("--edge-ips", dest="edge_ips", help="优选IP候选列表, 逗号分隔的 IP、域名、IP:端口 或 [IPv6]:端口, 省略端口时为443 (例如: 104.16.0.0:443,104.21.0.0:80); 保存在配置中, 重新安装时沿用")
+    parser.add_argument("--listen", help=f"serve/metrics 监听地址 (默认分别为 {SUB_LISTEN} 和 {METRICS_LISTEN}), 订阅路径为 /sub/<UUID>?format=base64|vmess|clash|singbox, 指标路径为 /metrics")
+    parser.add_argument("--instances", "-n", type=int, help="分片实例数: N个本地vmess入站(端口依次递增)各由独立的cloudflared转发 (默认1)")
+    parser.add_argument("--perf-profile", dest="perf_profile", choices=list(PERF_PROFILES),
+                        help=f"sing-box 性能配置档 (默认 {DEFAULT_PERF_PROFILE}): throughput 吞吐优先(多路复用), low-latency 低延迟, low-cpu 低CPU占用")
+    parser.add_argument("--profile", action="store_true", help=f"install 时记录各阶段耗时与下载量, 报告写入 {PROFILE_FILE}")
+    parser.add_argument("--backends", help="启用的协议后端, 逗号分隔 (默认 vmess-argo): vmess-argo, vless-reality, hysteria2, tuic; "
+                                           "也可通过环境变量 vlpt/hypt/tupt 指定端口来启用")
+    parser.add_argument("--server-ip", dest="server_ip", help="直连协议节点使用的服务器地址 (默认自动检测公网IP)")
+    parser.add_argument("--no-banner", dest="no_banner", action="store_true", help="不打印脚本信息框 (也可设置环境变量 AGSB_NO_BANNER=1)")
 
     return parser.parse_args()
 
 # 网络请求函数
+def _ssl_context():
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
 def http_get(url, timeout=10):
     try:
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req, context=ctx, timeout=timeout) as response:
-            return response.read().decode('utf-8')
+        req = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with urllib.request.urlopen(req, context=_ssl_context(), timeout=timeout) as response:
+            data = response.read()
+        count_net_bytes(len(data))
+        return data.decode('utf-8')
     except Exception as e:
         print(f"HTTP请求失败: {url}, 错误: {e}")
         write_debug_log(f"HTTP GET Error: {url}, {e}")
         return None
 
-def download_file(url, target_path, mode='wb'):
-    try:
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req, context=ctx) as response, open(target_path, mode) as out_file:
-            shutil.copyfileobj(response, out_file)
-        return True
-    except Exception as e:
-        print(f"下载文件失败: {url}, 错误: {e}")
-        write_debug_log(f"Download Error: {url}, {e}")
-        return False
+def _open_url(url, offset=0, timeout=DOWNLOAD_TIMEOUT):
+    headers = {'User-Agent': USER_AGENT}
+    if offset > 0:
+        headers['Range'] = f"bytes={offset}-"
+    req = urllib.request.Request(url, headers=headers)
+    return urllib.request.urlopen(req, context=_ssl_context(), timeout=timeout)
 
-# 脚本信息
-def print_info():
-    print("\033[36m╭───────────────────────────────────────────────────────────────╮\033[0m")
-    print("\033[36m│             \033[33m✨ ArgoSB Python3 自定义域名版 ✨              \033[36m│\033[0m")
-    print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-    print("\033[36m│ \033[32m作者: 康康                                                  \033[36m│\033[0m")
-    print("\033[36m│ \033[32mGithub: https://github.com/zhumengkang/                    \033[36m│\033[0m")
-    print("\033[36m│ \033[32mYouTube: https://www.youtube.com/@康康的V2Ray与Clash         \033[36m│\033[0m")
-    print("\033[36m│ \033[32mTelegram: https://t.me/+WibQp7Mww1k5MmZl                   \033[36m│\033[0m")
-    print("\033[36m│ \033[32m版本: 25.7.0 (支持Argo Token及交互式输入)                 \033[36m│\033[0m")
-    print("\033[36m╰───────────────────────────────────────────────────────────────╯\033[0m")
+def mirror_urls(url):
+    """返回主地址及其镜像地址列表 (仅 GitHub 地址有镜像)"""
+    if url.startswith("https://github.com/"):
+        return [url, MIRROR_PREFIX + url]
+    return [url]
+
+def race_open(urls, offset=0, timeout=DOWNLOAD_TIMEOUT):
+    """同时请求所有地址, 返回最先成功响应的 (url, response), 其余连接在后台关闭"""
+    results = queue.Queue()
+
+    def worker(u):
+        try:
+            results.put((u, _open_url(u, offset, timeout), None))
+        except Exception as e:
+            results.put((u, None, e))
+
+    for u in urls:
+        threading.Thread(target=worker, args=(u,), daemon=True).start()
+
+    errors = []
+    for pending in range(len(urls), 0, -1):
+        u, response, err = results.get()
+        if response is None:
+            errors.append(f"{u}: {err}")
+            continue
+        # 关闭之后才返回的失败者, 避免连接泄漏
+        def close_rest(n=pending - 1):
+            for _ in range(n):
+                _, r, _ = results.get()
+                if r is not None:
+                    r.close()
+        threading.Thread(target=close_rest, daemon=True).start()
+        return u, response
+    raise IOError("; ".join(errors))
+
+def download_file(url, target_path, stats=None):
+    """下载文件: 主地址与镜像竞速, 写入 .part 临时文件并支持 Range 断点续传"""
+    target_path = Path(target_path)
+    part_path = target_path.with_name(target_path.name + ".part")
+    urls = mirror_urls(url)
+    start = time.time()
+    received = 0
+    source = url
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        try:
+            source, response = race_open(urls, offset)
+            with response:
+                if offset and response.status != 206: # 服务器不支持 Range, 从头下载
+                    offset = 0
+                expected = response.headers.get("Content-Length")
+                # 既无 Content-Length 也非 chunked 编码时, 响应体以断开连接结束, 中途断开与正常结束无法区分
+                if expected is None and not getattr(response, "chunked", False):
+                    raise IOError("服务器未返回 Content-Length, 无法确认下载完整")
+                got = 0
+                with open(part_path, 'ab' if offset else 'wb') as out_file:
+                    while True:
+                        chunk = response.read(DOWNLOAD_CHUNK)
+                        if not chunk:
+                            break
+                        out_file.write(chunk)
+                        got += len(chunk)
+                received += got
+                if expected is not None and got < int(expected):
+                    raise IOError(f"连接中断, 已接收 {offset + got} 字节")
+            os.replace(part_path, target_path)
+            if stats is not None:
+                stats.update(bytes=received, seconds=time.time() - start, source=source)
+            return True
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and part_path.exists(): # Range 越界, 丢弃残留的临时文件
+                part_path.unlink()
+            print(f"下载文件失败: {url}, 错误: {e} (尝试 {attempt}/{DOWNLOAD_RETRIES})")
+            write_debug_log(f"Download Error: {url}, {e}")
+        except Exception as e:
+            print(f"下载文件失败: {url}, 错误: {e} (尝试 {attempt}/{DOWNLOAD_RETRIES})")
+            write_debug_log(f"Download Error: {url}, {e}")
+    return False
+
+class _CountingReader:
+    """包装 HTTP 响应, 统计已读取的(压缩)字节数"""
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+def download_member(url, member_name, target_path, stats=None):
+    """流式下载 tar.gz, 边解压边查找并只写出名为 member_name 的文件, 压缩包本身不落盘"""
+    target_path = Path(target_path)
+    part_path = target_path.with_name(target_path.name + ".part")
+    urls = mirror_urls(url)
+    start = time.time()
+    received = 0
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        try:
+            source, response = race_open(urls)
+            reader = _CountingReader(response)
+            try:
+                with response, tarfile.open(fileobj=reader, mode="r|gz") as tar:
+                    for member in tar:
+                        if member.isfile() and os.path.basename(member.name) == member_name:
+                            with tar.extractfile(member) as src, open(part_path, 'wb') as out_file:
+                                shutil.copyfileobj(src, out_file, DOWNLOAD_CHUNK)
+                                written = out_file.tell()
+                            # tar 头中记录了文件大小, 不依赖 Content-Length 也能发现截断
+                            if written != member.size:
+                                raise IOError(f"{member_name} 不完整: {written}/{member.size} 字节")
+                            break
+                    else:
+                        raise IOError(f"压缩包中未找到 {member_name}")
+            finally:
+                received += reader.bytes_read
+            os.chmod(part_path, 0o755)
+            os.replace(part_path, target_path)
+            if stats is not None:
+                stats.update(bytes=received, seconds=time.time() - start, source=source)
+            return True
+        except Exception as e:
+            if part_path.exists(): part_path.unlink()
+            print(f"下载解压失败: {url}, 错误: {e} (尝试 {attempt}/{DOWNLOAD_RETRIES})")
+            write_debug_log(f"Download/extract Error: {url}, {e}")
+    return False
+
+def fetch_artifacts(jobs):
+    """并行下载多个文件, jobs 为 [(名称, url, 目标路径, 压缩包内文件名或None), ...], 返回 {名称: 是否成功}"""
+    def fetch_one(job):
+        name, url, target_path, member = job
+        stats = {}
+        if member:
+            ok = download_member(url, member, target_path, stats=stats)
+        else:
+            ok = download_file(url, target_path, stats=stats)
+        if ok:
+            seconds = max(stats["seconds"], 1e-6)
+            mb = stats["bytes"] / 1048576
+            via = "镜像" if stats["source"].startswith(MIRROR_PREFIX) else "主地址"
+            print(f"{name} 下载完成: {mb:.1f} MB, 用时 {seconds:.1f}s, {mb / seconds:.2f} MB/s (来源: {via})")
+            write_debug_log(f"Download stats {name}: {stats}")
+            count_net_bytes(stats["bytes"])
+        return name, ok
+
+    if not jobs:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        return dict(pool.map(fetch_one, jobs))
 
 # 打印使用帮助信息
 def print_usage():
@@ -100,6 +502,7 @@ def print_usage():
     print("  \033[36mpython3 script.py --agk YOUR_TOKEN\033[0m     - 使用Argo Tunnel Token安装")
     print("  \033[36mpython3 script.py status\033[0m              - 查看服务状态和节点信息")
     print("  \033[36mpython3 script.py cat\033[0m                 - 查看单行节点列表")
+    print(f"  \033[36m{FAST_LAUNCHER} status --no-banner\033[0m - 快速查看状态 (预编译入口, 适合监控脚本)")
     print("  \033[36mpython3 script.py update\033[0m              - 更新脚本")
     print("  \033[36mpython3 script.py del\033[0m                 - 卸载服务")
     print()
@@ -111,27 +514,294 @@ def print_usage():
     print()
 
 # 写入日志函数
-def write_debug_log(message):
-    try:
-        if not INSTALL_DIR.exists():
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "pid": record.process,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_log_lock = threading.Lock()
+_log_listener = None
+
+# 调试日志: 调用方只把记录放入队列, 由后台线程通过常驻的文件句柄写出;
+# 守护进程和每次命令行调用都会写这个文件, 各进程只以追加模式写入, 轮转统一由守护进程的 rotate_copytruncate 完成
+def _debug_logger():
+    global _log_listener
+    logger = logging.getLogger("agsb")
+    with _log_lock:
+        if _log_listener is None:
             INSTALL_DIR.mkdir(parents=True, exist_ok=True)
-        with open(DEBUG_LOG, 'a', encoding='utf-8') as f:
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            f.write(f"[{timestamp}] {message}\n")
+            handler = logging.FileHandler(DEBUG_LOG, mode="a", encoding="utf-8")
+            handler.setFormatter(_JsonFormatter())
+            log_queue = queue.SimpleQueue()
+            _log_listener = logging.handlers.QueueListener(log_queue, handler)
+            _log_listener.start()
+            atexit.register(_log_listener.stop) # 退出前写完队列中的记录
+            logger.addHandler(logging.handlers.QueueHandler(log_queue))
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+    return logger
+
+def write_debug_log(message, level=logging.INFO, **fields):
+    try:
+        _debug_logger().log(level, message, extra={"fields": fields})
     except Exception as e:
         print(f"写入日志失败: {e}")
 
-# 下载二进制文件
-def download_binary(name, download_url, target_path):
-    print(f"正在下载 {name}...")
-    success = download_file(download_url, target_path)
-    if success:
-        print(f"{name} 下载成功!")
-        os.chmod(target_path, 0o755)
-        return True
-    else:
-        print(f"{name} 下载失败!")
+_net_bytes = 0 # 本进程从网络读取的字节数, 按阶段取差值得到各阶段下载量
+_net_bytes_lock = threading.Lock()
+_profile = None # install --profile 时收集各阶段记录
+_profile_started = 0.0
+_span_depth = 0
+
+def count_net_bytes(n):
+    global _net_bytes
+    with _net_bytes_lock:
+        _net_bytes += n
+
+# 计时区间: 结束时写一条带耗时和下载量的 span 记录 (AGSB_LOG_SPANS=1 时启用), --profile 时同时计入报告;
+# 区间内可向 yield 出的字典追加字段
+@contextmanager
+def log_span(name, **fields):
+    global _span_depth
+    start = time.perf_counter()
+    start_bytes = _net_bytes
+    depth = _span_depth
+    _span_depth += 1
+    status = "ok"
+    try:
+        yield fields
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _span_depth = depth
+        seconds = time.perf_counter() - start
+        moved = _net_bytes - start_bytes
+        if LOG_SPANS:
+            write_debug_log(f"span {name}", span=name, duration_ms=round(seconds * 1000, 1),
+                            bytes=moved, status=status, **fields)
+        if _profile is not None:
+            _profile.append({
+                "phase": name, "depth": depth, "start": round(start - _profile_started, 3),
+                "seconds": round(seconds, 3), "bytes": moved, "status": status, **fields,
+            })
+
+# 按终端显示宽度补齐 (中文字符占两列)
+def _pad(text, width, right=False):
+    fill = " " * max(0, width - sum(2 if unicodedata.east_asian_width(c) in "WF" else 1 for c in text))
+    return fill + text if right else text + fill
+
+def _format_bytes(n):
+    return f"{n / 1048576:.1f} MB" if n >= 1048576 else f"{n / 1024:.1f} KB" if n else "-"
+
+# install --profile: 记录各阶段耗时与下载量, 结束时(包括失败退出)写出 JSON 报告并打印汇总表
+@contextmanager
+def install_profile():
+    global _profile, _profile_started
+    _profile, _profile_started = [], time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        phases = sorted(_profile, key=lambda phase: (phase["start"], phase["depth"]))
+        _profile = None
+        total = time.perf_counter() - _profile_started
+        top_level = [phase for phase in phases if phase["depth"] == 0]
+        report = {
+            "generated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "host": platform.node(),
+            "platform": f"{platform.system().lower()}-{platform.machine().lower()}",
+            "python": platform.python_version(),
+            "status": status,
+            "total_seconds": round(total, 3),
+            "total_bytes": sum(phase["bytes"] for phase in top_level),
+            "phases": phases,
+        }
+        try:
+            INSTALL_DIR.mkdir(parents=True, exist_ok=True)
+            PROFILE_FILE.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        except OSError as e:
+            print(f"写入性能报告失败: {e}")
+        print("\n\033[36m安装阶段耗时:\033[0m")
+        rows = [("阶段", "耗时(秒)", "下载量", "状态")]
+        rows += [("  " * phase["depth"] + phase["phase"], f"{phase['seconds']:.2f}", _format_bytes(phase["bytes"]), phase["status"])
+                 for phase in phases]
+        rows.append(("(其他/交互输入)", f"{total - sum(phase['seconds'] for phase in top_level):.2f}", "", ""))
+        rows.append(("合计", f"{total:.2f}", _format_bytes(report["total_bytes"]), status))
+        for label, seconds, moved, phase_status in rows:
+            print(f"  {_pad(label, 20)}{_pad(seconds, 10, right=True)}{_pad(moved, 12, right=True)}  {phase_status}")
+        print(f"报告已保存: {PROFILE_FILE}")
+
+# 日志当前大小: 子进程以追加模式写日志, 启动前记下大小, 之后只从这个偏移开始查找本次运行的输出
+def log_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# 轮转仍被子进程以 O_APPEND 写入的日志: 复制为 .1 后原地截断, 子进程无需重新打开文件
+def rotate_copytruncate(path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return False
+    except OSError:
         return False
+    path = Path(path)
+    for i in range(backups - 1, 0, -1):
+        older = path.with_name(f"{path.name}.{i}")
+        if older.exists():
+            os.replace(older, path.with_name(f"{path.name}.{i + 1}"))
+    shutil.copyfile(path, path.with_name(f"{path.name}.1"))
+    os.truncate(path, 0)
+    return True
+
+# 读取二进制文件版本号 (例如 "cloudflared version 2024.6.1 (built ...)")
+def get_binary_version(binary_path):
+    try:
+        output = subprocess.run([str(binary_path), "--version"], capture_output=True, text=True, timeout=10).stdout
+        match = re.search(r'(\d+\.\d+\.\d+[\w.-]*)', output)
+        return match.group(1) if match else None
+    except Exception as e:
+        write_debug_log(f"读取版本号失败: {binary_path}, {e}")
+        return None
+
+# 解析单个优选地址: IP、域名、IP:端口、域名:端口 或 [IPv6]:端口, 未指定端口时为 443; 格式错误时抛出 ValueError
+def parse_edge_candidate(item):
+    item = item.strip()
+    if item.startswith("["):
+        host, sep, rest = item[1:].partition("]")
+        if not sep or (rest and not rest.startswith(":")):
+            raise ValueError(f"无效的地址: {item}")
+        port = rest[1:]
+    elif item.count(":") > 1: # 不带方括号的 IPv6 地址, 只能使用默认端口
+        host, port = item, ""
+    else:
+        host, _, port = item.partition(":")
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        if item.startswith("[") or not HOSTNAME_RE.fullmatch(host):
+            raise ValueError(f"无效的地址: {item}") from None
+    port = port or "443"
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"无效的端口: {item}")
+    return host, int(port), int(port) in CF_TLS_PORTS
+
+# 校验 --edge-ips 参数, 返回逗号分隔的各项; 任意一项无效时抛出 ValueError
+def split_edge_ips(text):
+    items = [item.strip() for item in text.split(",") if item.strip()]
+    if not items:
+        raise ValueError("没有有效的地址")
+    for item in items:
+        parse_edge_candidate(item)
+    return items
+
+def parse_edge_candidates(items):
+    edges = []
+    for item in items:
+        if not item.strip():
+            continue
+        try:
+            edges.append(parse_edge_candidate(item))
+        except ValueError as e: # 旧版本未校验写入的配置, 跳过无效项
+            write_debug_log(f"忽略优选地址: {e}", level=logging.WARNING)
+    return edges
+
+def edge_candidates(config=None):
+    if config is None:
+        config = read_config()
+    return parse_edge_candidates(config.get("edge_candidates") or DEFAULT_EDGE_CANDIDATES)
+
+# 对单个边缘地址做多次 TCP 连接 (及 TLS 握手) 测速
+def probe_edge(ip, port, tls, sni, attempts=EDGE_PROBE_ATTEMPTS, timeout=2.0):
+    tcp_times, tls_times = [], []
+    ctx = _ssl_context()
+    for _ in range(attempts):
+        try:
+            t0 = time.perf_counter()
+            with socket.create_connection((ip, port), timeout=timeout) as sock:
+                t1 = time.perf_counter()
+                if tls:
+                    with ctx.wrap_socket(sock, server_hostname=sni):
+                        tls_times.append((time.perf_counter() - t1) * 1000)
+            tcp_times.append((t1 - t0) * 1000)
+        except OSError:
+            pass
+    ok = len(tls_times) if tls else len(tcp_times)
+    tcp_ms = statistics.median(tcp_times) if tcp_times else None
+    tls_ms = statistics.median(tls_times) if tls_times else None
+    return {
+        "ip": ip, "port": port, "tls": tls,
+        "tcp_ms": round(tcp_ms, 1) if tcp_ms is not None else None,
+        "tls_ms": round(tls_ms, 1) if tls_ms is not None else None,
+        "latency_ms": round(tcp_ms + (tls_ms or 0), 1) if ok else None,
+        "loss": round(1 - ok / attempts, 2),
+    }
+
+# 并发测速所有候选地址, 结果写入缓存文件
+def run_edge_probe(edges, sni):
+    with ThreadPoolExecutor(max_workers=min(32, len(edges) or 1)) as pool:
+        results = list(pool.map(lambda edge: probe_edge(*edge, sni), edges))
+    EDGE_PROBE_FILE.write_text(json.dumps({"probed_at": time.time(), "results": results}, indent=2))
+    write_debug_log(f"优选IP测速完成: {results}")
+    return results
+
+# 返回用于生成节点的边缘地址: 有未过期测速结果时按 (丢包率, 延迟) 排序并剔除不可达地址, 否则保持候选顺序
+def ranked_edges():
+    edges = edge_candidates()
+    try:
+        cached = json.loads(EDGE_PROBE_FILE.read_text())
+    except (OSError, ValueError):
+        return edges
+    if time.time() - cached.get("probed_at", 0) > EDGE_PROBE_TTL:
+        return edges
+    measured = {(r["ip"], r["port"]): r for r in cached["results"] if r["latency_ms"] is not None}
+    if not measured: # 全部失败时多半是本机网络问题, 不做剔除
+        return edges
+    reachable = [edge for edge in edges if edge[:2] in measured]
+    return sorted(reachable, key=lambda edge: (measured[edge[:2]]["loss"], measured[edge[:2]]["latency_ms"]))
+
+def print_edge_probe(results):
+    print("\033[33m优选IP测速结果 (按丢包率和延迟排序):\033[0m")
+    print(f"  {'地址':<22}{'TCP(ms)':>9}{'TLS(ms)':>9}{'总延迟':>9}{'丢包':>7}")
+    ordered = sorted(results, key=lambda r: (r["loss"], r["latency_ms"] if r["latency_ms"] is not None else float("inf")))
+    for r in ordered:
+        fmt = lambda v: "-" if v is None else f"{v:.1f}"
+        print(f"  {uri_host(r['ip']) + ':' + str(r['port']):<22}{fmt(r['tcp_ms']):>9}{fmt(r['tls_ms']):>9}{fmt(r['latency_ms']):>9}{r['loss']:>7.0%}")
+
+# probe 命令: 测速并按结果重新生成节点链接
+def probe_edges_command(args):
+    state = read_state()
+    config = state["config"]
+    if not config:
+        print("\033[31m尚未安装，请先安装。\033[0m")
+        return
+    if args.edge_ips:
+        try:
+            config["edge_candidates"] = split_edge_ips(args.edge_ips)
+        except ValueError as e:
+            print(f"\033[31m--edge-ips 格式错误: {e}\033[0m")
+            return
+        with state_transaction() as state:
+            state["config"]["edge_candidates"] = config["edge_candidates"]
+    domains = state["domains"]
+    edges = edge_candidates(config)
+    print(f"正在测速 {len(edges)} 个优选IP (每个 {EDGE_PROBE_ATTEMPTS} 次)...")
+    print_edge_probe(run_edge_probe(edges, domains[0] if domains else "www.cloudflare.com"))
+    if domains:
+        generate_links(domains, config["port_vm_ws"], config["uuid_str"], quiet=True)
+        print("\033[32m节点链接已按测速结果重新排序，使用 cat 查看。\033[0m")
 
 # 生成VMess链接
 def generate_vmess_link(config):
@@ -153,108 +823,640 @@ def generate_vmess_link(config):
     vmess_b64 = base64.b64encode(vmess_str.encode('utf-8')).decode('utf-8').rstrip("=")
     return f"vmess://{vmess_b64}"
 
-# 生成链接
-# 生成链接
-# 生成链接
-def generate_links(domain, port_vm_ws, uuid_str):
-    write_debug_log(f"生成链接: domain={domain}, port_vm_ws={port_vm_ws}, uuid_str={uuid_str}")
+# 节点模型: 各种订阅格式都从同一组节点对象渲染
+@dataclass(frozen=True)
+class VmessNode:
+    name: str # 节点名 (ps)
+    label: str # 终端/列表文件中显示的简短名称
+    server: str
+    port: int
+    uuid: str
+    host: str # WebSocket Host 头 (隧道域名)
+    path: str # WebSocket 路径, 不含 ?ed 参数
+    tls: bool
+    early_data: int = 2048
+    multiplex: bool = False # 服务端入站开启了多路复用 (throughput 配置档), 客户端需同样开启才生效
+
+    def vmess_config(self):
+        config = {
+            "ps": self.name, "add": self.server, "port": str(self.port), "id": self.uuid, "aid": "0",
+            "net": "ws", "type": "none", "host": self.host,
+            "path": f"{self.path}?ed={self.early_data}" if self.early_data else self.path,
+            "tls": "tls" if self.tls else "",
+        }
+        if self.tls:
+            config["sni"] = self.host
+        return config
+
+    def uri(self):
+        return generate_vmess_link(self.vmess_config())
+
+    def clash_proxy(self):
+        q = json.dumps # JSON 字符串同时也是合法的 YAML 标量
+        opts = f"path: {q(self.path)}, headers: {{Host: {q(self.host)}}}"
+        if self.early_data:
+            opts += f", max-early-data: {self.early_data}, early-data-header-name: Sec-WebSocket-Protocol"
+        tls = f", tls: true, servername: {q(self.host)}" if self.tls else ", tls: false"
+        smux = f", smux: {{enabled: true, protocol: smux, max-connections: {MUX_MAX_CONNECTIONS}}}" if self.multiplex else ""
+        return (f"{{name: {q(self.name)}, type: vmess, server: {q(self.server)}, port: {self.port}, "
+                f"uuid: {q(self.uuid)}, alterId: 0, cipher: auto, udp: true{tls}, network: ws, ws-opts: {{{opts}}}{smux}}}")
+
+    def singbox_outbound(self):
+        transport = {"type": "ws", "path": self.path, "headers": {"Host": self.host}}
+        if self.early_data:
+            transport.update(max_early_data=self.early_data, early_data_header_name="Sec-WebSocket-Protocol")
+        outbound = {
+            "type": "vmess", "tag": self.name, "server": self.server, "server_port": self.port,
+            "uuid": self.uuid, "security": "auto", "alter_id": 0, "transport": transport,
+        }
+        if self.tls:
+            outbound["tls"] = {"enabled": True, "server_name": self.host}
+        if self.multiplex:
+            outbound["multiplex"] = {"enabled": True, "protocol": "smux", "max_connections": MUX_MAX_CONNECTIONS}
+        return outbound
+
+# 链接中的主机部分, IPv6 地址需加方括号
+def uri_host(server):
+    return f"[{server}]" if ":" in server else server
+
+@dataclass(frozen=True)
+class VlessRealityNode:
+    name: str
+    label: str
+    server: str
+    port: int
+    uuid: str
+    sni: str
+    public_key: str
+    short_id: str
+
+    def uri(self):
+        return (f"vless://{self.uuid}@{uri_host(self.server)}:{self.port}?encryption=none&flow=xtls-rprx-vision"
+                f"&security=reality&sni={self.sni}&fp=chrome&pbk={self.public_key}&sid={self.short_id}&type=tcp#{self.name}")
+
+    def clash_proxy(self):
+        q = json.dumps
+        return (f"{{name: {q(self.name)}, type: vless, server: {q(self.server)}, port: {self.port}, uuid: {q(self.uuid)}, "
+                f"network: tcp, udp: true, tls: true, flow: xtls-rprx-vision, servername: {q(self.sni)}, "
+                f"client-fingerprint: chrome, reality-opts: {{public-key: {q(self.public_key)}, short-id: {q(self.short_id)}}}}}")
+
+    def singbox_outbound(self):
+        return {
+            "type": "vless", "tag": self.name, "server": self.server, "server_port": self.port,
+            "uuid": self.uuid, "flow": "xtls-rprx-vision",
+            "tls": {"enabled": True, "server_name": self.sni, "utls": {"enabled": True, "fingerprint": "chrome"},
+                    "reality": {"enabled": True, "public_key": self.public_key, "short_id": self.short_id}},
+        }
 
-    ws_path = f"/{uuid_str[:8]}-vm" # 使用UUID前8位作为路径一部分，增加一点变化性
-    ws_path_full = f"{ws_path}?ed=2048"
-    write_debug_log(f"WebSocket路径: {ws_path_full}")
+@dataclass(frozen=True)
+class Hysteria2Node:
+    name: str
+    label: str
+    server: str
+    port: int
+    password: str
+    sni: str = TLS_SNI
+
+    def uri(self):
+        return f"hysteria2://{self.password}@{uri_host(self.server)}:{self.port}?sni={self.sni}&alpn=h3&insecure=1#{self.name}"
+
+    def clash_proxy(self):
+        q = json.dumps
+        return (f"{{name: {q(self.name)}, type: hysteria2, server: {q(self.server)}, port: {self.port}, "
+                f"password: {q(self.password)}, sni: {q(self.sni)}, alpn: [h3], skip-cert-verify: true}}")
+
+    def singbox_outbound(self):
+        return {
+            "type": "hysteria2", "tag": self.name, "server": self.server, "server_port": self.port,
+            "password": self.password,
+            "tls": {"enabled": True, "server_name": self.sni, "insecure": True, "alpn": ["h3"]},
+        }
+
+@dataclass(frozen=True)
+class TuicNode:
+    name: str
+    label: str
+    server: str
+    port: int
+    uuid: str
+    password: str
+    sni: str = TLS_SNI
+
+    def uri(self):
+        return (f"tuic://{self.uuid}:{self.password}@{uri_host(self.server)}:{self.port}?congestion_control=bbr"
+                f"&udp_relay_mode=native&alpn=h3&sni={self.sni}&allow_insecure=1#{self.name}")
+
+    def clash_proxy(self):
+        q = json.dumps
+        return (f"{{name: {q(self.name)}, type: tuic, server: {q(self.server)}, port: {self.port}, uuid: {q(self.uuid)}, "
+                f"password: {q(self.password)}, alpn: [h3], congestion-controller: bbr, udp-relay-mode: native, "
+                f"sni: {q(self.sni)}, skip-cert-verify: true}}")
+
+    def singbox_outbound(self):
+        return {
+            "type": "tuic", "tag": self.name, "server": self.server, "server_port": self.port,
+            "uuid": self.uuid, "password": self.password, "congestion_control": "bbr", "udp_relay_mode": "native",
+            "tls": {"enabled": True, "server_name": self.sni, "insecure": True, "alpn": ["h3"]},
+        }
+
+# 读取配置中的性能配置档, 未设置或无效时使用默认档
+def perf_profile(config):
+    name = config.get("perf_profile") or DEFAULT_PERF_PROFILE
+    if name not in PERF_PROFILES:
+        name = DEFAULT_PERF_PROFILE
+    return name, PERF_PROFILES[name]
 
+# 构建节点 (不写文件、不输出)
+def build_nodes(domains, uuid_str, early_data=PERF_PROFILES[DEFAULT_PERF_PROFILE]["early_data"], multiplex=False):
+    ws_path = f"/{uuid_str[:8]}-vm" # 使用UUID前8位作为路径一部分，增加一点变化性
     hostname = socket.gethostname()[:10] # 限制主机名长度
-    all_links = []
-    link_names = []
-    link_configs_for_json_output = [] # 用于未来可能的JSON输出
-
-    # Cloudflare优选IP和端口
-    cf_ips_tls = {
-        "104.16.0.0": "443", "104.17.0.0": "8443", "104.18.0.0": "2053",
-        "104.19.0.0": "2083", "104.20.0.0": "2087"
-    }
-    cf_ips_http = {
-        "104.21.0.0": "80", "104.22.0.0": "8080", "104.24.0.0": "8880"
-    }
+    nodes = []
+
+    # Cloudflare优选IP和端口 (有测速结果时按延迟排序并剔除不可达地址)
+    edges = ranked_edges()
+    cf_ips_tls = [(ip, port) for ip, port, tls in edges if tls]
+    cf_ips_http = [(ip, port) for ip, port, tls in edges if not tls]
+
+    for shard, shard_domain in enumerate(domains):
+        # 多实例时在节点名中标出分片序号
+        tag = f"-S{shard}" if len(domains) > 1 else ""
+        common = {"uuid": uuid_str, "host": shard_domain, "path": ws_path, "early_data": early_data, "multiplex": multiplex}
+
+        # === TLS节点 ===
+        for ip, port_cf in cf_ips_tls:
+            nodes.append(VmessNode(f"VMWS-TLS-{hostname}{tag}-{ip}-{port_cf}", f"TLS{tag}-{port_cf}-{ip}",
+                                   ip, port_cf, tls=True, **common))
+        # === 非TLS节点 ===
+        for ip, port_cf in cf_ips_http:
+            nodes.append(VmessNode(f"VMWS-HTTP-{hostname}{tag}-{ip}-{port_cf}", f"HTTP{tag}-{port_cf}-{ip}",
+                                   ip, port_cf, tls=False, **common))
+        # === 直接使用域名和标准端口的节点 ===
+        nodes.append(VmessNode(f"VMWS-TLS-{hostname}{tag}-Direct-{shard_domain[:15]}-443", f"TLS{tag}-Direct-{shard_domain}-443",
+                               shard_domain, 443, tls=True, **common))
+        nodes.append(VmessNode(f"VMWS-HTTP-{hostname}{tag}-Direct-{shard_domain[:15]}-80", f"HTTP{tag}-Direct-{shard_domain}-80",
+                               shard_domain, 80, tls=False, **common))
+    return nodes
+
+# 订阅格式渲染器注册表: 格式名 -> (渲染函数, Content-Type)
+RENDERERS = {}
+
+def register_renderer(name, content_type="text/plain; charset=utf-8"):
+    def decorator(func):
+        RENDERERS[name] = (func, content_type)
+        return func
+    return decorator
+
+# 各节点类型都提供 uri() / clash_proxy() / singbox_outbound(), 渲染器与协议无关
+@register_renderer("vmess") # 历史名称: 每行一个分享链接, 包含所有已启用协议
+def render_uris(nodes):
+    return "\n".join(node.uri() for node in nodes) + "\n"
+
+@register_renderer("base64")
+def render_base64(nodes):
+    return base64.b64encode(render_uris(nodes).rstrip("\n").encode()).decode()
+
+@register_renderer("clash", "text/yaml; charset=utf-8")
+def render_clash(nodes):
+    q = json.dumps # JSON 字符串同时也是合法的 YAML 标量
+    lines = ["proxies:"]
+    for node in nodes:
+        lines.append(f"  - {node.clash_proxy()}")
+    lines.append("proxy-groups:")
+    lines.append(f"  - {{name: ArgoSB, type: select, proxies: [{', '.join(q(node.name) for node in nodes)}]}}")
+    lines.append("rules:")
+    lines.append("  - MATCH,ArgoSB")
+    return "\n".join(lines) + "\n"
+
+@register_renderer("singbox", "application/json")
+def render_singbox(nodes):
+    outbounds = [node.singbox_outbound() for node in nodes]
+    return json.dumps({"outbounds": outbounds}, indent=2, ensure_ascii=False)
+
+# 协议后端注册表: 名称 -> 后端实例 (按注册顺序生成入站和节点)
+BACKENDS = {}
+
+def register_backend(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls()
+        return cls
+    return decorator
+
+class Backend:
+    """协议后端: install/reload 的参数收集、sing-box 入站、就绪检查、节点链接都由后端自己提供"""
+    name = ""
+    title = "" # 显示名称
+    tunnel = False # 是否经 cloudflared 隧道对外提供服务
+    port_env = None # 端口环境变量 (与 argosb 脚本一致), 设置后即启用该后端
+    port_key = None # 配置中的端口字段
+
+    def configure(self, args, config):
+        """收集参数写入 config (在下载二进制之前执行); 已有的值保持不变"""
+
+    def prepare(self, config):
+        """生成依赖 sing-box/openssl 的密钥和证书 (在下载之后执行)"""
+
+    def inbounds(self, config, settings):
+        return []
+
+    def probes(self, config):
+        """就绪检查: 名称 -> 无参函数, 返回 True 表示就绪"""
+        return {}
+
+    def nodes(self, config, domains):
+        return []
+
+    def describe(self, config, domains):
+        """节点信息摘要中的 (标题, 值) 行"""
+        return []
+
+# 读取配置中启用的后端, 旧版配置没有 backends 字段时只有 vmess-argo
+def enabled_backends(config):
+    return [BACKENDS[name] for name in config.get("backends") or DEFAULT_BACKENDS if name in BACKENDS]
+
+def uses_tunnel(config):
+    return any(backend.tunnel for backend in enabled_backends(config))
+
+# 从 --backends 与端口环境变量 (vlpt/hypt/tupt) 解析要启用的后端, 保持注册顺序
+def select_backends(args):
+    if args.backends:
+        names = {name.strip() for name in args.backends.split(",") if name.strip()}
+    else:
+        names = set(DEFAULT_BACKENDS) | {b.name for b in BACKENDS.values() if b.port_env and b.port_env in os.environ}
+    unknown = names - set(BACKENDS)
+    if unknown:
+        print(f"\033[31m未知的协议后端: {', '.join(sorted(unknown))} (可选: {', '.join(BACKENDS)})\033[0m")
+        sys.exit(1)
+    return [name for name in BACKENDS if name in names]
 
-    # === TLS节点 ===
-    for ip, port_cf in cf_ips_tls.items():
-        ps_name = f"VMWS-TLS-{hostname}-{ip.split('.')[2]}-{port_cf}"
-        config = {
-            "ps": ps_name, "add": ip, "port": port_cf, "id": uuid_str, "aid": "0",
-            "net": "ws", "type": "none", "host": domain, "path": ws_path_full,
-            "tls": "tls", "sni": domain
-        }
-        all_links.append(generate_vmess_link(config))
-        link_names.append(f"TLS-{port_cf}-{ip}")
-        link_configs_for_json_output.append(config)
+@register_backend("vmess-argo")
+class VmessArgoBackend(Backend):
+    title = "VMess-WS-Argo"
+    tunnel = True
+    port_env = "vmpt"
+    port_key = "port_vm_ws"
 
-    # === 非TLS节点 ===
-    for ip, port_cf in cf_ips_http.items():
-        ps_name = f"VMWS-HTTP-{hostname}-{ip.split('.')[2]}-{port_cf}"
-        config = {
-            "ps": ps_name, "add": ip, "port": port_cf, "id": uuid_str, "aid": "0",
-            "net": "ws", "type": "none", "host": domain, "path": ws_path_full,
-            "tls": "" # 非TLS，此项为空
-        }
-        all_links.append(generate_vmess_link(config))
-        link_names.append(f"HTTP-{port_cf}-{ip}")
-        link_configs_for_json_output.append(config)
-    
-    # === 直接使用域名和标准端口的节点 ===
-    # TLS Direct
-    direct_tls_config = {
-        "ps": f"VMWS-TLS-{hostname}-Direct-{domain[:15]}-443", 
-        "add": domain, "port": "443", "id": uuid_str, "aid": "0",
-        "net": "ws", "type": "none", "host": domain, "path": ws_path_full,
-        "tls": "tls", "sni": domain
-    }
-    all_links.append(generate_vmess_link(direct_tls_config))
-    link_names.append(f"TLS-Direct-{domain}-443")
-    link_configs_for_json_output.append(direct_tls_config)
-
-    # HTTP Direct
-    direct_http_config = {
-        "ps": f"VMWS-HTTP-{hostname}-Direct-{domain[:15]}-80",
-        "add": domain, "port": "80", "id": uuid_str, "aid": "0",
-        "net": "ws", "type": "none", "host": domain, "path": ws_path_full,
-        "tls": ""
-    }
-    all_links.append(generate_vmess_link(direct_http_config))
-    link_names.append(f"HTTP-Direct-{domain}-80")
-    link_configs_for_json_output.append(direct_http_config)
-
-    # 保存所有链接到文件
-    (INSTALL_DIR / "allnodes.txt").write_text("\n".join(all_links) + "\n")
-    (INSTALL_DIR / "jh.txt").write_text("\n".join(all_links) + "\n") 
-
-    # 保存域名到文件
-    CUSTOM_DOMAIN_FILE.write_text(domain)
-
-    # 创建LIST_FILE (带颜色) - 这个文件主要用于 status 命令
-    list_content_color_file = [] # 使用不同的变量名以避免混淆
-    list_content_color_file.append("\033[36m╭───────────────────────────────────────────────────────────────╮\033[0m")
-    list_content_color_file.append("\033[36m│                \033[33m✨ ArgoSB 节点信息 ✨                   \033[36m│\033[0m")
-    list_content_color_file.append("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-    list_content_color_file.append(f"\033[36m│ \033[32m域名 (Domain): \033[0m{domain}")
-    list_content_color_file.append(f"\033[36m│ \033[32mUUID: \033[0m{uuid_str}")
-    list_content_color_file.append(f"\033[36m│ \033[32m本地Vmess端口 (Local VMess Port): \033[0m{port_vm_ws}")
-    list_content_color_file.append(f"\033[36m│ \033[32mWebSocket路径 (WS Path): \033[0m{ws_path_full}")
-    list_content_color_file.append("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-    list_content_color_file.append("\033[36m│ \033[33m所有节点列表 (All Nodes - 详细信息见 status 或 cat):\033[0m")
-    for i, (link, name) in enumerate(zip(all_links, link_names)):
-        list_content_color_file.append(f"\033[36m│ \033[32m{i+1}. {name}:\033[0m")
-        list_content_color_file.append(f"\033[36m│ \033[0m{link}")
-        if i < len(all_links) -1 :
-             list_content_color_file.append("\033[36m│ \033[0m") # 在文件内为了可读性，节点间加空行
-    list_content_color_file.append("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-    list_content_color_file.append("\033[36m│ \033[33m使用方法 (Usage):\033[0m")
-    list_content_color_file.append("\033[36m│ \033[32m查看节点: \033[0mpython3 " + os.path.basename(__file__) + " status")
-    list_content_color_file.append("\033[36m│ \033[32m单行节点: \033[0mpython3 " + os.path.basename(__file__) + " cat")
-    list_content_color_file.append("\033[36m│ \033[32m升级脚本: \033[0mpython3 " + os.path.basename(__file__) + " update")
-    list_content_color_file.append("\033[36m│ \033[32m卸载脚本: \033[0mpython3 " + os.path.basename(__file__) + " del")
-    list_content_color_file.append("\033[36m╰───────────────────────────────────────────────────────────────╯\033[0m")
-    LIST_FILE.write_text("\n".join(list_content_color_file) + "\n")
+    def configure(self, args, config):
+        # 分片实例数 (instances)
+        try:
+            instances = args.instances or int(os.environ.get("instances") or 1)
+        except ValueError:
+            instances = 1
+        if not (1 <= instances <= 64):
+            print("实例数无效 (1-64)，将使用单实例。")
+            instances = 1
+        max_port = 65535 - (instances - 1) # 为后续分片预留连续端口
+
+        # Vmess Port (vmpt)
+        port_vm_ws_str = str(args.vmpt) if args.vmpt else os.environ.get("vmpt")
+        if not port_vm_ws_str:
+            port_vm_ws_str = input(f"请输入自定义Vmess端口 (例如: 49999, 10000-{max_port}, 留空则随机生成): ").strip()
+
+        if port_vm_ws_str:
+            try:
+                port_vm_ws = int(port_vm_ws_str)
+                if not (10000 <= port_vm_ws <= max_port):
+                    print("端口号无效，将使用随机端口。")
+                    port_vm_ws = random.randint(10000, max_port)
+            except ValueError:
+                print("端口输入非数字，将使用随机端口。")
+                port_vm_ws = random.randint(10000, max_port)
+        else:
+            port_vm_ws = random.randint(10000, max_port)
+        if instances > 1:
+            print(f"使用 Vmess 本地端口: {port_vm_ws}-{port_vm_ws + instances - 1} ({instances} 个分片)")
+        else:
+            print(f"使用 Vmess 本地端口: {port_vm_ws}")
+        write_debug_log(f"Vmess Port: {port_vm_ws}, instances: {instances}")
+
+        # Argo Tunnel Token (agk)
+        argo_token = args.agk or os.environ.get("agk")
+        if not argo_token:
+            argo_token_input = input("请输入 Argo Tunnel Token (AGK) (例如: eyJhIjo...Ifs9, 若使用Cloudflare Zero Trust隧道请输入, 留空则使用临时隧道): ").strip()
+            argo_token = argo_token_input or None # None if empty
+        if argo_token:
+            print(f"使用 Argo Tunnel Token: ******{argo_token[-6:]}") # 仅显示末尾几位
+            write_debug_log(f"Argo Token: Present (not logged for security)")
+        else:
+            print("未提供 Argo Tunnel Token，将使用临时隧道 (Quick Tunnel)。")
+            write_debug_log("Argo Token: Not provided, using Quick Tunnel.")
+
+        # Custom Domain (agn)
+        custom_domain = args.agn or os.environ.get("agn")
+        if not custom_domain:
+            domain_prompt = "请输入自定义域名 (例如: test.zmkk.fun"
+            if argo_token:
+                domain_prompt += ", 必须是与Argo Token关联的域名"
+            else:
+                domain_prompt += ", 或留空以自动获取 trycloudflare.com 域名"
+            domain_prompt += "): "
+            custom_domain_input = input(domain_prompt).strip()
+            custom_domain = custom_domain_input or None
+
+        if custom_domain:
+            print(f"使用自定义域名: {custom_domain}")
+            write_debug_log(f"Custom Domain (agn): {custom_domain}")
+        elif argo_token: # 如果用了token，必须提供域名
+            print("\033[31m错误: 使用 Argo Tunnel Token 时必须提供自定义域名 (agn/--domain)。\033[0m")
+            sys.exit(1)
+        else:
+            print("未提供自定义域名，将尝试在隧道启动后自动获取。")
+            write_debug_log("Custom Domain (agn): Not provided, will attempt auto-detection.")
+
+        config.update({
+            "port_vm_ws": port_vm_ws,
+            "argo_token": argo_token, # Will be None if not provided
+            "custom_domain_agn": custom_domain, # Will be None if not provided
+            "instances": instances,
+            "cf_metrics_ports": [find_free_port() for _ in range(instances)], # 各分片 cloudflared 指标/就绪检查端口 (仅监听127.0.0.1)
+        })
+
+    def inbounds(self, config, settings):
+        ws_path = f"/{config['uuid_str'][:8]}-vm" # 和 generate_links 中的路径保持一致
+        # 每个分片一个入站 (端口依次递增), 各由独立的 cloudflared 进程转发
+        inbounds = []
+        for shard, shard_port, _ in shard_layout(config):
+            inbound = {
+                "type": "vmess", "tag": "vmess-in" if shard == 0 else f"vmess-in-{shard}", "listen": "127.0.0.1",
+                "listen_port": shard_port, "tcp_fast_open": settings["tcp_fast_open"], "sniff": settings["sniff"],
+                "sniff_override_destination": settings["sniff"], "proxy_protocol": False, # No proxy protocol from local cloudflared
+                "users": [{"uuid": config["uuid_str"], "alterId": 0}], # alterId 0 is common now
+                "transport": {
+                    "type": "ws", "path": ws_path,
+                    "max_early_data": settings["early_data"], "early_data_header_name": "Sec-WebSocket-Protocol"
+                }
+            }
+            if settings["multiplex"]: # 接受客户端的多路复用连接, 未开启多路复用的客户端不受影响
+                inbound["multiplex"] = {"enabled": True, "padding": False}
+            inbounds.append(inbound)
+        return inbounds
+
+    def probes(self, config):
+        ws_path = f"/{config['uuid_str'][:8]}-vm"
+        probes = {}
+        for shard, shard_port, metrics_port in shard_layout(config):
+            probes[f"sing-box:{shard_port}"] = lambda port=shard_port: probe_sing_box(port, ws_path)
+            if metrics_port:
+                probes[cf_service_name(shard)] = lambda port=metrics_port: probe_cloudflared(port)
+        return probes
+
+    def nodes(self, config, domains):
+        settings = perf_profile(config)[1]
+        return build_nodes(domains, config["uuid_str"], settings["early_data"], settings["multiplex"])
+
+    def describe(self, config, domains):
+        port_vm_ws = config["port_vm_ws"]
+        port_display = f"{port_vm_ws}-{port_vm_ws + len(domains) - 1}" if len(domains) > 1 else port_vm_ws
+        early_data = perf_profile(config)[1]["early_data"] # 链接的 ?ed= 与 sing-box 入站的 max_early_data 一致
+        ws_path_full = f"/{config['uuid_str'][:8]}-vm" + (f"?ed={early_data}" if early_data else "")
+        return [("域名 (Domain)", ", ".join(domains)), ("本地Vmess端口 (Local VMess Port)", port_display),
+                ("WebSocket路径 (WS Path)", ws_path_full)]
+
+# 自动检测公网IP (直连协议的节点地址), 优先 IPv4
+def detect_public_ip():
+    for url in ("https://api.ipify.org", "https://api64.ipify.org"):
+        ip = (http_get(url, timeout=5) or "").strip()
+        if ip:
+            return ip
+    return None
+
+# 生成自签证书 (hysteria2 / tuic 共用), 优先 openssl, 没有时使用 sing-box 自带的生成器
+def ensure_tls_cert():
+    if TLS_CERT_FILE.exists() and TLS_KEY_FILE.exists():
+        return
+    try:
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                        "-keyout", str(TLS_KEY_FILE), "-out", str(TLS_CERT_FILE), "-days", "36500", "-nodes",
+                        "-subj", f"/CN={TLS_SNI}"], check=True, capture_output=True, timeout=30)
+    except (OSError, subprocess.SubprocessError) as e:
+        write_debug_log(f"openssl 生成证书失败, 改用 sing-box: {e}")
+        output = subprocess.run([str(INSTALL_DIR / "sing-box"), "generate", "tls-keypair", TLS_SNI, "-m", "1200"],
+                                check=True, capture_output=True, text=True, timeout=30).stdout
+        for pem in re.finditer(r"-----BEGIN ([A-Z ]+)-----.*?-----END \1-----\n?", output, re.S):
+            (TLS_CERT_FILE if pem.group(1) == "CERTIFICATE" else TLS_KEY_FILE).write_text(pem.group(0))
+    os.chmod(TLS_KEY_FILE, 0o600)
+    print(f"已生成自签证书: {TLS_CERT_FILE} (CN={TLS_SNI})")
+
+class DirectBackend(Backend):
+    """直接监听公网端口的后端: 端口来自环境变量或随机生成, 节点地址为服务器公网IP"""
+
+    def configure(self, args, config):
+        if not config.get(self.port_key):
+            port = os.environ.get(self.port_env, "")
+            config[self.port_key] = int(port) if port.isdigit() and 1 <= int(port) <= 65535 else random.randint(10000, 65535)
+        print(f"使用 {self.title} 端口: {config[self.port_key]}")
+        if not config.get("server_ip"):
+            config["server_ip"] = args.server_ip or os.environ.get("serip") or detect_public_ip()
+            if not config["server_ip"]:
+                print(f"\033[31m错误: 无法检测公网IP，请使用 --server-ip 指定 {self.title} 节点地址。\033[0m")
+                sys.exit(1)
+            print(f"直连节点地址: {config['server_ip']}")
+
+    def node_name(self, config):
+        return f"{self.title}-{socket.gethostname()[:10]}-{config[self.port_key]}"
+
+    def describe(self, config, domains):
+        return [(f"{self.title}端口", config[self.port_key])]
+
+@register_backend("vless-reality")
+class VlessRealityBackend(DirectBackend):
+    title = "VLESS-Reality"
+    port_env = "vlpt"
+    port_key = "port_vl_re"
+
+    def prepare(self, config):
+        if config.get("reality_private_key"):
+            return
+        output = subprocess.run([str(INSTALL_DIR / "sing-box"), "generate", "reality-keypair"],
+                                check=True, capture_output=True, text=True, timeout=30).stdout
+        keys = dict(re.findall(r"(\w+):\s*(\S+)", output)) # PrivateKey: ... / PublicKey: ...
+        config.update({
+            "reality_private_key": keys["PrivateKey"], "reality_public_key": keys["PublicKey"],
+            "reality_short_id": os.urandom(4).hex(), "reality_sni": REALITY_SNI,
+        })
+
+    def inbounds(self, config, settings):
+        return [{
+            "type": "vless", "tag": "vless-in", "listen": "::", "listen_port": config[self.port_key],
+            "tcp_fast_open": settings["tcp_fast_open"], "sniff": settings["sniff"],
+            "sniff_override_destination": settings["sniff"],
+            "users": [{"uuid": config["uuid_str"], "flow": "xtls-rprx-vision"}],
+            "tls": {
+                "enabled": True, "server_name": config["reality_sni"],
+                "reality": {
+                    "enabled": True, "handshake": {"server": config["reality_sni"], "server_port": 443},
+                    "private_key": config["reality_private_key"], "short_id": [config["reality_short_id"]],
+                },
+            },
+        }]
+
+    def probes(self, config):
+        port = config[self.port_key]
+        return {f"sing-box:{port}": lambda: probe_tcp_port(port)}
+
+    def nodes(self, config, domains):
+        return [VlessRealityNode(self.node_name(config), f"{self.title}-{config['server_ip']}", config["server_ip"],
+                                 config[self.port_key], config["uuid_str"], config["reality_sni"],
+                                 config["reality_public_key"], config["reality_short_id"])]
+
+    def describe(self, config, domains):
+        return super().describe(config, domains) + [("Reality 公钥 / SNI", f"{config['reality_public_key']} / {config['reality_sni']}")]
+
+@register_backend("hysteria2")
+class Hysteria2Backend(DirectBackend):
+    title = "Hysteria2"
+    port_env = "hypt"
+    port_key = "port_hy2"
+
+    def prepare(self, config):
+        ensure_tls_cert()
+
+    def inbounds(self, config, settings):
+        return [{
+            "type": "hysteria2", "tag": "hy2-in", "listen": "::", "listen_port": config[self.port_key],
+            "sniff": settings["sniff"], "sniff_override_destination": settings["sniff"],
+            "users": [{"password": config["uuid_str"]}],
+            "tls": {"enabled": True, "alpn": ["h3"], "certificate_path": str(TLS_CERT_FILE), "key_path": str(TLS_KEY_FILE)},
+        }]
+
+    def nodes(self, config, domains):
+        return [Hysteria2Node(self.node_name(config), f"{self.title}-{config['server_ip']}", config["server_ip"],
+                              config[self.port_key], config["uuid_str"])]
+
+@register_backend("tuic")
+class TuicBackend(DirectBackend):
+    title = "TUIC"
+    port_env = "tupt"
+    port_key = "port_tu"
+
+    def prepare(self, config):
+        ensure_tls_cert()
+
+    def inbounds(self, config, settings):
+        return [{
+            "type": "tuic", "tag": "tuic-in", "listen": "::", "listen_port": config[self.port_key],
+            "sniff": settings["sniff"], "sniff_override_destination": settings["sniff"],
+            "users": [{"uuid": config["uuid_str"], "password": config["uuid_str"]}],
+            "congestion_control": "bbr",
+            "tls": {"enabled": True, "alpn": ["h3"], "certificate_path": str(TLS_CERT_FILE), "key_path": str(TLS_KEY_FILE)},
+        }]
+
+    def nodes(self, config, domains):
+        return [TuicNode(self.node_name(config), f"{self.title}-{config['server_ip']}", config["server_ip"],
+                         config[self.port_key], config["uuid_str"], config["uuid_str"])]
+
+# 所有已启用后端的节点 (vmess-argo 在前, 与原有链接顺序一致)
+def build_all_nodes(config, domains):
+    return [node for backend in enabled_backends(config) for node in backend.nodes(config, domains)]
+
+# 读取状态存储 (未安装时 config 为空); 旧版本的分散文件和无版本号的快照在这里迁移,
+# 迁移结果在下一次 write_state 时落盘
+def read_state():
+    state = load_state()
+    if state is not None:
+        return state
+    try:
+        old = json.loads(STATE_FILE.read_text())
+    except (OSError, ValueError):
+        old = {}
+    state = {"version": STATE_VERSION, "config": old.get("config") or {}, "domains": old.get("domains") or [],
+             "links": old.get("links") or []}
+    for key in ("generated_at", "uuid", "backends", "tunnel"):
+        if key in old:
+            state[key] = old[key]
+    try:
+        if CONFIG_FILE.exists() and not state["config"]:
+            state["config"] = json.loads(CONFIG_FILE.read_text())
+        if CUSTOM_DOMAIN_FILE.exists() and not state["domains"]:
+            state["domains"] = CUSTOM_DOMAIN_FILE.read_text().split()
+        if (INSTALL_DIR / "allnodes.txt").exists() and not state["links"]:
+            state["links"] = (INSTALL_DIR / "allnodes.txt").read_text().split()
+        pids = [path.read_text().strip() for path in (SB_PID_FILE, ARGO_PID_FILE) if path.exists()]
+    except (OSError, ValueError) as e:
+        write_debug_log(f"迁移旧版状态文件失败: {e}", level=logging.WARNING)
+        pids = []
+    if any(pids):
+        state["legacy_pids"] = [pid for pid in pids if pid]
+    return state
+
+def read_config():
+    return read_state()["config"]
+
+# 原子写入状态存储: 写临时文件并 fsync 后 rename, 中途崩溃时旧文件保持完整; 之后删除已迁移的旧版文件
+def write_state(state):
+    tmp_path = STATE_FILE.with_name(f".{STATE_FILE.name}.{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, STATE_FILE)
+    for path in LEGACY_STATE_FILES:
+        path.unlink(missing_ok=True)
+
+# 状态存储的读-改-写事务: 持有文件锁 (命令行与守护进程可能同时写入), 正常退出时整体写回
+@contextmanager
+def state_transaction():
+    INSTALL_DIR.mkdir(parents=True, exist_ok=True)
+    with open(STATE_LOCK, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = read_state()
+        yield state
+        write_state(state)
+
+# 旧版本安装: 把分散的文件迁移进状态存储, 之后 cat/status 即可走快速路径
+def ensure_state():
+    if load_state() is None and read_config():
+        with state_transaction():
+            pass # read_state 完成迁移, 事务结束时写回
+
+# 生成 cat/status 快速入口: 预编译安装目录内的脚本副本, 省去每次启动时编译整个脚本
+# (单是编译就占去约一半的启动时间); 状态快照不存在时入口退回完整脚本
+def create_fast_launcher():
+    import py_compile
+    try:
+        py_compile.compile(str(SUPERVISOR_SCRIPT), cfile=str(FAST_PYC), doraise=True)
+    except (py_compile.PyCompileError, OSError) as e:
+        write_debug_log(f"预编译快速入口失败: {e}", level=logging.WARNING)
+        return
+    FAST_LAUNCHER.write_text(f"""#!/bin/sh
+case "$1" in
+    cat|status) [ -f "{STATE_FILE}" ] && exec "{sys.executable}" "{FAST_PYC}" "$@" ;;
+esac
+exec "{sys.executable}" "{SUPERVISOR_SCRIPT}" "$@"
+""")
+    os.chmod(FAST_LAUNCHER, 0o755)
+
+# 生成链接
+def generate_links(domain, port_vm_ws, uuid_str, quiet=False):
+    # domain 可以是单个域名, 也可以是按分片顺序排列的域名列表 (--instances 多实例模式)
+    domains = [domain] if isinstance(domain, str) else list(domain)
+    domain = ", ".join(domains)
+    write_debug_log(f"生成链接: domain={domain}, port_vm_ws={port_vm_ws}, uuid_str={uuid_str}")
+
+    config = dict(read_config())
+    config.setdefault("uuid_str", uuid_str)
+    config.setdefault("port_vm_ws", port_vm_ws)
+    nodes = build_all_nodes(config, domains)
+    all_links = render_uris(nodes).split()
+    link_names = [node.label for node in nodes]
+    # 摘要行: UUID 之外的信息由各后端提供 (域名/端口/路径/公钥等)
+    summary = [("UUID", uuid_str)] + [row for backend in enabled_backends(config) for row in backend.describe(config, domains)]
+    write_debug_log(f"节点摘要: {summary}")
+
+    # 链接、域名和摘要与配置一起写入状态存储, cat/status 的快速路径只读取它
+    with state_transaction() as state:
+        state.update({
+            "generated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "uuid": uuid_str,
+            "backends": [backend.name for backend in enabled_backends(config)],
+            "tunnel": uses_tunnel(config),
+            "domains": domains,
+            "links": all_links,
+        })
+
+    if quiet: # 守护进程在隧道重连后刷新链接时不输出到终端
+        write_debug_log(f"节点链接已更新 (domain={domain})")
+        return True
 
     # ******** 终端输出部分 ********
 
@@ -262,10 +1464,8 @@ def generate_links(domain, port_vm_ws, uuid_str):
     print("\033[36m╭───────────────────────────────────────────────────────────────╮\033[0m")
     print("\033[36m│                \033[33m✨ ArgoSB 安装成功! ✨                    \033[36m│\033[0m")
     print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-    print(f"\033[36m│ \033[32m域名 (Domain): \033[0m{domain}")
-    print(f"\033[36m│ \033[32mUUID: \033[0m{uuid_str}")
-    print(f"\033[36m│ \033[32m本地Vmess端口 (Local VMess Port): \033[0m{port_vm_ws}")
-    print(f"\033[36m│ \033[32mWebSocket路径 (WS Path): \033[0m{ws_path_full}")
+    for title, value in summary:
+        print(f"\033[36m│ \033[32m{title}: \033[0m{value}")
     print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
     print("\033[36m│ \033[33m所有节点链接 (带格式):\033[0m") # 标题
     
@@ -278,11 +1478,10 @@ def generate_links(domain, port_vm_ws, uuid_str):
             print("\033[36m│ \033[0m") 
     
     print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-    print(f"\033[36m│ \033[32m详细节点信息及操作指南已保存到: \033[0m{LIST_FILE}")
-    print(f"\033[36m│ \033[32m单行节点列表 (纯链接) 已保存到: \033[0m{INSTALL_DIR / 'allnodes.txt'}")
-    print("\033[36m│ \033[32m使用 \033[33mpython3 " + os.path.basename(__file__) + " status\033[32m 查看详细状态和节点\033[0m")
-    print("\033[36m│ \033[32m使用 \033[33mpython3 " + os.path.basename(__file__) + " cat\033[32m 查看所有单行节点\033[0m")
-    print("\033[36m│ \033[32m使用 \033[33mpython3 " + os.path.basename(__file__) + " del\033[32m 删除所有节点\033[0m")
+    print(f"\033[36m│ \033[32m配置与节点信息已保存到: \033[0m{STATE_FILE}")
+    print("\033[36m│ \033[32m使用 \033[33mpython3 " + SCRIPT_HINT + " status\033[32m 查看详细状态和节点\033[0m")
+    print("\033[36m│ \033[32m使用 \033[33mpython3 " + SCRIPT_HINT + " cat\033[32m 查看所有单行节点\033[0m")
+    print("\033[36m│ \033[32m使用 \033[33mpython3 " + SCRIPT_HINT + " del\033[32m 删除所有节点\033[0m")
     print("\033[36m╰───────────────────────────────────────────────────────────────╯\033[0m")
     
     # === 第二部分：纯单行节点链接 ===
@@ -316,58 +1515,33 @@ def install(args):
     print(f"使用 UUID: {uuid_str}")
     write_debug_log(f"UUID: {uuid_str}")
 
-    # Vmess Port (vmpt)
-    port_vm_ws_str = str(args.vmpt) if args.vmpt else os.environ.get("vmpt")
-    if not port_vm_ws_str:
-        port_vm_ws_str = input(f"请输入自定义Vmess端口 (例如: 49999, 10000-65535, 留空则随机生成): ").strip()
-    
-    if port_vm_ws_str:
+    # 性能配置档 (perf_profile)
+    perf = args.perf_profile or os.environ.get("perf_profile") or DEFAULT_PERF_PROFILE
+    if perf not in PERF_PROFILES:
+        print(f"性能配置档无效 ({perf})，将使用 {DEFAULT_PERF_PROFILE}。")
+        perf = DEFAULT_PERF_PROFILE
+    print(f"使用性能配置档: {perf}")
+
+    # 优选IP候选列表: 在下载之前校验, 输入错误时立即退出
+    edge_ips = None
+    if args.edge_ips:
         try:
-            port_vm_ws = int(port_vm_ws_str)
-            if not (10000 <= port_vm_ws <= 65535):
-                print("端口号无效，将使用随机端口。")
-                port_vm_ws = random.randint(10000, 65535)
-        except ValueError:
-            print("端口输入非数字，将使用随机端口。")
-            port_vm_ws = random.randint(10000, 65535)
-    else:
-        port_vm_ws = random.randint(10000, 65535)
-    print(f"使用 Vmess 本地端口: {port_vm_ws}")
-    write_debug_log(f"Vmess Port: {port_vm_ws}")
-
-    # Argo Tunnel Token (agk)
-    argo_token = args.agk or os.environ.get("agk")
-    if not argo_token:
-        argo_token_input = input("请输入 Argo Tunnel Token (AGK) (例如: eyJhIjo...Ifs9, 若使用Cloudflare Zero Trust隧道请输入, 留空则使用临时隧道): ").strip()
-        argo_token = argo_token_input or None # None if empty
-    if argo_token:
-        print(f"使用 Argo Tunnel Token: ******{argo_token[-6:]}") # 仅显示末尾几位
-        write_debug_log(f"Argo Token: Present (not logged for security)")
-    else:
-        print("未提供 Argo Tunnel Token，将使用临时隧道 (Quick Tunnel)。")
-        write_debug_log("Argo Token: Not provided, using Quick Tunnel.")
+            edge_ips = split_edge_ips(args.edge_ips)
+        except ValueError as e:
+            print(f"\033[31m--edge-ips 格式错误: {e}\033[0m")
+            sys.exit(1)
 
-    # Custom Domain (agn)
-    custom_domain = args.agn or os.environ.get("agn")
-    if not custom_domain:
-        domain_prompt = "请输入自定义域名 (例如: test.zmkk.fun"
-        if argo_token:
-            domain_prompt += ", 必须是与Argo Token关联的域名"
-        else:
-            domain_prompt += ", 或留空以自动获取 trycloudflare.com 域名"
-        domain_prompt += "): "
-        custom_domain_input = input(domain_prompt).strip()
-        custom_domain = custom_domain_input or None
-
-    if custom_domain:
-        print(f"使用自定义域名: {custom_domain}")
-        write_debug_log(f"Custom Domain (agn): {custom_domain}")
-    elif argo_token: # 如果用了token，必须提供域名
-        print("\033[31m错误: 使用 Argo Tunnel Token 时必须提供自定义域名 (agn/--domain)。\033[0m")
-        sys.exit(1)
-    else:
-        print("未提供自定义域名，将尝试在隧道启动后自动获取。")
-        write_debug_log("Custom Domain (agn): Not provided, will attempt auto-detection.")
+    # 协议后端: 各后端收集自己的参数 (端口、隧道 Token、域名等)
+    backends = select_backends(args)
+    print(f"启用协议后端: {', '.join(backends)}")
+    config_data = {"uuid_str": uuid_str, "backends": backends, "perf_profile": perf}
+    for name in backends:
+        BACKENDS[name].configure(args, config_data)
+    tunnel = uses_tunnel(config_data)
+    instances = config_data.get("instances", 1)
+    port_vm_ws = config_data.get("port_vm_ws")
+    argo_token = config_data.get("argo_token")
+    custom_domain = config_data.get("custom_domain_agn")
 
 
     # --- 下载依赖 ---
@@ -384,104 +1558,231 @@ def install(args):
         sys.exit(1)
     write_debug_log(f"检测到系统: {system}, 架构: {machine}, 使用架构标识: {arch}")
 
-    # sing-box
-    singbox_path = INSTALL_DIR / "sing-box"
-    if not singbox_path.exists():
-        try:
-            print("获取sing-box最新版本号...")
-            version_info = http_get("https://api.github.com/repos/SagerNet/sing-box/releases/latest")
-            sb_version = json.loads(version_info)["tag_name"].lstrip("v") if version_info else "1.9.0-beta.11" # Fallback
-            print(f"sing-box 最新版本: {sb_version}")
-        except Exception as e:
-            sb_version = "1.9.0-beta.11" # Fallback
-            print(f"获取最新版本失败，使用默认版本: {sb_version}，错误: {e}")
+    # sing-box 与 cloudflared: 优先读取本地缓存, 未命中的并行下载 (主地址与镜像竞速, 支持断点续传)
+    with log_span("download", arch=arch) as span:
+        cache = ArtifactCache()
+        singbox_path = INSTALL_DIR / "sing-box"
+        cloudflared_path = INSTALL_DIR / "cloudflared"
+        downloads = []
+
+        if not singbox_path.exists():
+            sb_version = cache.latest_version("sing-box", arch)
+            if sb_version:
+                print(f"sing-box 最新版本 (缓存): {sb_version}")
+            else:
+                try:
+                    print("获取sing-box最新版本号...")
+                    with log_span("version_lookup"):
+                        version_info = http_get(f"{GITHUB_API}/repos/SagerNet/sing-box/releases/latest")
+                    sb_version = json.loads(version_info)["tag_name"].lstrip("v") if version_info else None
+                except Exception as e:
+                    sb_version = None
+                    print(f"获取最新版本失败，错误: {e}")
+                if sb_version:
+                    cache.set_latest("sing-box", arch, sb_version)
+                    print(f"sing-box 最新版本: {sb_version}")
+                else:
+                    sb_version = "1.9.0-beta.11" # Fallback
+                    print(f"获取最新版本失败，使用默认版本: {sb_version}")
         
-        sb_name = f"sing-box-{sb_version}-linux-{arch}"
-        # Armv7 for sing-box is usually armv7, not just arm
-        if arch == "arm": sb_name_actual = f"sing-box-{sb_version}-linux-armv7"
-        else: sb_name_actual = sb_name
+            # Armv7 for sing-box is usually armv7, not just arm
+            sb_name = f"sing-box-{sb_version}-linux-{'armv7' if arch == 'arm' else arch}"
 
-        sb_url = f"https://github.com/SagerNet/sing-box/releases/download/v{sb_version}/{sb_name_actual}.tar.gz"
-        tar_path = INSTALL_DIR / "sing-box.tar.gz"
-        
-        if not download_file(sb_url, tar_path):
-            print("sing-box 下载失败，尝试使用备用地址")
-            sb_url_backup = f"https://github.91chi.fun/https://github.com/SagerNet/sing-box/releases/download/v{sb_version}/{sb_name_actual}.tar.gz"
-            if not download_file(sb_url_backup, tar_path):
-                print("sing-box 备用下载也失败，退出安装")
-                sys.exit(1)
-        try:
-            print("正在解压sing-box...")
-            import tarfile
-            with tarfile.open(tar_path, "r:gz") as tar:
-                tar.extractall(path=INSTALL_DIR)
-            
-            # shutil.move(INSTALL_DIR / sb_name / "sing-box", singbox_path) # Original path
-            # Updated path structure in newer sing-box releases
-            extracted_folder_path = INSTALL_DIR / sb_name_actual 
-            if not extracted_folder_path.exists(): # sometimes it extracts directly without version in folder name for simpler archs
-                 extracted_folder_path = INSTALL_DIR / f"sing-box-{sb_version}-linux-{arch}"
-
-
-            shutil.move(extracted_folder_path / "sing-box", singbox_path)
-            shutil.rmtree(extracted_folder_path)
-            tar_path.unlink()
-            os.chmod(singbox_path, 0o755)
-        except Exception as e:
-            print(f"解压或移动sing-box失败: {e}")
-            if tar_path.exists(): tar_path.unlink()
-            sys.exit(1)
+            if cache.get("sing-box", sb_version, arch, singbox_path):
+                os.chmod(singbox_path, 0o755)
+                print(f"sing-box {sb_version} 已从缓存恢复: {CACHE_DIR}")
+                span.setdefault("cached", []).append("sing-box")
+            else:
+                sb_url = f"{GITHUB_BASE}/SagerNet/sing-box/releases/download/v{sb_version}/{sb_name}.tar.gz"
+                downloads.append(("sing-box", sb_url, singbox_path, "sing-box")) # 流式解压, 只写出 sing-box 本体
 
-    # cloudflared
-    cloudflared_path = INSTALL_DIR / "cloudflared"
-    if not cloudflared_path.exists():
         cf_arch = arch
         if arch == "armv7": cf_arch = "arm" # cloudflared uses 'arm' for 32-bit arm
-        
-        cf_url = f"https://github.com/cloudflare/cloudflared/releases/latest/download/cloudflared-linux-{cf_arch}"
-        if not download_binary("cloudflared", cf_url, cloudflared_path):
-            print("cloudflared 下载失败，尝试使用备用地址")
-            cf_url_backup = f"https://github.91chi.fun/https://github.com/cloudflare/cloudflared/releases/latest/download/cloudflared-linux-{cf_arch}"
-            if not download_binary("cloudflared", cf_url_backup, cloudflared_path):
-                print("cloudflared 备用下载也失败，退出安装")
+        if tunnel and not cloudflared_path.exists(): # 只有直连协议时不需要 cloudflared
+            cf_version = cache.latest_version("cloudflared", cf_arch)
+            if cf_version and cache.get("cloudflared", cf_version, cf_arch, cloudflared_path):
+                os.chmod(cloudflared_path, 0o755)
+                print(f"cloudflared {cf_version} 已从缓存恢复: {CACHE_DIR}")
+                span.setdefault("cached", []).append("cloudflared")
+            else:
+                cf_url = f"{GITHUB_BASE}/cloudflare/cloudflared/releases/latest/download/cloudflared-linux-{cf_arch}"
+                downloads.append(("cloudflared", cf_url, cloudflared_path, None))
+
+        if downloads:
+            print(f"正在并行下载: {', '.join(job[0] for job in downloads)}...")
+        results = fetch_artifacts(downloads)
+        for name, ok in results.items():
+            if not ok:
+                print(f"{name} 主地址与备用地址均下载失败，退出安装")
                 sys.exit(1)
 
-    # --- 配置和启动 ---
-    config_data = {
-        "uuid_str": uuid_str,
-        "port_vm_ws": port_vm_ws,
-        "argo_token": argo_token, # Will be None if not provided
-        "custom_domain_agn": custom_domain, # Will be None if not provided
-        "install_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config_data, f, indent=2)
-    write_debug_log(f"生成配置文件: {CONFIG_FILE} with data: {config_data}")
+        if results.get("sing-box"):
+            cache.put("sing-box", sb_version, arch, singbox_path)
 
-    create_sing_box_config(port_vm_ws, uuid_str)
-    create_startup_script() # Now reads from config for token
-    setup_autostart()
-    start_services()
+        if results.get("cloudflared"):
+            os.chmod(cloudflared_path, 0o755)
+            cf_version = get_binary_version(cloudflared_path) or "latest"
+            cache.put("cloudflared", cf_version, cf_arch, cloudflared_path)
+            cache.set_latest("cloudflared", cf_arch, cf_version)
+
+    # --- 配置和启动 ---
+    with log_span("configure", instances=instances, backends=backends):
+        config_data.update({
+            "sb_api_port": find_free_port(), # sing-box Clash API 端口, 用于流量统计
+            "install_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        for backend in enabled_backends(config_data): # 密钥/证书依赖 sing-box 和 openssl, 在下载之后生成
+            backend.prepare(config_data)
+        with state_transaction() as state: # 旧的域名和链接保留到 generate_links 用新布局重新生成为止
+            # 未指定 --edge-ips 时沿用之前保存的优选IP候选列表
+            edge_ips = edge_ips or state["config"].get("edge_candidates")
+            if edge_ips:
+                config_data["edge_candidates"] = edge_ips
+            state["config"] = config_data
+        write_debug_log(f"写入配置: {STATE_FILE} with data: {config_data}")
+
+        create_sing_box_config(config_data)
+        create_startup_script() # Now reads from config for token
+        # 守护进程与开机自启使用安装目录内的副本, 共用的缓存模块随脚本一起复制, 保证副本可以独立导入
+        for source, target in ((Path(__file__).resolve(), SUPERVISOR_SCRIPT), (CACHE_MODULE, INSTALL_DIR / CACHE_MODULE.name)):
+            if source.exists() and source != target.resolve():
+                shutil.copyfile(source, target)
+        create_fast_launcher()
+    with log_span("autostart"):
+        setup_autostart()
+    log_offsets = [log_size(cf_shard_files(shard)[1]) for shard in range(instances)] # 日志为追加写入, 只看本次启动的输出
+    with log_span("start_services"):
+        start_services()
 
     final_domain = custom_domain
-    if not argo_token and not custom_domain: # Quick tunnel and no pre-set domain
-        print("正在等待临时隧道域名生成...")
-        final_domain = get_tunnel_domain()
-        if not final_domain:
-            print("\033[31m无法获取tunnel域名。请检查argo.log或尝试手动指定域名。\033[0m")
-            print("  方法1: python3 " + os.path.basename(__file__) + " --agn your-domain.com")
-            print("  方法2: export agn=your-domain.com && python3 " + os.path.basename(__file__))
+    with log_span("tunnel_domain"):
+        if tunnel and not argo_token and not custom_domain: # Quick tunnel and no pre-set domain
+            print("正在等待临时隧道域名生成...")
+            log_paths = [cf_shard_files(shard)[1] for shard in range(instances)]
+            with ThreadPoolExecutor(max_workers=instances) as pool: # 各分片的隧道并行等待
+                final_domain = list(pool.map(lambda path, offset: get_tunnel_domain(log_path=path, offset=offset),
+                                             log_paths, log_offsets))
+            if not all(final_domain):
+                print("\033[31m无法获取tunnel域名。请检查argo.log或尝试手动指定域名。\033[0m")
+                print("  方法1: python3 " + SCRIPT_HINT + " --agn your-domain.com")
+                print("  方法2: export agn=your-domain.com && python3 " + SCRIPT_HINT)
+                sys.exit(1)
+        elif argo_token and not custom_domain: # Should have exited earlier, but as a safeguard
+            print("\033[31m错误: 使用Argo Token时，自定义域名是必需的但未提供。\033[0m")
             sys.exit(1)
-    elif argo_token and not custom_domain: # Should have exited earlier, but as a safeguard
-        print("\033[31m错误: 使用Argo Token时，自定义域名是必需的但未提供。\033[0m")
-        sys.exit(1)
     
-    if final_domain:
-        generate_links(final_domain, port_vm_ws, uuid_str)
-    else: # This case should ideally not be reached if logic above is correct
+    if tunnel and not final_domain: # This case should ideally not be reached if logic above is correct
         print("\033[31m最终域名未能确定，无法生成链接。\033[0m")
         sys.exit(1)
-
+    if tunnel:
+        print("正在测速Cloudflare优选IP...")
+        sni = final_domain if isinstance(final_domain, str) else final_domain[0]
+        with log_span("edge_probe"):
+            print_edge_probe(run_edge_probe(edge_candidates(), sni))
+    with log_span("links"):
+        generate_links(final_domain or [], port_vm_ws, uuid_str)
+
+
+# 热更新配置: 与状态存储中的配置比较, 只重写变化的文件并只重启受影响的进程
+def reload_config(args):
+    state = read_state()
+    config = state["config"]
+    if not config:
+        print("\033[31m尚未安装，请先安装。\033[0m")
+        return
+    os.chdir(INSTALL_DIR)
+    new_config = dict(config)
+    updates = {
+        "uuid_str": args.uuid, "port_vm_ws": args.vmpt, "argo_token": args.agk,
+        "custom_domain_agn": args.agn, "instances": args.instances, "perf_profile": args.perf_profile,
+        "backends": select_backends(args) if args.backends else None,
+    }
+    for key, value in updates.items():
+        if value is not None:
+            new_config[key] = value
+    tunnel = uses_tunnel(new_config)
+    if tunnel != uses_tunnel(config): # 隧道相关的二进制、端口和域名只在安装时准备
+        print("\033[31m启用或停用 vmess-argo 需要重新安装。\033[0m")
+        return
+    instances = new_config.get("instances", 1)
+    if tunnel and (not (1 <= instances <= 64) or not (10000 <= new_config["port_vm_ws"] <= 65535 - (instances - 1))):
+        print("\033[31m端口或实例数无效。\033[0m")
+        return
+    if tunnel and new_config.get("argo_token") and not new_config.get("custom_domain_agn"):
+        print("\033[31m错误: 使用 Argo Tunnel Token 时必须提供自定义域名 (agn/--domain)。\033[0m")
+        return
+    if tunnel:
+        metrics_ports = list(new_config.get("cf_metrics_ports") or [])
+        while len(metrics_ports) < instances:
+            metrics_ports.append(find_free_port())
+        new_config["cf_metrics_ports"] = metrics_ports[:instances]
+    old_backends = {backend.name for backend in enabled_backends(config)}
+    for backend in enabled_backends(new_config): # 新启用的直连后端: 分配端口并生成密钥/证书
+        if backend.name not in old_backends:
+            backend.configure(args, new_config)
+            backend.prepare(new_config)
+
+    changed = sorted(key for key in updates if new_config.get(key) != config.get(key))
+    if not changed:
+        print("配置没有变化，无需重载。")
+        return
+    print(f"变更项: {', '.join(changed)}")
+    with state_transaction() as state:
+        state["config"] = new_config
+    write_debug_log(f"重载配置, 变更: {changed}")
+
+    # 重写 sb.json 和启动脚本, 按内容是否变化决定重启哪些进程
+    old_layout = shard_layout(config)
+    shards = len(shard_layout(new_config))
+    snapshot = {path: path.read_text() if path.exists() else None
+                for path in [INSTALL_DIR / "sb.json"] + [cf_shard_files(shard)[0] for shard, _, _ in old_layout]}
+    create_sing_box_config(new_config)
+    create_startup_script()
+    for shard in range(shards, len(old_layout)): # 删除多余分片的启动脚本
+        cf_shard_files(shard)[0].unlink(missing_ok=True)
+
+    to_restart = []
+    if (INSTALL_DIR / "sb.json").read_text() != snapshot[INSTALL_DIR / "sb.json"]:
+        to_restart.append("sing-box")
+    restarted_shards = []
+    for shard in range(min(shards, len(old_layout))):
+        script = cf_shard_files(shard)[0]
+        if script.read_text() != snapshot.get(script):
+            to_restart.append(cf_service_name(shard))
+            restarted_shards.append(shard)
+    restarted_shards += list(range(len(old_layout), shards)) # 新增分片
+    supervisor_up = supervisor_request("status") is not None
+    if not supervisor_up: # 守护进程启动时会重新拉起所有分片, 每个分片的临时域名都会变化
+        restarted_shards = list(range(shards))
+    log_offsets = {shard: log_size(cf_shard_files(shard)[1]) for shard in restarted_shards}
+
+    if not supervisor_up:
+        print("守护进程未运行，正在启动...")
+        launch_supervisor()
+    else:
+        if shards != len(old_layout):
+            supervisor_request("sync", timeout=SUPERVISOR_CONTROL_TIMEOUT)
+        for name in to_restart:
+            restart_service(name)
+        if not to_restart and shards == len(old_layout):
+            print("进程配置未变化，sing-box 与 cloudflared 保持运行。")
+    not_ready = wait_for_services()
+    if not_ready:
+        print(f"\033[33m警告: {', '.join(not_ready)} 在 {READY_TIMEOUT} 秒内未就绪。\033[0m")
+
+    # 更新链接: 自定义域名直接使用, 临时隧道只为重启过的分片重新获取域名
+    if not tunnel:
+        domains = []
+    elif new_config.get("custom_domain_agn"):
+        domains = [new_config["custom_domain_agn"]]
+    else:
+        domains = (state["domains"] + [""] * instances)[:instances]
+        for shard in restarted_shards:
+            domains[shard] = get_tunnel_domain(log_path=cf_shard_files(shard)[1], offset=log_offsets[shard]) or ""
+        if not all(domains):
+            print("\033[31m无法获取部分分片的临时域名，请检查 argo.log。\033[0m")
+            return
+    generate_links(domains, new_config.get("port_vm_ws"), new_config["uuid_str"])
 
 # 设置开机自启动
 def setup_autostart():
@@ -491,14 +1792,16 @@ def setup_autostart():
         
         script_name_sb = (INSTALL_DIR / "start_sb.sh").resolve()
         script_name_cf = (INSTALL_DIR / "start_cf.sh").resolve()
+        supervisor_script = SUPERVISOR_SCRIPT.resolve()
 
         filtered_lines = [
             line for line in lines 
-            if str(script_name_sb) not in line and str(script_name_cf) not in line and line.strip()
+            if str(script_name_sb) not in line and str(script_name_cf) not in line
+            and str(supervisor_script) not in line and line.strip()
         ]
         
-        filtered_lines.append(f"@reboot {script_name_sb} >/dev/null 2>&1")
-        filtered_lines.append(f"@reboot {script_name_cf} >/dev/null 2>&1")
+        # 开机只需启动守护进程, 由它拉起并看护 sing-box 和 cloudflared
+        filtered_lines.append(f"@reboot {sys.executable} {supervisor_script} supervise >/dev/null 2>&1")
         
         new_crontab = "\n".join(filtered_lines).strip() + "\n"
         
@@ -519,23 +1822,20 @@ def setup_autostart():
 def uninstall():
     print("开始卸载服务...")
     
-    # 停止服务
-    for pid_file_path in [SB_PID_FILE, ARGO_PID_FILE]:
-        if pid_file_path.exists():
-            try:
-                pid = pid_file_path.read_text().strip()
-                if pid:
-                    print(f"正在停止进程 PID: {pid} (来自 {pid_file_path.name})")
-                    os.system(f"kill {pid} 2>/dev/null || true")
-            except Exception as e:
-                print(f"停止进程时出错 ({pid_file_path.name}): {e}")
+    # 停止守护进程 (会一并停止其管理的 sing-box 和 cloudflared)
+    print("正在停止守护进程...")
+    stop_supervisor()
+
+    # 兼容旧版启动脚本留下的PID (迁移时从 sbpid.log / sbargopid.log 读入)
+    for pid in read_state().get("legacy_pids", []):
+        print(f"正在停止旧版进程 PID: {pid}")
+        os.system(f"kill {pid} 2>/dev/null || true")
     time.sleep(1) # 给进程一点时间退出
 
     # 强制停止 (如果还在运行)
     print("尝试强制终止可能残留的 sing-box 和 cloudflared 进程...")
     os.system("pkill -9 -f 'sing-box run -c sb.json' 2>/dev/null || true")
-    os.system("pkill -9 -f 'cloudflared tunnel --url' 2>/dev/null || true") # Quick Tunnel
-    os.system("pkill -9 -f 'cloudflared tunnel --no-autoupdate run --token' 2>/dev/null || true") # Named Tunnel
+    os.system("pkill -9 -f 'cloudflared tunnel --no-autoupdate' 2>/dev/null || true") # Quick Tunnel 和 Named Tunnel
 
     # 移除crontab项
     try:
@@ -544,10 +1844,12 @@ def uninstall():
         
         script_name_sb_str = str((INSTALL_DIR / "start_sb.sh").resolve())
         script_name_cf_str = str((INSTALL_DIR / "start_cf.sh").resolve())
+        supervisor_script_str = str(SUPERVISOR_SCRIPT.resolve())
 
         filtered_lines = [
             line for line in lines
-            if script_name_sb_str not in line and script_name_cf_str not in line and line.strip()
+            if script_name_sb_str not in line and script_name_cf_str not in line
+            and supervisor_script_str not in line and line.strip()
         ]
         
         new_crontab = "\n".join(filtered_lines).strip()
@@ -572,6 +1874,8 @@ def uninstall():
             print(f"安装目录 {INSTALL_DIR} 已删除。")
         except Exception as e:
             print(f"无法完全删除安装目录 {INSTALL_DIR}: {e}。请手动删除。")
+    if CACHE_DIR and CACHE_DIR.exists():
+        print(f"下载缓存保留在 {CACHE_DIR}，重新安装时无需再次下载。")
             
     print("卸载完成。")
     sys.exit(0)
@@ -579,214 +1883,1055 @@ def uninstall():
 # 升级脚本
 def upgrade():
     script_url = "https://raw.githubusercontent.com/yonggekkk/argosb/main/agsb_custom_domain.py" # 假设这是最新脚本的地址
-    print(f"正在从 {script_url} 下载最新脚本...")
     try:
+        script_path = Path(__file__).resolve()
+        new_script_path = script_path.with_suffix(script_path.suffix + ".new")
+        # 升级总是重新下载, 不经过下载缓存: 缓存中的 "latest" 在有效期内可能已经过时
+        print(f"正在从 {script_url} 下载最新脚本...")
         script_content = http_get(script_url)
-        if script_content:
-            script_path = Path(__file__).resolve()
-            backup_path = script_path.with_suffix(script_path.suffix + ".bak")
-            shutil.copyfile(script_path, backup_path) #备份旧脚本
-            print(f"旧脚本已备份到: {backup_path}")
-            
-            with open(script_path, 'w', encoding='utf-8') as f:
-                f.write(script_content)
-            os.chmod(script_path, 0o755)
-            print("\033[32m脚本升级完成！请重新运行脚本。\033[0m")
-        else:
+        if not script_content:
             print("\033[31m升级失败，无法下载最新脚本。\033[0m")
+            sys.exit(0)
+        new_script_path.write_text(script_content, encoding='utf-8')
+
+        backup_path = script_path.with_suffix(script_path.suffix + ".bak")
+        shutil.copyfile(script_path, backup_path) #备份旧脚本
+        print(f"旧脚本已备份到: {backup_path}")
+
+        os.replace(new_script_path, script_path)
+        os.chmod(script_path, 0o755)
+
+        # 共用的缓存模块与脚本位于同一目录, 一并更新; 下载失败时保留现有模块 (缺少模块时脚本只是不使用下载缓存)
+        module_path = script_path.with_name(CACHE_MODULE.name)
+        module_content = http_get(script_url.rsplit("/", 1)[0] + "/" + CACHE_MODULE.name)
+        if module_content:
+            new_module_path = module_path.with_suffix(module_path.suffix + ".new")
+            new_module_path.write_text(module_content, encoding='utf-8')
+            os.replace(new_module_path, module_path)
+        else:
+            print(f"\033[33m未能更新 {CACHE_MODULE.name}，继续使用现有版本。\033[0m")
+        print("\033[32m脚本升级完成！请重新运行脚本。\033[0m")
     except Exception as e:
         print(f"\033[31m升级过程中出错: {e}\033[0m")
     sys.exit(0)
 
-# 检查脚本运行状态
-def check_status():
-    sb_running = SB_PID_FILE.exists() and os.path.exists(f"/proc/{SB_PID_FILE.read_text().strip()}")
-    cf_running = ARGO_PID_FILE.exists() and os.path.exists(f"/proc/{ARGO_PID_FILE.read_text().strip()}")
-
-    if sb_running and cf_running and LIST_FILE.exists():
-        print("\033[36m╭───────────────────────────────────────────────────────────────╮\033[0m")
-        print("\033[36m│                \033[33m✨ ArgoSB 运行状态 ✨                    \033[36m│\033[0m")
-        print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-        print("\033[36m│ \033[32m服务状态: \033[33m正在运行 (sing-box & cloudflared)\033[0m")
-        
-        domain_to_display = "未知"
-        if CUSTOM_DOMAIN_FILE.exists():
-            domain_to_display = CUSTOM_DOMAIN_FILE.read_text().strip()
-            print(f"\033[36m│ \033[32m当前使用域名: \033[0m{domain_to_display}")
-        elif CONFIG_FILE.exists(): # Fallback to config if custom_domain.txt not there
-            config = json.loads(CONFIG_FILE.read_text())
-            if config.get("custom_domain_agn"):
-                 domain_to_display = config["custom_domain_agn"]
-                 print(f"\033[36m│ \033[32m配置域名 (agn): \033[0m{domain_to_display}")
-            elif not config.get("argo_token") and LOG_FILE.exists(): # Quick tunnel, try log
-                log_content = LOG_FILE.read_text()
-                match = re.search(r'https://([a-zA-Z0-9.-]+\.trycloudflare\.com)', log_content)
-                if match:
-                    domain_to_display = match.group(1)
-                    print(f"\033[36m│ \033[32mArgo临时域名: \033[0m{domain_to_display}")
-        
-        if domain_to_display == "未知":
-             print("\033[36m│ \033[31m域名信息未找到或未生成，请检查配置或日志。\033[0m")
-
-        print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-        if (INSTALL_DIR / "allnodes.txt").exists():
-            print("\033[36m│ \033[33m节点链接 (部分示例):\033[0m")
-            with open(INSTALL_DIR / "allnodes.txt", 'r') as f:
-                links = f.read().splitlines()
-                for i in range(min(3, len(links))):
-                    print(f"\033[36m│ \033[0m{links[i][:70]}...") # 打印部分链接
-            if len(links) > 3:
-                print("\033[36m│ \033[32m... 更多节点请使用 'cat' 命令查看 ...\033[0m")
-        print("\033[36m╰───────────────────────────────────────────────────────────────╯\033[0m")
-        return True
-    
-    status_msgs = []
-    if not sb_running: status_msgs.append("sing-box 未运行")
-    if not cf_running: status_msgs.append("cloudflared 未运行")
-    if not LIST_FILE.exists(): status_msgs.append("节点信息文件未生成")
-
-    print("\033[36m╭───────────────────────────────────────────────────────────────╮\033[0m")
-    print("\033[36m│                \033[33m✨ ArgoSB 运行状态 ✨                    \033[36m│\033[0m")
-    print("\033[36m├───────────────────────────────────────────────────────────────┤\033[0m")
-    if status_msgs:
-        print("\033[36m│ \033[31mArgoSB 服务异常:\033[0m")
-        for msg in status_msgs:
-            print(f"\033[36m│   - {msg}\033[0m")
-        print("\033[36m│ \033[32m尝试重新安装或检查日志: \033[33mpython3 " + os.path.basename(__file__) + " install\033[0m")
-    else: # Should be caught by first if, but as a fallback
-         print("\033[36m│ \033[31mArgoSB 未运行或配置不完整。\033[0m")
-         print("\033[36m│ \033[32m运行 \033[33mpython3 " + os.path.basename(__file__) + "\033[32m 开始安装。\033[0m")
-    print("\033[36m╰───────────────────────────────────────────────────────────────╯\033[0m")
-    return False
-
+# 分片布局: [(分片序号, 本地vmess端口, cloudflared指标端口或None), ...], 未启用 vmess-argo 时为空
+def shard_layout(config):
+    if not uses_tunnel(config):
+        return []
+    metrics_ports = config.get("cf_metrics_ports") or []
+    return [
+        (shard, config["port_vm_ws"] + shard, metrics_ports[shard] if shard < len(metrics_ports) else None)
+        for shard in range(config.get("instances", 1))
+    ]
+
+# 分片对应的 cloudflared 启动脚本和日志文件 (分片0沿用 start_cf.sh / argo.log)
+def cf_shard_files(shard):
+    if shard == 0:
+        return INSTALL_DIR / "start_cf.sh", LOG_FILE
+    return INSTALL_DIR / f"start_cf_{shard}.sh", INSTALL_DIR / f"argo_{shard}.log"
+
+# 分片对应的守护进程服务名
+def cf_service_name(shard):
+    return "cloudflared" if shard == 0 else f"cloudflared-{shard}"
 
 # 创建sing-box配置
-def create_sing_box_config(port_vm_ws, uuid_str):
-    write_debug_log(f"创建sing-box配置，端口: {port_vm_ws}, UUID: {uuid_str}")
-    ws_path = f"/{uuid_str[:8]}-vm" # 和 generate_links 中的路径保持一致
+def build_sing_box_config(config):
+    settings = perf_profile(config)[1]
+    inbounds = [inbound for backend in enabled_backends(config) for inbound in backend.inbounds(config, settings)]
 
+    outbound = {"type": "direct", "tag": "direct"}
+    if settings["outbound_tcp_fast_open"] is not None:
+        outbound["tcp_fast_open"] = settings["outbound_tcp_fast_open"]
     config_dict = {
-        "log": {"level": "info", "timestamp": True},
-        "inbounds": [{
-            "type": "vmess", "tag": "vmess-in", "listen": "127.0.0.1",
-            "listen_port": port_vm_ws, "tcp_fast_open": True, "sniff": True,
-            "sniff_override_destination": True, "proxy_protocol": False, # No proxy protocol from local cloudflared
-            "users": [{"uuid": uuid_str, "alterId": 0}], # alterId 0 is common now
-            "transport": {
-                "type": "ws", "path": ws_path,
-                "max_early_data": 2048, "early_data_header_name": "Sec-WebSocket-Protocol"
-            }
-        }],
-        "outbounds": [{"type": "direct", "tag": "direct"}]
+        "log": {"level": settings["log_level"], "timestamp": True},
+        "inbounds": inbounds,
+        "outbounds": [outbound]
     }
+    if config.get("sb_api_port"): # Clash API 提供流量与连接统计, 仅监听本地
+        config_dict["experimental"] = {"clash_api": {"external_controller": f"127.0.0.1:{config['sb_api_port']}"}}
+    return config_dict
+
+def create_sing_box_config(config):
+    write_debug_log(f"创建sing-box配置, 后端: {[backend.name for backend in enabled_backends(config)]}, "
+                    f"实例数: {config.get('instances', 1)}, 性能配置: {perf_profile(config)[0]}")
+    config_dict = build_sing_box_config(config)
     sb_config_file = INSTALL_DIR / "sb.json"
     with open(sb_config_file, 'w') as f:
         json.dump(config_dict, f, indent=2)
     write_debug_log(f"sing-box配置已写入文件: {sb_config_file}")
     return True
 
+# cloudflared 传输参数: 协议、边缘IP版本和到边缘的连接数
+def cf_transport_args(tuning=None):
+    tuning = tuning or {}
+    args = f"--edge-ip-version {tuning.get('edge_ip_version', 'auto')} --protocol {tuning.get('protocol', 'http2')}"
+    if tuning.get("ha_connections"):
+        args += f" --ha-connections {tuning['ha_connections']}"
+    return args
+
 # 创建启动脚本
 def create_startup_script():
-    if not CONFIG_FILE.exists():
-        print("配置文件 config.json 不存在，无法创建启动脚本。请先执行安装。")
+    config = read_config()
+    if not config:
+        print("配置不存在，无法创建启动脚本。请先执行安装。")
         return
 
-    config = json.loads(CONFIG_FILE.read_text())
-    port_vm_ws = config["port_vm_ws"]
-    uuid_str = config["uuid_str"]
     argo_token = config.get("argo_token") # Safely get token, might be None
+    tuning = config.get("cf_tuning") # tune 命令选出的传输参数, 未调优时保持原有参数
     
     # sing-box启动脚本
     sb_start_script_path = INSTALL_DIR / "start_sb.sh"
     sb_start_content = f'''#!/bin/bash
 cd {INSTALL_DIR.resolve()}
-./sing-box run -c sb.json > sb.log 2>&1 &
-echo $! > {SB_PID_FILE.name}
+exec ./sing-box run -c sb.json
 '''
     sb_start_script_path.write_text(sb_start_content)
     os.chmod(sb_start_script_path, 0o755)
 
-    # cloudflared启动脚本
-    cf_start_script_path = INSTALL_DIR / "start_cf.sh"
-    cf_cmd_base = f"./cloudflared tunnel --no-autoupdate"
-    # 使用与 sing-box 配置中一致的路径，确保 ?ed=2048 在这里也加上
-    ws_path_for_url = f"/{uuid_str[:8]}-vm?ed=2048" 
-
-    if argo_token: # 使用命名隧道
-        cf_cmd = f"{cf_cmd_base} run --token {argo_token}"
-    else: # 使用临时隧道
-        cf_cmd = f"{cf_cmd_base} --url http://localhost:{port_vm_ws}{ws_path_for_url} --edge-ip-version auto --protocol http2"
-    
-    cf_start_content = f'''#!/bin/bash
+    # cloudflared启动脚本, 每个分片一个 (start_cf.sh, start_cf_1.sh, ...)
+    # 源站地址不带 WebSocket 路径: cloudflared 原样转发请求路径, 这样更换 UUID 时无需重建隧道
+    for shard, shard_port, metrics_port in shard_layout(config):
+        cf_start_script_path, _ = cf_shard_files(shard)
+        cf_cmd_base = f"./cloudflared tunnel --no-autoupdate"
+        if metrics_port:
+            cf_cmd_base += f" --metrics 127.0.0.1:{metrics_port}"
+
+        if argo_token: # 使用命名隧道 (多实例时为同一隧道增加连接器)
+            transport = f" {cf_transport_args(tuning)}" if tuning else ""
+            cf_cmd = f"{cf_cmd_base}{transport} run --token {argo_token}"
+        else: # 使用临时隧道
+            cf_cmd = f"{cf_cmd_base} --url http://localhost:{shard_port} {cf_transport_args(tuning)}"
+        
+        cf_start_content = f'''#!/bin/bash
 cd {INSTALL_DIR.resolve()}
-{cf_cmd} > {LOG_FILE.name} 2>&1 &
-echo $! > {ARGO_PID_FILE.name}
+exec {cf_cmd}
 '''
-    cf_start_script_path.write_text(cf_start_content)
-    os.chmod(cf_start_script_path, 0o755)
+        cf_start_script_path.write_text(cf_start_content)
+        os.chmod(cf_start_script_path, 0o755)
     
     write_debug_log("启动脚本已创建/更新。")
 
+# 获取一个本地空闲端口
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# WebSocket 升级请求 (就绪检查和隧道调优共用)
+def ws_upgrade_request(host, ws_path):
+    return (
+        f"GET {ws_path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}\r\n"
+        "Sec-WebSocket-Version: 13\r\n\r\n"
+    ).encode()
+
+# sing-box 就绪检查: 对本地 vmess 入站发起 WebSocket 握手, 返回 True(就绪)/False(未就绪)
+def probe_sing_box(port, ws_path, timeout=1.0):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=timeout) as sock:
+            sock.sendall(ws_upgrade_request(f"127.0.0.1:{port}", ws_path))
+            status_line = sock.recv(128).split(b"\r\n", 1)[0]
+        if status_line.split()[1:2] == [b"101"]:
+            return True
+        write_debug_log(f"sing-box 握手返回异常: {status_line!r}")
+        return False
+    except OSError:
+        return False
+
+# 直连 TCP 入站就绪检查: 能建立连接即认为 sing-box 已开始监听
+def probe_tcp_port(port, timeout=1.0):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+# cloudflared 就绪检查: 指标端口的 /ready 在至少一条隧道连接建立后返回 200
+def probe_cloudflared(metrics_port, timeout=1.0):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/ready", timeout=timeout) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+# 等待服务就绪: 全部就绪立即返回, 超过 deadline 则返回未就绪的服务列表
+def wait_for_services(timeout=READY_TIMEOUT):
+    config = read_config()
+    probes = {}
+    for backend in enabled_backends(config):
+        probes.update(backend.probes(config))
+
+    start = time.monotonic()
+    pending = dict(probes)
+    while pending:
+        for name in list(pending):
+            if pending[name]():
+                del pending[name]
+                print(f"{name} 已就绪 ({time.monotonic() - start:.1f}s)")
+        if not pending or time.monotonic() - start >= timeout:
+            break
+        time.sleep(0.1)
+    return list(pending)
+
 # 启动服务
 def start_services():
-    print("正在启动sing-box服务...")
-    subprocess.run(str(INSTALL_DIR / "start_sb.sh"), shell=True)
-    
-    print("正在启动cloudflared服务...")
-    subprocess.run(str(INSTALL_DIR / "start_cf.sh"), shell=True)
+    # 重新安装时分片布局和脚本副本都可能变化, 正在运行的守护进程只认识旧的服务列表且运行旧代码:
+    # 先停止它 (连同子进程), 再用新的副本重新启动
+    if supervisor_request("status") is not None:
+        print("守护进程已在运行，正在停止并按新配置重新启动...")
+        stop_supervisor()
+    print("正在启动守护进程 (sing-box & cloudflared)...")
+    launch_supervisor()
     
-    print("等待服务启动 (约5秒)...")
-    time.sleep(5)
-    write_debug_log("服务启动命令已执行。")
+    print(f"等待服务就绪 (最长{READY_TIMEOUT}秒)...")
+    not_ready = wait_for_services()
+    if not_ready:
+        print(f"\033[33m警告: {', '.join(not_ready)} 在 {READY_TIMEOUT} 秒内未就绪，请检查 sb.log / argo.log。\033[0m")
+    write_debug_log(f"服务启动命令已执行, 未就绪: {not_ready}")
+
+# 读取 /proc/<pid>/stat 中的启动时间 (自开机起的时钟滴答数), 与 PID 一起唯一标识一个进程
+def proc_start_time(pid):
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        return int(stat.rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
 
-# 获取tunnel域名 (仅用于Quick Tunnel)
-def get_tunnel_domain():
-    retry_count = 0
-    max_retries = 15 # 增加重试次数
-    while retry_count < max_retries:
-        if LOG_FILE.exists():
+# 进程存活且启动时间一致时才认为是同一个进程, 避免 PID 复用导致误判
+def process_alive(pid, start_time):
+    return bool(pid) and start_time is not None and proc_start_time(pid) == start_time
+
+# 守护进程管理的服务: 名称 -> (启动脚本, 日志文件)
+def supervised_services():
+    services = {"sing-box": (INSTALL_DIR / "start_sb.sh", SB_LOG_FILE)}
+    config = read_config() or {"port_vm_ws": 0}
+    for shard, _, _ in shard_layout(config):
+        services[cf_service_name(shard)] = cf_shard_files(shard)
+    return services
+
+# 以独立会话在后台启动守护进程
+def launch_supervisor():
+    with open(SUPERVISOR_LOG, 'ab') as log:
+        subprocess.Popen(
+            [sys.executable, str(SUPERVISOR_SCRIPT), "supervise"],
+            cwd=INSTALL_DIR, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    write_debug_log("守护进程已启动。")
+
+class _SupervisorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        command = self.rfile.readline().decode(errors="replace").strip()
+        response = self.server.supervisor.handle_command(command)
+        self.wfile.write(json.dumps(response).encode())
+
+# 守护进程: 持有 sing-box 和 cloudflared 子进程, 异常退出后按指数退避重启, 通过 Unix 套接字提供状态查询与控制
+class Supervisor:
+    def __init__(self, services):
+        self.lock = threading.Lock()
+        self.domain_lock = threading.Lock() # 各分片的域名刷新线程依次读改写状态存储中的域名列表
+        self.stopping = threading.Event()
+        self.started_at = time.time()
+        self.services = {name: self._new_service(script, log) for name, (script, log) in services.items()}
+
+    @staticmethod
+    def _new_service(script, log):
+        return {
+            "script": script, "log": log, "proc": None, "start_time": None, "started_at": None,
+            "restarts": 0, "backoff": RESTART_BACKOFF_MIN, "next_start": 0.0, "last_exit": None, "log_offset": 0,
+        }
+
+    def _spawn(self, name):
+        svc = self.services[name]
+        # 追加模式打开, 保留上一次运行 (例如崩溃前) 的输出, 大小由 rotate_copytruncate 控制;
+        # 本次运行的输出从 log_offset 开始
+        svc["log_offset"] = log_size(svc["log"])
+        fd = os.open(svc["log"], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, f"--- {datetime.now():%Y-%m-%d %H:%M:%S} 守护进程启动 {name} ---\n".encode())
+            proc = subprocess.Popen(
+                ["/bin/bash", str(svc["script"])], cwd=INSTALL_DIR,
+                stdin=subprocess.DEVNULL, stdout=fd, stderr=subprocess.STDOUT
+            )
+        finally:
+            os.close(fd)
+        svc.update(proc=proc, start_time=proc_start_time(proc.pid), started_at=time.time())
+        write_debug_log(f"守护进程: 已启动 {name} (PID {proc.pid})")
+        # 每次启动 (包括开机自启和 launch_supervisor 后的首次启动) Quick Tunnel 都会分配新域名
+        if name.startswith("cloudflared"):
+            threading.Thread(target=self._refresh_tunnel_domain, args=(name,), daemon=True).start()
+
+    def _stop(self, *names, timeout=5):
+        # 先向所有目标发送 SIGTERM 再统一等待, 总耗时不超过 timeout, 与服务数量无关
+        procs = [self.services[name]["proc"] for name in names]
+        procs = [proc for proc in procs if proc and proc.poll() is None]
+        for proc in procs:
+            proc.terminate()
+        deadline = time.monotonic() + timeout
+        for proc in procs:
             try:
-                log_content = LOG_FILE.read_text()
-                match = re.search(r'https://([a-zA-Z0-9.-]+\.trycloudflare\.com)', log_content)
-                if match:
-                    domain = match.group(1)
-                    write_debug_log(f"从日志中提取到临时域名: {domain}")
-                    print(f"获取到临时域名: {domain}")
-                    return domain
-            except Exception as e:
-                write_debug_log(f"读取或解析日志文件 {LOG_FILE} 出错: {e}")
-        
-        retry_count += 1
-        print(f"等待tunnel域名生成... (尝试 {retry_count}/{max_retries}, 检查 {LOG_FILE})")
-        time.sleep(3) # 每次等待3秒
+                proc.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        for name in names:
+            self.services[name]["proc"] = None
+
+    def _reap_and_spawn(self):
+        now = time.time()
+        for name, svc in self.services.items():
+            proc = svc["proc"]
+            if proc is not None and proc.poll() is not None:
+                svc["last_exit"] = proc.returncode
+                svc["proc"] = None
+                if now - svc["started_at"] >= RESTART_STABLE_SECS:
+                    svc["backoff"] = RESTART_BACKOFF_MIN
+                svc["next_start"] = now + svc["backoff"]
+                print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {name} 退出 (code {proc.returncode}), {svc['backoff']}秒后重启", flush=True)
+                write_debug_log(f"守护进程: {name} 退出 code={proc.returncode}, {svc['backoff']}秒后重启")
+                svc["backoff"] = min(svc["backoff"] * 2, RESTART_BACKOFF_MAX)
+                svc["restarts"] += 1
+            if svc["proc"] is None and now >= svc["next_start"]:
+                self._spawn(name)
+
+    # Quick Tunnel 的 cloudflared 每次启动后域名都会变化, 需重新生成链接
+    def _refresh_tunnel_domain(self, name):
+        try:
+            config = read_config()
+            if config.get("argo_token") or config.get("custom_domain_agn"):
+                return
+            shard = 0 if name == "cloudflared" else int(name.rsplit("-", 1)[1])
+            svc = self.services[name]
+            match = follow_log(svc["log"], TRYCLOUDFLARE_RE, TUNNEL_DOMAIN_TIMEOUT, offset=svc["log_offset"])
+            if not match:
+                return
+            with self.domain_lock:
+                domains = list(read_state().get("domains") or [])
+                domains += [""] * (shard + 1 - len(domains))
+                domains[shard] = match.group(1).decode()
+                generate_links(domains, config["port_vm_ws"], config["uuid_str"], quiet=True)
+        except Exception as e:
+            write_debug_log(f"守护进程: 刷新临时域名失败: {e}")
+
+    def status(self):
+        now = time.time()
+        services = {}
+        for name, svc in self.services.items():
+            proc = svc["proc"]
+            running = proc is not None and proc.poll() is None and process_alive(proc.pid, svc["start_time"])
+            services[name] = {
+                "running": running,
+                "pid": proc.pid if running else None,
+                "uptime": round(now - svc["started_at"], 1) if running else 0,
+                "restarts": svc["restarts"],
+                "last_exit": svc["last_exit"],
+            }
+        return {"pid": os.getpid(), "uptime": round(now - self.started_at, 1), "services": services}
+
+    def handle_command(self, command):
+        parts = command.split()
+        action = parts[0] if parts else "status"
+        with self.lock:
+            if action == "status":
+                return self.status()
+            if action == "restart":
+                target = parts[1] if len(parts) > 1 else "all"
+                names = list(self.services) if target == "all" else [target]
+                if any(name not in self.services for name in names):
+                    return {"ok": False, "error": f"未知服务: {target}"}
+                self._stop(*names)
+                for name in names:
+                    self._spawn(name)
+                return {"ok": True, "restarted": names}
+            if action == "sync": # 按最新配置增删服务 (例如分片数变化)
+                wanted = supervised_services()
+                removed = [name for name in self.services if name not in wanted]
+                self._stop(*removed)
+                for name in removed:
+                    del self.services[name]
+                added = [name for name in wanted if name not in self.services]
+                for name in added:
+                    self.services[name] = self._new_service(*wanted[name])
+                    self._spawn(name)
+                return {"ok": True, "added": added, "removed": removed}
+            if action == "stop":
+                self.stopping.set()
+                return {"ok": True}
+        return {"ok": False, "error": f"未知命令: {command}"}
+
+    def run(self):
+        # 单实例: 运行期间一直持有 supervisor.pid 的文件锁, 第二个实例直接退出, 不会删除正在使用的套接字
+        pid_fd = os.open(SUPERVISOR_PID_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(pid_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(pid_fd)
+            print("守护进程已在运行，本实例退出。", flush=True)
+            return
+        if supervisor_request("status") is not None: # 旧版本的守护进程不持有文件锁, 以套接字是否应答为准
+            os.close(pid_fd)
+            print("守护进程已在运行 (套接字有应答)，本实例退出。", flush=True)
+            return
+        os.ftruncate(pid_fd, 0)
+        os.write(pid_fd, f"{os.getpid()} {proc_start_time(os.getpid())}".encode())
+        if SUPERVISOR_SOCK.exists():
+            SUPERVISOR_SOCK.unlink()
+        server = socketserver.ThreadingUnixStreamServer(str(SUPERVISOR_SOCK), _SupervisorHandler)
+        server.daemon_threads = True
+        server.supervisor = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, lambda signum, frame: self.stopping.set())
+        write_debug_log(f"守护进程运行中 (PID {os.getpid()})")
+        next_rotate = 0.0
+        try:
+            while not self.stopping.wait(0.5):
+                with self.lock:
+                    self._reap_and_spawn()
+                    logs = [svc["log"] for svc in self.services.values()]
+                if time.monotonic() >= next_rotate:
+                    next_rotate = time.monotonic() + LOG_ROTATE_INTERVAL
+                    for log in logs + [SUPERVISOR_LOG, DEBUG_LOG]:
+                        if rotate_copytruncate(log):
+                            write_debug_log(f"守护进程: 日志已轮转 {log}")
+        finally:
+            with self.lock:
+                self._stop(*self.services)
+            server.shutdown()
+            server.server_close()
+            for path in (SUPERVISOR_SOCK, SUPERVISOR_PID_FILE):
+                if path.exists(): path.unlink()
+            os.close(pid_fd) # 释放单实例锁
+            write_debug_log("守护进程已退出。")
+
+# 停止守护进程: 优先通过套接字, 否则按校验过身份的 PID 发送信号; 等到进程退出 (释放单实例锁) 后返回
+def stop_supervisor(timeout=10):
+    try:
+        pid, start_time = (int(x) for x in SUPERVISOR_PID_FILE.read_text().split())
+    except (OSError, ValueError):
+        pid, start_time = None, None
+    if supervisor_request("stop") is None and process_alive(pid, start_time):
+        os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not (process_alive(pid, start_time) if pid else SUPERVISOR_SOCK.exists()):
+            return
+        time.sleep(0.1)
+
+# 通过守护进程重启单个服务 (等待时间按 restart 命令的耗时放宽), 失败或超时时打印警告
+def restart_service(name):
+    print(f"正在重启 {name}...")
+    response = supervisor_request(f"restart {name}", timeout=SUPERVISOR_CONTROL_TIMEOUT)
+    if not (response and response.get("ok")):
+        print(f"\033[33m警告: 重启 {name} 失败: {(response or {}).get('error', '守护进程未运行')}\033[0m")
+
+# 订阅内容: 按格式缓存渲染结果、gzip 压缩版本和强 ETag, 仅在状态存储或测速结果变化时失效
+class SubscriptionCache:
+    WATCHED = (STATE_FILE, EDGE_PROBE_FILE)
+
+    def __init__(self):
+        self.signature = None
+        self.uuid_str = None
+        self.nodes = []
+        self.rendered = {} # 格式名 -> (正文, gzip正文, ETag, Content-Type)
+
+    def _signature(self):
+        sig = []
+        for path in self.WATCHED:
+            try:
+                st = path.stat()
+                sig.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def refresh(self):
+        signature = self._signature()
+        if signature == self.signature:
+            return
+        state = read_state()
+        self.uuid_str = state["config"]["uuid_str"]
+        self.nodes = build_all_nodes(state["config"], state["domains"])
+        self.rendered = {}
+        self.signature = signature
+        write_debug_log(f"订阅节点已重建: {len(self.nodes)} 个节点")
+
+    def get(self, fmt):
+        """返回 (正文, gzip正文, ETag, Content-Type), 同一格式在配置变化前只渲染一次"""
+        if fmt not in self.rendered:
+            render, content_type = RENDERERS[fmt]
+            body = render(self.nodes).encode()
+            etag = '"' + hashlib.sha256(fmt.encode() + b"\0" + body).hexdigest()[:32] + '"'
+            self.rendered[fmt] = (body, gzip.compress(body, compresslevel=9, mtime=0), etag, content_type)
+        return self.rendered[fmt]
+
+async def _handle_subscription(cache, reader, writer):
+    try:
+        while True: # 支持 HTTP/1.1 keep-alive
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=30)
+            lines = head.decode("latin-1").split("\r\n")
+            method, path, version = (lines[0].split(" ") + ["", "", ""])[:3]
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+            cache.refresh()
+            extra = {}
+            route, _, query = path.partition("?")
+            params = dict(item.partition("=")[::2] for item in query.split("&") if item)
+            fmt = params.get("format", "base64")
+            if method not in ("GET", "HEAD"):
+                status, body = "405 Method Not Allowed", b""
+            elif route != f"/sub/{cache.uuid_str}" or fmt not in RENDERERS:
+                status, body = "404 Not Found", b""
+            else:
+                plain, compressed, etag, content_type = cache.get(fmt)
+                extra["ETag"] = etag
+                if etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+                    status, body = "304 Not Modified", b""
+                else:
+                    status = "200 OK"
+                    extra["Content-Type"] = content_type
+                    extra["Vary"] = "Accept-Encoding"
+                    if "gzip" in headers.get("accept-encoding", ""):
+                        body = compressed
+                        extra["Content-Encoding"] = "gzip"
+                    else:
+                        body = plain
+
+            response = [f"HTTP/1.1 {status}", f"Content-Length: {len(body)}",
+                        "Connection: " + ("keep-alive" if keep_alive else "close")]
+            response += [f"{name}: {value}" for name, value in extra.items()]
+            writer.write(("\r\n".join(response) + "\r\n\r\n").encode() + (body if method != "HEAD" else b""))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+# serve 命令: 运行订阅服务 (前台运行, 可配合 nohup 或 screen)
+def serve_subscription(listen):
+    if not read_config():
+        print("\033[31m尚未安装，请先安装。\033[0m")
+        return
+    host, _, port = listen.rpartition(":")
+    cache = SubscriptionCache()
+    cache.refresh()
+
+    async def run():
+        server = await asyncio.start_server(lambda r, w: _handle_subscription(cache, r, w), host or "0.0.0.0", int(port))
+        print(f"订阅服务已启动: http://{host or '0.0.0.0'}:{port}/sub/{cache.uuid_str}")
+        print(f"可用格式 (?format=): {', '.join(RENDERERS)} (默认 base64)")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+# 读取进程的累计CPU时间(秒)和常驻内存(字节)
+def proc_usage(pid):
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK") # utime + stime
+        rss_pages = int(Path(f"/proc/{pid}/statm").read_text().split()[1])
+        return cpu_seconds, rss_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+# 给 Prometheus 文本格式的样本行追加标签
+def _add_metric_label(line, label):
+    name, sep, rest = line.partition("{")
+    if sep:
+        return f"{name}{{{label},{rest}"
+    name, _, value = line.partition(" ")
+    return f"{name}{{{label}}} {value}"
+
+# 汇总守护进程、sing-box Clash API 与各分片 cloudflared 的指标, 输出 Prometheus 文本格式
+def collect_metrics():
+    config = read_config()
+    out = []
+
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            out.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+    status = supervisor_request("status")
+    services = status.get("services", {}) if status else {}
+    metric("agsb_supervisor_up", "gauge", "Whether the agsb supervisor answers on its socket.", [("", int(bool(status) and "services" in status))])
+    metric("agsb_process_up", "gauge", "Whether the supervised process is running.",
+           [(f'service="{name}"', int(info["running"])) for name, info in services.items()])
+    metric("agsb_process_restarts_total", "counter", "Restarts performed by the supervisor.",
+           [(f'service="{name}"', info["restarts"]) for name, info in services.items()])
+    usage = {name: proc_usage(info["pid"]) for name, info in services.items() if info["running"]}
+    metric("agsb_process_cpu_seconds_total", "counter", "User plus system CPU time of the process.",
+           [(f'service="{name}"', f"{u[0]:.2f}") for name, u in usage.items() if u])
+    metric("agsb_process_resident_memory_bytes", "gauge", "Resident set size of the process.",
+           [(f'service="{name}"', u[1]) for name, u in usage.items() if u])
+
+    if config.get("sb_api_port"):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{config['sb_api_port']}/connections", timeout=2) as response:
+                conns = json.loads(response.read())
+            metric("agsb_singbox_upload_bytes_total", "counter", "Bytes sent upstream through sing-box.", [("", conns.get("uploadTotal", 0))])
+            metric("agsb_singbox_download_bytes_total", "counter", "Bytes received through sing-box.", [("", conns.get("downloadTotal", 0))])
+            metric("agsb_singbox_connections", "gauge", "Active sing-box connections.", [("", len(conns.get("connections") or []))])
+        except Exception as e:
+            write_debug_log(f"读取 sing-box Clash API 失败: {e}")
+
+    # 按指标族汇总各分片的样本: 同一指标族的样本必须连续输出, HELP/TYPE 只输出一次
+    families = {}
+    for shard, _, metrics_port in shard_layout(config):
+        if not metrics_port:
+            continue
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=2) as response:
+                text = response.read().decode()
+        except Exception as e:
+            write_debug_log(f"读取 cloudflared 指标失败 (分片{shard}): {e}")
+            continue
+        current = None
+        for line in text.splitlines():
+            if line.startswith(("# HELP ", "# TYPE ")):
+                current = line.split(None, 3)[2]
+                if current.startswith("cloudflared_tunnel_"):
+                    meta = families.setdefault(current, {"meta": {}, "samples": []})["meta"]
+                    meta.setdefault(line[2:6], line)
+            elif line.startswith("cloudflared_tunnel_"):
+                name = line.split("{", 1)[0].split(" ", 1)[0]
+                # histogram/summary 的 _bucket/_sum/_count 样本归入其前面声明的指标族
+                family = current if current and name in (current, *(current + s for s in ("_bucket", "_sum", "_count"))) else name
+                families.setdefault(family, {"meta": {}, "samples": []})["samples"].append(
+                    _add_metric_label(line, f'shard="{shard}"'))
+    for family in families.values():
+        out.extend(family["meta"][kind] for kind in ("HELP", "TYPE") if kind in family["meta"])
+        out.extend(family["samples"])
+    return "\n".join(out) + "\n"
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = collect_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# metrics 命令: 运行 Prometheus 指标服务 (前台运行)
+def serve_metrics(listen):
+    if not read_config():
+        print("\033[31m尚未安装，请先安装。\033[0m")
+        return
+    host, _, port = listen.rpartition(":")
+    server = http.server.ThreadingHTTPServer((host or "127.0.0.1", int(port)), _MetricsHandler)
+    print(f"指标服务已启动: http://{host or '127.0.0.1'}:{port}/metrics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# 调优用的临时源站: CF_TUNE_PATH 返回指定大小的随机数据用于测吞吐, 其余请求 (WebSocket 握手) 原样转发给 sing-box
+class _TuneOriginHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True: # cloudflared 会复用到源站的连接
+            head = b""
+            while not head.endswith(b"\r\n\r\n"):
+                line = self.rfile.readline(65536)
+                if not line:
+                    return
+                head += line
+            path = head.split(b" ", 2)[1].decode("latin-1")
+            if not path.startswith(CF_TUNE_PATH):
+                self._relay(head)
+                return
+            size = int(path.partition("bytes=")[2] or CF_TUNE_PAYLOAD)
+            chunk = os.urandom(DOWNLOAD_CHUNK) # 随机数据, 避免被边缘压缩
+            try:
+                self.wfile.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                                 f"Cache-Control: no-store\r\nContent-Length: {size}\r\n\r\n".encode())
+                while size > 0:
+                    self.wfile.write(chunk[:size])
+                    size -= len(chunk)
+            except OSError:
+                return
+
+    def _relay(self, head):
+        try:
+            upstream = socket.create_connection(("127.0.0.1", self.server.sb_port), timeout=5)
+        except OSError:
+            self.wfile.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+            return
+        with upstream:
+            upstream.settimeout(None)
+            upstream.sendall(head)
+
+            def pump():
+                try:
+                    for data in iter(lambda: self.rfile.read1(65536), b""):
+                        upstream.sendall(data)
+                    upstream.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+            threading.Thread(target=pump, daemon=True).start()
+            try:
+                for data in iter(lambda: upstream.recv(65536), b""):
+                    self.wfile.write(data)
+            except OSError:
+                pass
+
+class _TuneOrigin(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, sb_port):
+        self.sb_port = sb_port
+        super().__init__(("127.0.0.1", 0), _TuneOriginHandler)
+
+# 本机是否有到该地址族的路由 (UDP connect 不发送数据), 没有时跳过对应的边缘IP版本
+def has_route(family):
+    target = ("1.1.1.1", 53) if family == socket.AF_INET else ("2606:4700:4700::1111", 53)
+    try:
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.connect(target)
+        return True
+    except OSError:
+        return False
+
+@contextmanager
+def _tunnel_connection(domain, timeout=10):
+    with socket.create_connection((domain, 443), timeout=timeout) as raw:
+        with _ssl_context().wrap_socket(raw, server_hostname=domain) as sock:
+            yield sock
+
+# 经隧道完成一次 WebSocket 握手 (到达 sing-box), 返回从发送请求到收到 101 的毫秒数, 失败返回 None
+def tunnel_handshake(domain, ws_path):
+    with _tunnel_connection(domain) as sock:
+        start = time.perf_counter()
+        sock.sendall(ws_upgrade_request(domain, ws_path))
+        status_line = sock.recv(128).split(b"\r\n", 1)[0]
+        elapsed = (time.perf_counter() - start) * 1000
+    return elapsed if status_line.split()[1:2] == [b"101"] else None
+
+# 经隧道下载测速数据, 返回吞吐量 (Mbps)
+def tunnel_throughput(domain, size=CF_TUNE_PAYLOAD, max_seconds=CF_TUNE_SECONDS):
+    with _tunnel_connection(domain) as sock:
+        start = time.perf_counter()
+        sock.sendall(f"GET {CF_TUNE_PATH}?bytes={size} HTTP/1.1\r\nHost: {domain}\r\nConnection: close\r\n\r\n".encode())
+        head, received = b"", 0
+        while time.perf_counter() - start < max_seconds:
+            data = sock.recv(DOWNLOAD_CHUNK)
+            if not data:
+                break
+            if head is not None: # 仍在读取响应头
+                head += data
+                if b"\r\n\r\n" not in head:
+                    continue
+                status, _, body = head.partition(b"\r\n\r\n")
+                if status.split()[1:2] != [b"200"]:
+                    raise OSError(f"测速请求失败: {status.splitlines()[0]!r}")
+                head, data = None, body
+            received += len(data)
+            if received >= size:
+                break
+        elapsed = time.perf_counter() - start
+    return received * 8 / elapsed / 1e6 if received else None
+
+# 用一组传输参数启动临时隧道 (指向调优源站), 测量握手时间和吞吐量后结束进程
+def tune_trial(origin_port, ws_path, protocol, edge_ip_version, ha_connections):
+    tuning = {"protocol": protocol, "edge_ip_version": edge_ip_version, "ha_connections": ha_connections}
+    result = dict(tuning, handshake_ms=None, mbps=None, error=None)
+    log_path = INSTALL_DIR / "argo_tune.log"
+    metrics_port = find_free_port()
+    cmd = (f"./cloudflared tunnel --no-autoupdate --metrics 127.0.0.1:{metrics_port} "
+           f"--url http://localhost:{origin_port} {cf_transport_args(tuning)}").split()
+    with open(log_path, "wb") as log:
+        proc = subprocess.Popen(cmd, cwd=INSTALL_DIR, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + CF_TUNE_READY_TIMEOUT
+        match = follow_log(log_path, TRYCLOUDFLARE_RE, CF_TUNE_READY_TIMEOUT)
+        if not match:
+            result["error"] = "未获取到临时域名"
+            return result
+        domain = match.group(1).decode()
+        while not probe_cloudflared(metrics_port) and time.monotonic() < deadline:
+            time.sleep(0.5)
+        # 新域名的 DNS 生效和边缘路由需要几秒, 第一次握手成功前持续重试
+        first = None
+        while first is None and time.monotonic() < deadline:
+            try:
+                first = tunnel_handshake(domain, ws_path)
+            except OSError:
+                pass
+            if first is None:
+                time.sleep(1)
+        if first is None:
+            result["error"] = "隧道未连通"
+            return result
+        times = [first]
+        for _ in range(CF_TUNE_HANDSHAKES - 1):
+            try:
+                elapsed = tunnel_handshake(domain, ws_path)
+            except OSError:
+                elapsed = None
+            if elapsed is not None:
+                times.append(elapsed)
+        result["handshake_ms"] = round(statistics.median(times), 1)
+        try:
+            mbps = tunnel_throughput(domain)
+            result["mbps"] = round(mbps, 2) if mbps else None
+        except OSError as e:
+            result["error"] = str(e)
+        return result
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        log_path.unlink(missing_ok=True)
+        write_debug_log(f"隧道调优: {result}")
+
+# 吞吐量优先, 相同时握手时间短者优先
+def _tune_key(result):
+    return (-result["mbps"], result["handshake_ms"])
+
+def print_tune_results(results):
+    print("\033[33mcloudflared 传输参数测试结果:\033[0m")
+    print(f"  {_pad('协议', 8)}{_pad('边缘IP', 8)}{_pad('连接数', 8)}{_pad('握手(ms)', 10, True)}{_pad('吞吐(Mbps)', 12, True)}  状态")
+    for r in results:
+        fmt = lambda v: "-" if v is None else f"{v:.1f}"
+        state = r["error"] or ("成功" if r["mbps"] else "无数据")
+        print(f"  {_pad(r['protocol'], 8)}{_pad('IPv' + r['edge_ip_version'], 8)}{_pad(str(r['ha_connections']), 8)}"
+              f"{_pad(fmt(r['handshake_ms']), 10, True)}{_pad(fmt(r['mbps']), 12, True)}  {state}")
+
+# tune 命令: 逐个测试协议/边缘IP版本/连接数组合, 把最快的组合写入状态存储和 cloudflared 启动脚本
+def tune_tunnel_command():
+    config = read_config()
+    if not config:
+        print("\033[31m尚未安装，请先安装。\033[0m")
+        return
+    os.chdir(INSTALL_DIR)
+    layout = shard_layout(config)
+    if not layout:
+        print("\033[33m未启用 vmess-argo，没有需要调优的隧道。\033[0m")
+        return
+    ws_path = f"/{config['uuid_str'][:8]}-vm"
+    sb_port = layout[0][1]
+    if not probe_sing_box(sb_port, ws_path):
+        print("\033[31msing-box 未就绪，请先启动服务 (status 查看状态)。\033[0m")
+        return
+    ip_versions = [v for v in CF_TUNE_EDGE_IP_VERSIONS if has_route(socket.AF_INET if v == "4" else socket.AF_INET6)]
+    if not ip_versions:
+        print("\033[31m本机没有可用的 IPv4/IPv6 路由。\033[0m")
+        return
+
+    origin = _TuneOrigin(sb_port)
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    origin_port = origin.server_address[1]
+    results = []
+    try:
+        for protocol in CF_TUNE_PROTOCOLS:
+            for ip_version in ip_versions:
+                print(f"正在测试 {protocol} / IPv{ip_version} / {CF_TUNE_HA_CONNECTIONS[0]} 连接...")
+                results.append(tune_trial(origin_port, ws_path, protocol, ip_version, CF_TUNE_HA_CONNECTIONS[0]))
+        ok = [r for r in results if r["mbps"]]
+        if ok:
+            best = min(ok, key=_tune_key)
+            for ha_connections in CF_TUNE_HA_CONNECTIONS[1:]:
+                print(f"正在测试 {best['protocol']} / IPv{best['edge_ip_version']} / {ha_connections} 连接...")
+                results.append(tune_trial(origin_port, ws_path, best["protocol"], best["edge_ip_version"], ha_connections))
+    finally:
+        origin.shutdown()
+        origin.server_close()
+
+    print_tune_results(results)
+    ok = [r for r in results if r["mbps"]]
+    if not ok:
+        print("\033[31m所有组合均测试失败，保持当前参数。\033[0m")
+        return
+    best = min(ok, key=_tune_key)
+    config["cf_tuning"] = {
+        "protocol": best["protocol"], "edge_ip_version": best["edge_ip_version"], "ha_connections": best["ha_connections"],
+        "handshake_ms": best["handshake_ms"], "mbps": best["mbps"], "tuned_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    with state_transaction() as state:
+        state["config"]["cf_tuning"] = config["cf_tuning"]
+    print(f"\033[32m最优组合: {cf_transport_args(config['cf_tuning'])}\033[0m")
+
+    # 重写启动脚本, 只重启参数发生变化的分片
+    scripts = {shard: cf_shard_files(shard)[0] for shard, _, _ in layout}
+    before = {shard: path.read_text() if path.exists() else None for shard, path in scripts.items()}
+    create_startup_script()
+    changed = [shard for shard, path in scripts.items() if path.read_text() != before[shard]]
+    if not changed:
+        print("当前启动参数已是最优组合，无需重启 cloudflared。")
+        return
+    if supervisor_request("status") is None:
+        print("守护进程未运行，新参数将在下次启动时生效。")
+        return
+    log_offsets = {shard: log_size(cf_shard_files(shard)[1]) for shard in changed}
+    for shard in changed:
+        restart_service(cf_service_name(shard))
+    not_ready = wait_for_services()
+    if not_ready:
+        print(f"\033[33m警告: {', '.join(not_ready)} 在 {READY_TIMEOUT} 秒内未就绪。\033[0m")
+    if not config.get("argo_token") and not config.get("custom_domain_agn"): # 临时隧道重启后域名会变化
+        domains = (read_state()["domains"] + [""] * len(layout))[:len(layout)]
+        for shard in changed:
+            domains[shard] = get_tunnel_domain(log_path=cf_shard_files(shard)[1], offset=log_offsets[shard]) or ""
+        if not all(domains):
+            print("\033[31m无法获取部分分片的临时域名，请检查 argo.log。\033[0m")
+            return
+        generate_links(domains, config["port_vm_ws"], config["uuid_str"], quiet=True)
+        print("\033[32m临时域名已变化，节点链接已更新，使用 cat 查看。\033[0m")
+
+# 基于 inotify 的目录变化通知 (通过 ctypes 调用 libc), 不可用时由调用方回退到轮询
+class DirWatcher:
+    IN_MODIFY = 0x00000002
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        mask = self.IN_MODIFY | self.IN_CREATE | self.IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch 失败: {directory}")
+
+    def wait(self, timeout):
+        """阻塞直到目录内有文件变化或超时, 返回是否收到事件"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+def follow_log(log_path, pattern, timeout, offset=0, poll_interval=0.5):
+    """增量跟踪日志: 从 offset 开始只扫描新追加的字节, 文件变化时立即唤醒, 匹配到 pattern 即返回 match 对象"""
+    log_path = Path(log_path)
+    deadline = time.monotonic() + timeout
+    inode, tail = None, b""
+    try:
+        watcher = DirWatcher(log_path.parent)
+    except (OSError, AttributeError) as e:
+        write_debug_log(f"inotify 不可用, 改为轮询: {e}")
+        watcher = None
+    try:
+        while True:
+            try:
+                st = os.stat(log_path)
+                if inode is None:
+                    inode = st.st_ino
+                if st.st_ino != inode or st.st_size < offset: # 文件被重建或截断 (轮转), 从头开始
+                    offset, inode, tail = 0, st.st_ino, b""
+                if st.st_size > offset:
+                    with open(log_path, 'rb') as f:
+                        f.seek(offset)
+                        data = f.read(st.st_size - offset)
+                    offset += len(data)
+                    buf = tail + data
+                    match = pattern.search(buf)
+                    if match:
+                        return match
+                    tail = buf[-256:] # 保留末尾, 防止匹配内容被两次写入截断
+            except FileNotFoundError:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if watcher:
+                watcher.wait(min(remaining, 1.0)) # 事件驱动, 1秒兜底
+            else:
+                time.sleep(min(poll_interval, remaining))
+    finally:
+        if watcher:
+            watcher.close()
+
+# 获取tunnel域名 (仅用于Quick Tunnel)
+# offset 为重启前记下的日志大小, 避免匹配到上一次运行留下的旧域名
+def get_tunnel_domain(timeout=TUNNEL_DOMAIN_TIMEOUT, log_path=LOG_FILE, offset=0):
+    print(f"等待tunnel域名生成... (最长 {timeout} 秒, 检查 {log_path})")
+    start = time.monotonic()
+    match = follow_log(log_path, TRYCLOUDFLARE_RE, timeout, offset=offset)
+    if match:
+        domain = match.group(1).decode()
+        write_debug_log(f"从日志中提取到临时域名: {domain} (用时 {time.monotonic() - start:.1f}s)")
+        print(f"获取到临时域名: {domain}")
+        return domain
     
     write_debug_log("获取tunnel域名超时。")
     return None
 
 # 主函数
 def main():
-    print_info()
     args = parse_args()
+    if args.action == "supervise":
+        Supervisor(supervised_services()).run()
+        return
+    if banner_enabled(args.no_banner):
+        print_info()
 
     if args.action == "install":
-        install(args)
+        if args.profile:
+            with install_profile():
+                install(args)
+        else:
+            install(args)
     elif args.action in ["uninstall", "del"]:
         uninstall()
     elif args.action == "update":
         upgrade()
     elif args.action == "status":
+        ensure_state()
         check_status()
+    elif args.action == "reload":
+        reload_config(args)
+    elif args.action == "probe":
+        probe_edges_command(args)
+    elif args.action == "serve":
+        serve_subscription(args.listen or SUB_LISTEN)
+    elif args.action == "metrics":
+        serve_metrics(args.listen or METRICS_LISTEN)
+    elif args.action == "tune":
+        tune_tunnel_command()
     elif args.action == "cat":
-        all_nodes_path = INSTALL_DIR / "allnodes.txt"
-        if all_nodes_path.exists():
-            print(all_nodes_path.read_text().strip())
-        else:
-            print(f"\033[31m节点文件 {all_nodes_path} 未找到。请先安装或运行 status。\033[0m")
+        ensure_state()
+        show_nodes(load_state())
     else: # 默认行为，通常是 'install' 或者检查后提示
-        if INSTALL_DIR.exists() and CONFIG_FILE.exists() and SB_PID_FILE.exists() and ARGO_PID_FILE.exists():
+        if read_config():
             print("\033[33m检测到ArgoSB可能已安装并正在运行。\033[0m")
             if check_status():
-                 print("\033[32m如需重新安装，请先执行卸载: python3 " + os.path.basename(__file__) + " del\033[0m")
+                 print("\033[32m如需重新安装，请先执行卸载: python3 " + SCRIPT_HINT + " del\033[0m")
             else:
                 print("\033[31m服务状态异常，建议尝试重新安装。\033[0m")
                 install(args) # 尝试重新安装
@@ -795,10 +2940,10 @@ def main():
             install(args)
 
 if __name__ == "__main__":
-    script_name = os.path.basename(__file__)
+    script_name = SCRIPT_HINT
     if len(sys.argv) == 1: # 如果只运行脚本名，没有其他参数
         # 检查是否已安装，如果已安装且在运行，显示status，否则进行安装
-        if INSTALL_DIR.exists() and CONFIG_FILE.exists() and SB_PID_FILE.exists() and ARGO_PID_FILE.exists():
+        if read_config():
             print(f"\033[33m检测到 ArgoSB 可能已安装。显示当前状态。\033[0m")
             print(f"\033[33m如需重新安装，请运行: python3 {script_name} install\033[0m")
             print(f"\033[33m如需卸载，请运行: python3 {script_name} del\033[0m")
@@ -1,18 +1,65 @@
 import os
 import sys
 import subprocess
-import time
 from pathlib import Path
 import requests
 from datetime import datetime
 import streamlit as st
+from console_jobs import command_console
+from artifact_cache import ArtifactCache
 import tarfile
-import io
+import lzma
+import shutil
+import threading
+from dataclasses import dataclass
 
 TMATE_VERSION = "2.4.0"
-TMATE_DOWNLOAD_URL = f"https://github.com/tmate-io/tmate/releases/download/{TMATE_VERSION}/tmate-{TMATE_VERSION}-static-linux-amd64.tar.xz"
+GITHUB_BASE = os.environ.get("AGSB_GITHUB_BASE", "https://github.com").rstrip("/")  # 可指向本地测试服务器 (见 benchmark.py)
+TMATE_DOWNLOAD_URL = f"{GITHUB_BASE}/tmate-io/tmate/releases/download/{TMATE_VERSION}/tmate-{TMATE_VERSION}-static-linux-amd64.tar.xz"
 USER_HOME = Path.home()
 SSH_INFO_FILE = "/tmp/ssh.txt"
+TMATE_SOCKET = os.environ.get("TMATE_SOCKET", "/tmp/tmate.sock")
+TMATE_MEMBER = f"tmate-{TMATE_VERSION}-static-linux-amd64/tmate"
+DOWNLOAD_CHUNK = 64 * 1024
+TMATE_READY_TIMEOUT = 20
+# 一次 display 调用取回会话的全部连接信息, 字段以制表符分隔
+TMATE_FIELDS = ("session_name", "tmate_ssh", "tmate_ssh_ro", "tmate_web", "tmate_web_ro")
+TMATE_SESSION_FORMAT = "\t".join("#{%s}" % field for field in TMATE_FIELDS)
+XZ_MEMLIMIT = 64 * 1024 * 1024  # xz 解压器内存上限, 下载过程内存占用与压缩包大小无关
+
+class XzStream:
+    """把分块下载的 .xz 数据边接收边解压, 以文件对象形式提供给 tarfile 的流式模式"""
+    def __init__(self, chunks, on_progress=None):
+        self.chunks = iter(chunks)
+        self.decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ, memlimit=XZ_MEMLIMIT)
+        self.on_progress = on_progress
+        self.received = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = DOWNLOAD_CHUNK
+        while not self.decompressor.eof:
+            chunk = b""
+            if self.decompressor.needs_input:
+                chunk = next(self.chunks, b"")
+                if not chunk:
+                    raise EOFError("xz 数据流提前结束")
+                self.received += len(chunk)
+                if self.on_progress:
+                    self.on_progress(self.received)
+            data = self.decompressor.decompress(chunk, max_length=size)
+            if data:
+                return data
+        return b""
+
+@dataclass
+class TmateSession:
+    """tmate 会话的连接信息; display 查询成功即说明会话存活"""
+    name: str = ""
+    ssh: str = ""
+    ssh_ro: str = ""
+    web: str = ""
+    web_ro: str = ""
 
 class TmateManager:
     def __init__(self):
@@ -20,24 +67,101 @@ class TmateManager:
         self.tmate_path = self.tmate_dir / "tmate"
         self.ssh_info_path = Path(SSH_INFO_FILE)
         self.tmate_process = None
-        self.session_info = {}
-        
+        self.session = None
+        self.lock = threading.Lock()  # 多个会话同时点击时串行创建
+        self._version = None
+        self._version_key = None
+
+    def installed_version(self):
+        """返回已安装tmate的版本号, 按文件 mtime/size 缓存, 二进制不变时不再执行 tmate -V"""
+        try:
+            stat = self.tmate_path.stat()
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key != self._version_key:
+            try:
+                output = subprocess.run([str(self.tmate_path), "-V"], capture_output=True, text=True, timeout=5).stdout
+            except (OSError, subprocess.SubprocessError):
+                output = ""
+            parts = output.split()  # "tmate 2.4.0"
+            self._version = parts[1] if len(parts) >= 2 else None
+            self._version_key = key
+        return self._version
+
+    def query_session(self, timeout=5):
+        """用一次 display 调用同时获取会话存活状态与 ssh/web 连接信息, 会话不存在时返回 None"""
+        if not os.path.exists(TMATE_SOCKET) or not self.tmate_path.exists():
+            return None
+        try:
+            result = subprocess.run(
+                [str(self.tmate_path), "-S", TMATE_SOCKET, "display", "-p", TMATE_SESSION_FORMAT],
+                capture_output=True, text=True, timeout=timeout
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        if result.returncode != 0:
+            return None
+        values = result.stdout.rstrip("\n").split("\t")
+        values += [""] * (len(TMATE_FIELDS) - len(values))
+        return TmateSession(*(value.strip() for value in values[:len(TMATE_FIELDS)]))
+
+    def probe_session(self):
+        """检查已有的 tmate 会话, 存活且已连上服务器时记录其连接信息"""
+        session = self.query_session()
+        if session is None or not session.ssh:
+            return False
+        self.session = session
+        return True
+
     def download_tmate(self):
         """下载并安装tmate"""
-        st.info("正在下载并安装tmate...")
         self.tmate_dir.mkdir(exist_ok=True)
+        version = self.installed_version()
+        if version == TMATE_VERSION:
+            st.success(f"✓ tmate {version} 已安装: {self.tmate_path}")
+            return True
+        cache = ArtifactCache()
         try:
-            response = requests.get(TMATE_DOWNLOAD_URL, stream=True)
-            response.raise_for_status()
-            with io.BytesIO(response.content) as tar_stream:
-                with tarfile.open(fileobj=tar_stream, mode="r:xz") as tar:
-                    tar.extract("tmate-2.4.0-static-linux-amd64/tmate", path=str(self.tmate_dir))
-            extracted_path = self.tmate_dir / "tmate-2.4.0-static-linux-amd64" / "tmate"
-            if extracted_path.exists():
-                extracted_path.rename(self.tmate_path)
+            if cache.get("tmate", TMATE_VERSION, "amd64", self.tmate_path):
                 os.chmod(self.tmate_path, 0o755)
-            subprocess.run(["rm", "-rf", str(self.tmate_dir / "tmate-2.4.0-static-linux-amd64")])
+                st.success(f"✓ tmate已从缓存安装到: {self.tmate_path}")
+                return True
+            st.info("正在下载并安装tmate...")
+            with requests.get(TMATE_DOWNLOAD_URL, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                total = int(response.headers.get("Content-Length") or 0)
+                progress = st.progress(0.0, text="正在下载tmate...")
+                last_update = [0]
+
+                def report(received):
+                    if received - last_update[0] < 256 * 1024 and received != total:
+                        return
+                    last_update[0] = received
+                    text = f"已下载 {received / 1048576:.1f} MB" + (f" / {total / 1048576:.1f} MB" if total else "")
+                    progress.progress(min(received / total, 1.0) if total else 0.0, text=text)
+
+                stream = XzStream(response.iter_content(DOWNLOAD_CHUNK), on_progress=report)
+                part_path = self.tmate_path.with_name("tmate.part")
+                try:
+                    with tarfile.open(fileobj=stream, mode="r|") as tar:
+                        for member in tar:
+                            if member.name == TMATE_MEMBER:
+                                with tar.extractfile(member) as src, open(part_path, "wb") as dst:
+                                    shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK)
+                                    written = dst.tell()
+                                if written != member.size:
+                                    raise IOError(f"{TMATE_MEMBER} 不完整: {written}/{member.size} 字节")
+                                os.chmod(part_path, 0o755)
+                                part_path.replace(self.tmate_path)
+                                break
+                        else: # 不能落到下面的存在性检查: 旧版本的 tmate 仍在原处, 会被当作新版本写入缓存
+                            raise IOError(f"压缩包中未找到 {TMATE_MEMBER}")
+                finally:
+                    part_path.unlink(missing_ok=True)
+                progress.empty()
             if self.tmate_path.exists() and os.access(self.tmate_path, os.X_OK):
+                cache.put("tmate", TMATE_VERSION, "amd64", self.tmate_path)
                 st.success(f"✓ tmate已安装到: {self.tmate_path}")
                 return True
             else:
@@ -48,68 +172,82 @@ class TmateManager:
             return False
     
     def start_tmate(self):
-        """启动tmate"""
-        st.info("正在启动tmate...")
+        """启动tmate, 已有存活会话时直接复用"""
         try:
             if not self.tmate_path.exists():
                 st.error("tmate文件不存在，请先安装")
                 return False
+            if self.probe_session():
+                st.success("✓ 复用已有的Tmate会话:")
+                self.show_session_info()
+                return True
+            st.info("正在启动tmate...")
             self.tmate_process = subprocess.Popen(
-                [str(self.tmate_path), "-S", "/tmp/tmate.sock", "new-session", "-d"],
-                stdout=subprocess.PIPE,
+                [str(self.tmate_path), "-S", TMATE_SOCKET, "new-session", "-d"],
+                stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
                 start_new_session=True
             )
-            time.sleep(3)
-            self.get_session_info()
-            result = subprocess.run(
-                [str(self.tmate_path), "-S", "/tmp/tmate.sock", "list-sessions"],
-                capture_output=True, text=True, timeout=5
-            )
-            if result.returncode == 0:
-                st.success("✓ Tmate后台进程运行中")
-                return True
-            else:
+            # new-session -d 在 tmate 服务端 (及其套接字) 就绪后才返回, 先等它退出再等待 tmate-ready 事件
+            try:
+                _, stderr = self.tmate_process.communicate(timeout=TMATE_READY_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.tmate_process.kill()
+                st.error(f"✗ tmate 服务端在{TMATE_READY_TIMEOUT}秒内未启动")
+                return False
+            if self.tmate_process.returncode != 0:
+                st.error(f"✗ tmate 启动失败: {stderr.decode(errors='replace').strip()}")
+                return False
+            # 等待 tmate 与服务器建立会话 (tmate-ready 事件), 就绪即返回
+            try:
+                ready = subprocess.run(
+                    [str(self.tmate_path), "-S", TMATE_SOCKET, "wait", "tmate-ready"],
+                    capture_output=True, timeout=TMATE_READY_TIMEOUT
+                )
+            except subprocess.TimeoutExpired:
+                st.error(f"✗ 等待tmate就绪超过{TMATE_READY_TIMEOUT}秒")
+                return False
+            if ready.returncode != 0:
+                st.error(f"✗ 等待tmate就绪失败: {ready.stderr.decode(errors='replace').strip()}")
+                return False
+            self.session = self.query_session(timeout=10)
+            if self.session is None:
                 st.error("✗ Tmate后台进程验证失败")
                 return False
+            if self.session.ssh:
+                st.success("✓ Tmate会话已创建:")
+            self.show_session_info()
+            st.success("✓ Tmate后台进程运行中")
+            return True
         except Exception as e:
             st.error(f"✗ 启动tmate失败: {e}")
             return False
-    
-    def get_session_info(self):
-        """获取tmate会话信息"""
-        try:
-            result = subprocess.run(
-                [str(self.tmate_path), "-S", "/tmp/tmate.sock", "display", "-p", "#{tmate_ssh}"],
-                capture_output=True, text=True, timeout=10
-            )
-            if result.returncode == 0:
-                self.session_info['ssh'] = result.stdout.strip()
-            if self.session_info.get('ssh'):
-                st.success("✓ Tmate会话已创建:")
-                st.info(f"SSH连接命令: {self.session_info['ssh']}")
-            else:
-                result = subprocess.run(
-                    [str(self.tmate_path), "-S", "/tmp/tmate.sock", "display", "-p", "#{tmate_web}"],
-                    capture_output=True, text=True, timeout=10
-                )
-                if result.returncode == 0:
-                    st.info(f"Web访问地址: {result.stdout.strip()}")
-        except Exception as e:
-            st.error(f"✗ 获取会话信息失败: {e}")
-    
+
+    def show_session_info(self):
+        """显示tmate会话信息"""
+        if self.session.ssh:
+            st.info(f"SSH连接命令: {self.session.ssh}")
+        if self.session.web:
+            st.info(f"Web访问地址: {self.session.web}")
+
     def save_ssh_info(self):
         """保存SSH信息"""
         try:
-            if not self.session_info.get('ssh'):
+            if self.session is None or not self.session.ssh:
                 st.error("没有可用的SSH会话信息")
                 return False
             content = f"""Tmate SSH 会话信息
 版本: {TMATE_VERSION}
 创建时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 SSH连接命令:
-{self.session_info['ssh']}
+{self.session.ssh}
 """
+            if self.session.ssh_ro:
+                content += f"只读SSH连接命令:\n{self.session.ssh_ro}\n"
+            if self.session.web:
+                content += f"Web访问地址:\n{self.session.web}\n"
+            if self.session.web_ro:
+                content += f"只读Web访问地址:\n{self.session.web_ro}\n"
             with open(self.ssh_info_path, 'w', encoding='utf-8') as f:
                 f.write(content)
             st.success(f"✓ SSH信息已保存到: {self.ssh_info_path}")
@@ -119,31 +257,18 @@ SSH连接命令:
             st.error(f"✗ 保存SSH信息失败: {e}")
             return False
 
-def execute_command(command):
-    """执行命令并输出"""
-    try:
-        if not command.strip():
-            st.warning("请输入要执行的命令。")
-            return
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=30)
-        if result.returncode == 0:
-            st.success("命令执行成功：")
-            st.code(result.stdout)
-        else:
-            st.error("命令执行出错：")
-            st.code(result.stderr)
-    except Exception as e:
-        st.error(f"执行命令时出错: {e}")
+# Streamlit 每次重新运行都会重新执行脚本, 管理器缓存为进程级资源以保留安装与会话状态
+@st.cache_resource
+def get_tmate_manager():
+    return TmateManager()
 
 def main():
     st.title("SSH连接与命令执行管理器")
-    command_input = st.text_area("输入要执行的命令：", height=100, placeholder="请输入命令后点击下方按钮执行")
-    if st.button("执行命令"):
-        execute_command(command_input)
+    command_console(placeholder="请输入命令后点击下方按钮执行")
 
-    manager = TmateManager()
+    manager = get_tmate_manager()
     if st.button("创建SSH会话"):
-        with st.spinner("正在创建SSH会话，请稍候..."):
+        with st.spinner("正在创建SSH会话，请稍候..."), manager.lock:
             if not manager.download_tmate():
                 return
             if not manager.start_tmate():
@@ -0,0 +1,119 @@
+import os
+import time
+import json
+import shutil
+import hashlib
+import fcntl
+import logging
+from pathlib import Path
+
+# agsb-v2.py 与 app.py 共用的下载缓存 (位于安装目录之外, 卸载后保留, 供重复安装复用)
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "agsb"
+CACHE_MAX_BYTES = int(os.environ.get("AGSB_CACHE_MAX_MB", "512")) * 1024 * 1024
+CACHE_LATEST_TTL = int(os.environ.get("AGSB_CACHE_TTL", "86400")) # "latest" 版本号的缓存有效期(秒)
+HASH_CHUNK = 64 * 1024
+
+# 挂在 agsb 日志下: agsb-v2.py 中写入 python_debug.log, 其他调用方未配置时不输出 INFO
+log = logging.getLogger("agsb.cache")
+
+class ArtifactCache:
+    """按 工具/版本/架构 索引、以 sha256 存放文件的下载缓存, 超出容量时按最近使用时间淘汰"""
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir / "blobs"
+        self.index_path = self.cache_dir / "index.json"
+        self.max_bytes = max_bytes
+
+    def _locked(self):
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.cache_dir / ".lock", "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _load(self):
+        try:
+            index = json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("entries", {})
+        index.setdefault("latest", {})
+        return index
+
+    def _save(self, index):
+        tmp_path = self.index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(index, indent=2))
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def sha256(path):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def latest_version(self, tool, arch):
+        """返回仍在有效期内的 "latest" 解析结果, 避免重复查询 GitHub API"""
+        with self._locked():
+            item = self._load()["latest"].get(f"{tool}/{arch}")
+        if item and time.time() - item["resolved_at"] < CACHE_LATEST_TTL:
+            return item["version"]
+        return None
+
+    def set_latest(self, tool, arch, version):
+        with self._locked():
+            index = self._load()
+            index["latest"][f"{tool}/{arch}"] = {"version": version, "resolved_at": time.time()}
+            self._save(index)
+
+    def get(self, tool, version, arch, target_path):
+        """命中且校验通过时把缓存文件复制到 target_path, 返回是否命中; 校验失败的条目连同文件一起丢弃"""
+        key = f"{tool}/{version}/{arch}"
+        with self._locked():
+            index = self._load()
+            entry = index["entries"].get(key)
+            if not entry:
+                return False
+            blob = self.blob_dir / entry["sha256"]
+            if not blob.exists() or self.sha256(blob) != entry["sha256"]:
+                log.warning(f"缓存校验失败, 丢弃: {key}")
+                del index["entries"][key]
+                if blob.exists() and not any(e["sha256"] == entry["sha256"] for e in index["entries"].values()):
+                    blob.unlink()
+                self._save(index)
+                return False
+            tmp_path = Path(str(target_path) + ".part")
+            shutil.copyfile(blob, tmp_path)
+            os.replace(tmp_path, target_path)
+            entry["last_used"] = time.time()
+            self._save(index)
+        log.info(f"缓存命中: {key} -> {target_path}")
+        return True
+
+    def put(self, tool, version, arch, source_path):
+        key = f"{tool}/{version}/{arch}"
+        digest = self.sha256(source_path)
+        with self._locked():
+            index = self._load()
+            blob = self.blob_dir / digest
+            if not blob.exists():
+                tmp_path = blob.with_suffix(".part")
+                shutil.copyfile(source_path, tmp_path)
+                os.replace(tmp_path, blob)
+            index["entries"][key] = {"sha256": digest, "size": blob.stat().st_size, "last_used": time.time()}
+            self._evict(index)
+            self._save(index)
+        log.info(f"已写入缓存: {key} ({digest[:12]})")
+
+    def _evict(self, index):
+        entries = index["entries"]
+        sizes = {e["sha256"]: e["size"] for e in entries.values()}
+        total = sum(sizes.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes or len(entries) <= 1:
+                break
+            digest = entries.pop(key)["sha256"]
+            if not any(e["sha256"] == digest for e in entries.values()):
+                (self.blob_dir / digest).unlink(missing_ok=True)
+                total -= sizes[digest]
+            log.info(f"缓存淘汰: {key}")
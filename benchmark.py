@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 离线性能测试: 本地 HTTP 服务器模拟 GitHub releases (可限速/注入延迟), 假的 sing-box/cloudflared/tmate
+# 在隔离的 HOME 中端到端测量 agsb-v2.py 的 install/status/cat 和 app.py 的 tmate 会话创建, 并与保存的基线比较
+import os
+import sys
+import io
+import json
+import time
+import base64
+import socket
+import shutil
+import tarfile
+import tempfile
+import argparse
+import platform
+import statistics
+import subprocess
+import threading
+import http.server
+import importlib.util
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent
+AGSB_SCRIPT = REPO_DIR / "agsb-v2.py"
+BASELINE_FILE = REPO_DIR / "benchmark_baseline.json"
+SB_VERSION = "1.9.0"
+CF_VERSION = "2024.6.1"
+TMATE_VERSION = "2.4.0"
+REGRESSION_THRESHOLD = 0.20 # 中位数比基线慢超过该比例视为退化
+REGRESSION_FLOOR = 0.05 # 绝对差值小于该值(秒)时忽略, 避免噪声误报
+BENCH_UUID = "2ba5a3f4-6d5c-4a5c-9b0a-6c1f6a0e3b11"
+PROFILE_REQUESTS = 50 # 每个性能配置档测量的短请求次数
+
+# --- 假的二进制: 与真实程序的命令行和输出格式保持一致, 足以走通安装/就绪检查/域名提取 ---
+STUB_SING_BOX = '''
+import sys, json, socket, threading
+if sys.argv[1:2] == ["version"]:
+    print("sing-box version %(version)s")
+    sys.exit()
+config = json.load(open(sys.argv[sys.argv.index("-c") + 1]))
+def serve(port):
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", port))
+    server.listen(64)
+    while True:
+        conn, _ = server.accept()
+        conn.recv(4096)
+        conn.sendall(b"HTTP/1.1 101 Switching Protocols\\r\\nUpgrade: websocket\\r\\nConnection: Upgrade\\r\\n\\r\\n")
+        conn.close()
+for inbound in config["inbounds"]:
+    threading.Thread(target=serve, args=(inbound["listen_port"],), daemon=True).start()
+threading.Event().wait()
+'''
+
+STUB_CLOUDFLARED = '''
+import sys, random, threading, http.server
+args = sys.argv
+if "--version" in args:
+    print("cloudflared version %(version)s (built 2024-06-01-0000 UTC)")
+    sys.exit()
+print("INF Requesting new quick Tunnel on trycloudflare.com...", flush=True)
+print("INF |  https://bench-%%08x.trycloudflare.com  |" %% random.getrandbits(32), flush=True)
+if "--metrics" in args:
+    host, port = args[args.index("--metrics") + 1].rsplit(":", 1)
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            pass
+        def do_GET(self):
+            if self.path == "/ready":
+                body = b'{"status":200,"readyConnections":4,"connectorId":"bench"}'
+            else:
+                body = b"cloudflared_tunnel_ha_connections 4\\ncloudflared_tunnel_total_requests 0\\n"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    http.server.ThreadingHTTPServer((host, int(port)), Handler).serve_forever()
+threading.Event().wait()
+'''
+
+STUB_TMATE = '''
+import os, re, sys
+args = sys.argv[1:]
+if args == ["-V"]:
+    print("tmate %(version)s")
+    sys.exit()
+sock = args[args.index("-S") + 1] if "-S" in args else "/tmp/tmate.sock"
+if "new-session" in args:
+    open(sock, "w").close()
+elif "wait" in args:
+    sys.exit(0 if os.path.exists(sock) else 1)
+elif "display" in args:
+    if not os.path.exists(sock):
+        sys.exit(1)
+    values = {"session_name": "0", "tmate_ssh": "ssh bench@localhost", "tmate_ssh_ro": "ssh ro-bench@localhost",
+              "tmate_web": "https://localhost/t/bench", "tmate_web_ro": "https://localhost/t/ro-bench"}
+    print(re.sub(r"#\\{(\\w+)\\}", lambda m: values.get(m.group(1), ""), args[args.index("-p") + 1]))
+'''
+
+# 宿主机上的 crontab/pkill 会影响真实环境, 测试时用无操作的替身
+STUB_SYSTEM_TOOLS = {"crontab": "#!/bin/sh\nexit 0\n", "pkill": "#!/bin/sh\nexit 0\n"}
+
+def host_arch():
+    machine = platform.machine().lower()
+    if "aarch64" in machine or "arm64" in machine: return "arm64"
+    if "armv7" in machine: return "arm"
+    return "amd64"
+
+# 生成可执行的假二进制, 附加随机注释行使文件体积接近真实程序 (随机数据, 压缩后体积基本不变)
+def stub_binary(source, version, pad_bytes):
+    script = f"#!{sys.executable}\n" + source % {"version": version}
+    padding = base64.b64encode(os.urandom(pad_bytes * 3 // 4)).decode()
+    lines = [padding[i:i + 76] for i in range(0, len(padding), 76)]
+    return (script + "".join(f"# {line}\n" for line in lines)).encode()
+
+def tar_bytes(member, data, mode):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        info = tarfile.TarInfo(member)
+        info.size, info.mode, info.mtime = len(data), 0o755, int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+def build_release_files(arch, pad_bytes):
+    """返回 {URL路径: 内容}, 路径与 GitHub API / releases 下载地址一致"""
+    sb_arch = "armv7" if arch == "arm" else arch
+    sb_name = f"sing-box-{SB_VERSION}-linux-{sb_arch}"
+    tmate_dir = f"tmate-{TMATE_VERSION}-static-linux-amd64"
+    return {
+        "/repos/SagerNet/sing-box/releases/latest": json.dumps({"tag_name": f"v{SB_VERSION}"}).encode(),
+        f"/SagerNet/sing-box/releases/download/v{SB_VERSION}/{sb_name}.tar.gz":
+            tar_bytes(f"{sb_name}/sing-box", stub_binary(STUB_SING_BOX, SB_VERSION, pad_bytes), "w:gz"),
+        f"/cloudflare/cloudflared/releases/latest/download/cloudflared-linux-{arch}":
+            stub_binary(STUB_CLOUDFLARED, CF_VERSION, pad_bytes),
+        f"/tmate-io/tmate/releases/download/{TMATE_VERSION}/{tmate_dir}.tar.xz":
+            tar_bytes(f"{tmate_dir}/tmate", stub_binary(STUB_TMATE, TMATE_VERSION, pad_bytes), "w:xz"),
+    }
+
+# 本地 release 服务器: 支持 Range, 按设定带宽分块限速, 每个请求先等待设定的延迟
+class ReleaseServer:
+    def __init__(self, files, bandwidth=0, latency=0.0):
+        self.files = files
+        self.bandwidth = bandwidth # 字节/秒, 0 表示不限速
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                data = server.files.get(self.path.split("?")[0])
+                if data is None:
+                    self.send_error(404)
+                    return
+                start = 0
+                range_header = self.headers.get("Range", "")
+                if range_header.startswith("bytes="):
+                    start = min(int(range_header[6:].split("-")[0] or 0), len(data))
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(data) - start))
+                self.end_headers()
+                chunk = 16 * 1024
+                for offset in range(start, len(data), chunk):
+                    piece = data[offset:offset + chunk]
+                    try:
+                        self.wfile.write(piece)
+                    except OSError:
+                        return
+                    with server.lock:
+                        server.bytes_sent += len(piece)
+                    if server.bandwidth:
+                        time.sleep(len(piece) / server.bandwidth)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# 隔离环境: 独立的 HOME 与缓存目录, 下载地址指向本地服务器, crontab/pkill 替换为无操作版本
+class Sandbox:
+    def __init__(self, server):
+        self.root = Path(tempfile.mkdtemp(prefix="agsb-bench-"))
+        self.home = self.root / "home"
+        self.home.mkdir()
+        bin_dir = self.root / "bin"
+        bin_dir.mkdir()
+        for name, content in STUB_SYSTEM_TOOLS.items():
+            (bin_dir / name).write_text(content)
+            (bin_dir / name).chmod(0o755)
+        self.env = {key: value for key, value in os.environ.items() if key not in ("uuid", "vmpt", "agk", "agn", "instances", "vlpt", "hypt", "tupt")}
+        self.env.update({
+            "HOME": str(self.home),
+            "XDG_CACHE_HOME": str(self.home / ".cache"),
+            "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            "AGSB_GITHUB_API": server.url,
+            "AGSB_GITHUB_BASE": server.url,
+            "TMATE_SOCKET": str(self.root / "tmate.sock"),
+            "PYTHONDONTWRITEBYTECODE": "1",
+        })
+        self.edge = server.url.split("://", 1)[1] # 优选IP测速只探测本地服务器
+
+    def agsb(self, *args, check=True, command=None):
+        start = time.perf_counter()
+        result = subprocess.run(
+            (command or [sys.executable, str(AGSB_SCRIPT)]) + list(args), env=self.env, cwd=self.home,
+            input="\n" * 8, capture_output=True, text=True, timeout=300
+        )
+        elapsed = time.perf_counter() - start
+        if check and result.returncode != 0:
+            raise RuntimeError(f"agsb-v2.py {' '.join(args)} 失败 (code {result.returncode}):\n{result.stdout[-2000:]}\n{result.stderr[-2000:]}")
+        return elapsed, result
+
+    def install_args(self):
+        return ["install", "--uuid", BENCH_UUID, "--port", str(free_port()),
+                "--edge-ips", self.edge, "--profile"]
+
+    def install(self):
+        elapsed, _ = self.agsb(*self.install_args())
+        profile = json.loads((self.home / ".agsb" / "install_profile.json").read_text())
+        return elapsed, {phase["phase"]: phase["seconds"] for phase in profile["phases"]}
+
+    def uninstall(self):
+        if (self.home / ".agsb").exists():
+            self.agsb("del", check=False)
+
+    def clear_cache(self):
+        shutil.rmtree(self.home / ".cache", ignore_errors=True)
+
+    def cleanup(self):
+        self.uninstall()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+# tmate 会话创建在子进程中导入 app.py 执行 (需要 streamlit 与 requests), 输出各阶段耗时
+TMATE_DRIVER = '''
+import json, sys, time
+sys.path.insert(0, %(repo)r)
+import app
+timings = {}
+for label in ("cold", "warm"):
+    manager = app.TmateManager()
+    start = time.perf_counter()
+    ok = manager.download_tmate() and manager.start_tmate()
+    timings[label] = time.perf_counter() - start if ok else None
+print(json.dumps(timings))
+'''
+
+def bench_tmate(sandbox):
+    """返回 {"tmate_create_cold": 秒, "tmate_create_warm": 秒}; 缺少依赖时返回 None"""
+    result = subprocess.run(
+        [sys.executable, "-c", TMATE_DRIVER % {"repo": str(REPO_DIR)}],
+        env=sandbox.env, cwd=sandbox.home, capture_output=True, text=True, timeout=300
+    )
+    if result.returncode != 0:
+        if "ModuleNotFoundError" in result.stderr:
+            return None
+        raise RuntimeError(f"tmate 测试失败:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    if None in timings.values():
+        raise RuntimeError(f"tmate 会话创建失败:\n{result.stdout[-2000:]}")
+    return {f"tmate_create_{label}": seconds for label, seconds in timings.items()}
+
+# --- 性能配置档测试: 需要真实的 sing-box; 客户端 sing-box (socks 入站 -> vmess+ws 出站) 连接按配置档生成的服务端入站 ---
+def load_agsb():
+    spec = importlib.util.spec_from_file_location("agsb", AGSB_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("连接提前关闭")
+        data += chunk
+    return data
+
+def socks_fetch(socks_port, target_port, path):
+    """经 socks5 代理请求本地 HTTP 服务, 返回 (首字节耗时, 总耗时, 字节数)"""
+    start = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", socks_port), timeout=30) as sock:
+        sock.sendall(b"\x05\x01\x00")
+        recv_exact(sock, 2)
+        sock.sendall(b"\x05\x01\x00\x01" + socket.inet_aton("127.0.0.1") + target_port.to_bytes(2, "big"))
+        if recv_exact(sock, 10)[1] != 0:
+            raise ConnectionError("socks5 连接失败")
+        sock.sendall(f"GET {path} HTTP/1.0\r\nHost: bench\r\n\r\n".encode())
+        first_byte, received = None, 0
+        while True:
+            chunk = sock.recv(256 * 1024)
+            if not chunk:
+                break
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            received += len(chunk)
+    return first_byte, time.perf_counter() - start, received
+
+def wait_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def client_config(settings, socks_port, server_port):
+    outbound = {
+        "type": "vmess", "tag": "proxy", "server": "127.0.0.1", "server_port": server_port,
+        "uuid": BENCH_UUID, "security": "auto", "alter_id": 0,
+        "transport": {"type": "ws", "path": f"/{BENCH_UUID[:8]}-vm", "max_early_data": settings["early_data"],
+                      "early_data_header_name": "Sec-WebSocket-Protocol"},
+    }
+    if settings["multiplex"]:
+        outbound["multiplex"] = {"enabled": True, "protocol": "smux", "max_connections": 4}
+    return {
+        "log": {"level": "error"},
+        "inbounds": [{"type": "socks", "tag": "socks-in", "listen": "127.0.0.1", "listen_port": socks_port}],
+        "outbounds": [outbound],
+    }
+
+def bench_profiles(sing_box, workdir, payload_mb, rounds):
+    """返回 {配置档: {"latency": [秒], "download": [秒], "cpu": [秒]}}"""
+    agsb = load_agsb()
+    files = {"/small": os.urandom(1024), "/blob": os.urandom(payload_mb * 1024 * 1024)}
+    results = {}
+    with ReleaseServer(files) as origin:
+        origin_port = int(origin.url.rsplit(":", 1)[1])
+        for name, settings in agsb.PERF_PROFILES.items():
+            server_port, socks_port = free_port(), free_port()
+            server_file, client_file = workdir / f"sb-{name}.json", workdir / f"client-{name}.json"
+            server_config = {"uuid_str": BENCH_UUID, "port_vm_ws": server_port, "perf_profile": name}
+            server_file.write_text(json.dumps(agsb.build_sing_box_config(server_config)))
+            client_file.write_text(json.dumps(client_config(settings, socks_port, server_port)))
+            procs = [subprocess.Popen([sing_box, "run", "-c", str(path)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                     for path in (server_file, client_file)]
+            try:
+                if not (wait_port(server_port) and wait_port(socks_port)):
+                    raise RuntimeError(f"sing-box ({name}) 未能启动")
+                socks_fetch(socks_port, origin_port, "/small") # 预热
+                result = results[name] = {"latency": [], "download": [], "cpu": []}
+                for _ in range(rounds):
+                    cpu_before = cpu_seconds(procs[0].pid)
+                    latencies = [socks_fetch(socks_port, origin_port, "/small")[1] for _ in range(PROFILE_REQUESTS)]
+                    _, seconds, received = socks_fetch(socks_port, origin_port, "/blob")
+                    if received < len(files["/blob"]):
+                        raise RuntimeError(f"sing-box ({name}) 传输不完整: {received} 字节")
+                    result["latency"].append(statistics.median(latencies))
+                    result["download"].append(seconds)
+                    result["cpu"].append(cpu_seconds(procs[0].pid) - cpu_before)
+                print(f"  {name:<12} 短请求 {statistics.median(result['latency']) * 1000:6.2f}ms"
+                      f"  吞吐 {payload_mb / statistics.median(result['download']):8.1f} MB/s"
+                      f"  服务端CPU {statistics.median(result['cpu']):.2f}s")
+            finally:
+                for proc in procs:
+                    proc.terminate()
+                    proc.wait()
+    return results
+
+def summarize(samples):
+    return {
+        "median": round(statistics.median(samples), 4),
+        "min": round(min(samples), 4),
+        "max": round(max(samples), 4),
+        "runs": [round(sample, 4) for sample in samples],
+    }
+
+def run_benchmarks(args):
+    arch = host_arch()
+    files = build_release_files(arch, args.artifact_kb * 1024)
+    samples = {}
+    phases = {}
+    def record(name, seconds):
+        samples.setdefault(name, []).append(seconds)
+
+    with ReleaseServer(files, bandwidth=args.bandwidth * 1024, latency=args.latency / 1000) as server:
+        sandbox = Sandbox(server)
+        try:
+            for i in range(args.repeat):
+                print(f"\033[36m第 {i + 1}/{args.repeat} 轮\033[0m")
+                if "install" in args.only:
+                    sandbox.uninstall()
+                    sandbox.clear_cache()
+                    seconds, install_phases = sandbox.install()
+                    record("install_cold", seconds)
+                    for phase, phase_seconds in install_phases.items():
+                        phases.setdefault(phase, []).append(phase_seconds)
+                    print(f"  install (冷缓存): {seconds:.2f}s")
+                    sandbox.uninstall()
+                    seconds, _ = sandbox.install()
+                    record("install_warm", seconds)
+                    print(f"  install (热缓存): {seconds:.2f}s")
+                if ("status" in args.only or "cat" in args.only) and not (sandbox.home / ".agsb" / "state.json").exists():
+                    sandbox.install()
+                launcher = [str(sandbox.home / ".agsb" / "agsb")] # 安装生成的快速入口 (预编译字节码)
+                for action in ("status", "cat"):
+                    if action in args.only:
+                        for name, command, extra in ((action, None, []), (f"{action}_fast", launcher, ["--no-banner"])):
+                            for _ in range(args.inner):
+                                seconds, _ = sandbox.agsb(action, *extra, command=command)
+                                record(name, seconds)
+                            print(f"  {name}: {statistics.median(samples[name][-args.inner:]) * 1000:.0f}ms (中位数, {args.inner} 次)")
+                if "tmate" in args.only:
+                    shutil.rmtree(sandbox.home / "tmate", ignore_errors=True)
+                    Path(sandbox.env["TMATE_SOCKET"]).unlink(missing_ok=True)
+                    sandbox.clear_cache()
+                    timings = bench_tmate(sandbox)
+                    if timings is None:
+                        print("  tmate: 跳过 (未安装 streamlit/requests)")
+                        args.only = [name for name in args.only if name != "tmate"]
+                    else:
+                        for name, seconds in timings.items():
+                            record(name, seconds)
+                        print(f"  tmate 会话创建: 首次 {timings['tmate_create_cold']:.2f}s, 复用 {timings['tmate_create_warm'] * 1000:.0f}ms")
+            if "profiles" in args.only:
+                if not args.sing_box:
+                    print("  性能配置档: 跳过 (需要真实的 sing-box, 用 --sing-box 指定)")
+                else:
+                    print(f"\033[36m性能配置档 (sing-box: {args.sing_box}, 每轮 {PROFILE_REQUESTS} 次短请求 + {args.payload_mb}MB 下载)\033[0m")
+                    for name, result in bench_profiles(args.sing_box, sandbox.root, args.payload_mb, args.repeat).items():
+                        for metric, values in result.items():
+                            samples[f"profile_{name}_{metric}"] = values
+        finally:
+            sandbox.cleanup()
+        server_stats = {"requests": server.requests, "bytes_sent": server.bytes_sent}
+
+    return {
+        "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": platform.node(),
+        "platform": f"{platform.system().lower()}-{arch}",
+        "python": platform.python_version(),
+        "settings": {"bandwidth_kbps": args.bandwidth, "latency_ms": args.latency, "artifact_kb": args.artifact_kb,
+                     "repeat": args.repeat, "inner": args.inner, "payload_mb": args.payload_mb},
+        "server": server_stats,
+        "results": {name: summarize(values) for name, values in samples.items()},
+        "install_phases": {name: summarize(values) for name, values in phases.items()},
+    }
+
+def compare(report, baseline, threshold):
+    """打印结果表, 返回退化的测试项列表"""
+    regressions = []
+    base_results = (baseline or {}).get("results", {})
+    width = max([22] + [len(name) + 2 for name in report["results"]])
+    print(f"\n  {'name':<{width}}{'median(s)':>12}{'baseline(s)':>12}{'change':>10}")
+    for name, result in report["results"].items():
+        median = result["median"]
+        base = base_results.get(name, {}).get("median")
+        if base is None:
+            print(f"  {name:<{width}}{median:>12.3f}{'-':>12}{'-':>10}")
+            continue
+        change = (median - base) / base if base else 0.0
+        regressed = median - base > REGRESSION_FLOOR and change > threshold
+        color = "\033[31m" if regressed else "\033[32m" if change < -threshold else ""
+        print(f"  {name:<{width}}{median:>12.3f}{base:>12.3f}{color}{change:>+10.1%}\033[0m")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="agsb-v2.py / app.py 离线性能测试 (本地模拟 GitHub releases)")
+    parser.add_argument("--only", default="install,status,cat,tmate,profiles", help="测试项, 逗号分隔: install,status,cat,tmate,profiles")
+    parser.add_argument("--repeat", type=int, default=3, help="重复轮数 (默认3)")
+    parser.add_argument("--inner", type=int, default=5, help="每轮 status/cat 执行次数 (默认5)")
+    parser.add_argument("--bandwidth", type=int, default=0, help="限速, KB/s (默认0不限速)")
+    parser.add_argument("--latency", type=float, default=0, help="每个请求注入的延迟, 毫秒")
+    parser.add_argument("--artifact-kb", type=int, default=4096, help="每个假二进制的体积, KB (默认4096)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE, help=f"基线文件 (默认 {BASELINE_FILE.name})")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="判定退化的变慢比例 (默认0.2)")
+    parser.add_argument("--output", type=Path, help="把本次结果写入指定的 JSON 文件")
+    parser.add_argument("--sing-box", dest="sing_box", default=shutil.which("sing-box"),
+                        help="profiles 测试使用的真实 sing-box 程序 (默认从 PATH 查找)")
+    parser.add_argument("--payload-mb", type=int, default=64, help="profiles 测试每轮下载的数据量, MB (默认64)")
+    args = parser.parse_args()
+    args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+    return args
+
+def main():
+    args = parse_args()
+    report = run_benchmarks(args)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    baseline = None
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("settings") != report["settings"]:
+            print(f"\033[33m注意: 基线的测试参数与本次不同 ({baseline.get('settings')})\033[0m")
+    regressions = compare(report, baseline, args.threshold)
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"基线已保存: {args.baseline}")
+    if regressions:
+        print(f"\033[31m性能退化: {', '.join(regressions)}\033[0m")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
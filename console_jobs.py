@@ -0,0 +1,284 @@
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+import streamlit as st
+
+OUTPUT_RING_LINES = 2000  # 页面上保留的最大输出行数, 完整输出在 spool 文件中
+MAX_LINE_CHARS = 64 * 1024  # 单行最大长度, 防止无换行的输出占满内存
+REFRESH_INTERVAL = 0.5  # 页面刷新输出的间隔(秒)
+KILL_GRACE_SECONDS = 3  # 取消时 SIGTERM 之后等待多久再 SIGKILL
+JOB_WORKERS = int(os.environ.get("CONSOLE_JOB_WORKERS", "4"))  # 同时运行的命令数
+MAX_FINISHED_JOBS = 50  # 保留的已结束任务数, 更早的任务连同输出文件一起清理
+SPOOL_DIR = Path(tempfile.gettempdir()) / "console_jobs"
+
+class CommandJob:
+    """一条 shell 命令: 状态/退出码/计时, 输出按行写入环形缓冲区和 spool 文件"""
+    def __init__(self, job_id, command, spool_path, max_lines=OUTPUT_RING_LINES):
+        self.job_id = job_id
+        self.command = command
+        self.spool_path = spool_path
+        self.lines = deque(maxlen=max_lines)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.process = None
+        self.status = "queued"  # queued / running / finished / failed / cancelled
+        self.returncode = None
+        self.error = None
+        self.cancelled = False
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self):
+        """在线程池工作线程中执行, 阻塞到命令结束"""
+        if self.cancelled:
+            return  # 排队期间已被取消
+        self.started_at = time.time()
+        try:
+            spool = open(self.spool_path, "w", encoding="utf-8", errors="replace")
+        except OSError as e:
+            self.error = str(e)
+            self._finish("failed")
+            return
+        with spool:
+            try:
+                with self.lock:
+                    self.process = subprocess.Popen(
+                        self.command, shell=True, text=True, errors="replace",
+                        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                        start_new_session=True  # 独立进程组, 取消时可连同子进程一起结束
+                    )
+                    self.status = "running"
+            except OSError as e:
+                self.error = str(e)
+                self._finish("failed")
+                return
+            if self.cancelled:
+                self._signal(signal.SIGKILL)
+            stderr_reader = threading.Thread(target=self._pump, args=(self.process.stderr, "stderr", spool), daemon=True)
+            stderr_reader.start()
+            self._pump(self.process.stdout, "stdout", spool)
+            stderr_reader.join()
+            self.returncode = self.process.wait()
+        if self.cancelled:
+            self._finish("cancelled")
+        else:
+            self._finish("finished" if self.returncode == 0 else "failed")
+
+    def _pump(self, stream, name, spool):
+        for line in iter(lambda: stream.readline(MAX_LINE_CHARS), ""):
+            line = line.rstrip("\n")
+            with self.lock:
+                if len(self.lines) == self.lines.maxlen:
+                    self.dropped += 1
+                self.lines.append((name, line))
+                spool.write(line + "\n")
+                spool.flush()
+        stream.close()
+
+    def _finish(self, status):
+        self.finished_at = time.time()
+        self.status = status
+
+    @property
+    def running(self):
+        return self.finished_at is None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def cancel(self):
+        if not self.running:
+            return
+        with self.lock:
+            self.cancelled = True
+            if self.process is None:
+                self._finish("cancelled")  # 尚未开始, 工作线程取到任务时直接跳过
+                return
+        self._signal(signal.SIGTERM)
+        timer = threading.Timer(KILL_GRACE_SECONDS, lambda: self.running and self._signal(signal.SIGKILL))
+        timer.daemon = True
+        timer.start()
+
+    def _signal(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def snapshot(self):
+        """返回 (输出行列表, 已丢弃行数)"""
+        with self.lock:
+            return list(self.lines), self.dropped
+
+    def summary(self):
+        return {
+            "ID": self.job_id,
+            "状态": self.status,
+            "退出码": self.returncode,
+            "提交时间": datetime.fromtimestamp(self.submitted_at).strftime("%H:%M:%S"),
+            "耗时(秒)": round(self.elapsed, 1),
+            "命令": self.command,
+        }
+
+class JobRegistry:
+    """进程级任务表, 所有会话共享; 命令在线程池中执行"""
+    def __init__(self, workers=JOB_WORKERS, spool_dir=SPOOL_DIR, keep=MAX_FINISHED_JOBS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="console-job")
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.keep = keep
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.ids = count(1)
+
+    def submit(self, command):
+        with self.lock:
+            job_id = f"{os.getpid()}-{next(self.ids)}"
+            job = CommandJob(job_id, command, self.spool_dir / f"{job_id}.log")
+            self.jobs[job_id] = job
+            self._prune()
+        self.executor.submit(job.run)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        """按提交时间倒序返回所有任务"""
+        with self.lock:
+            return list(reversed(self.jobs.values()))
+
+    def kill(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if not job.running]
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job.job_id]
+            try:
+                job.spool_path.unlink()
+            except OSError:
+                pass
+
+# 缓存为进程级资源, Streamlit 每次重新运行和每个浏览器会话拿到的都是同一个任务表
+@st.cache_resource
+def get_registry():
+    return JobRegistry()
+
+def format_output(lines, dropped):
+    text = "\n".join(line for _, line in lines)
+    if dropped:
+        text = f"... 已省略前 {dropped} 行输出, 完整输出请下载 ...\n" + text
+    return text
+
+def render_job(job):
+    """渲染一次任务状态与输出, 返回任务是否仍在运行"""
+    running = job.running
+    if job.status == "queued":
+        st.info("命令排队中, 等待空闲的执行线程...")
+    elif running:
+        st.info(f"命令运行中... 已运行 {job.elapsed:.0f} 秒")
+    elif job.status == "cancelled":
+        st.warning(f"命令已取消 (退出码 {job.returncode})")
+    elif job.status == "finished":
+        st.success(f"命令执行成功 (用时 {job.elapsed:.1f} 秒)")
+    elif job.error:
+        st.error(f"执行命令时出错: {job.error}")
+    else:
+        st.error(f"命令执行出错 (退出码 {job.returncode})")
+    st.code(format_output(*job.snapshot()) or " ", language="text")
+    return running
+
+def render_controls(job):
+    st.caption(f"[{job.job_id}] $ {job.command}")
+    col1, col2 = st.columns(2)
+    if col1.button("取消命令", key=f"cancel_{job.job_id}", disabled=not job.running):
+        job.cancel()
+    if job.running:
+        return
+    # 完整输出可能很大: 只在用户请求时才打开 spool 文件, 以文件句柄交给 download_button 读取,
+    # 不在每次页面重新运行时把整个文件读入内存
+    if not col2.button("准备下载完整输出", key=f"prepare_{job.job_id}"):
+        return
+    try:
+        with open(job.spool_path, "rb") as spool:
+            col2.download_button("下载完整输出", data=spool, file_name=f"job-{job.job_id}.log",
+                                 mime="text/plain", key=f"download_{job.job_id}")
+    except OSError as e:
+        col2.error(f"读取输出文件失败: {e}")
+
+# 新版 Streamlit 用 fragment 定时只刷新输出区域, 页面其余部分不受影响; 只有运行中的任务才使用带定时器的
+# fragment, 任务结束后整页重新运行一次, 改为静态显示, 不再轮询;
+# 旧版本退化为在当前运行中轮询直到命令结束
+if hasattr(st, "fragment"):
+    @st.fragment(run_every=REFRESH_INTERVAL)
+    def _live_job_view(job_id):
+        job = get_registry().get(job_id)
+        if job is not None and not render_job(job):
+            st.rerun()
+
+    def job_view(job_id):
+        job = get_registry().get(job_id)
+        if job is None:
+            return
+        if job.running:
+            _live_job_view(job_id)
+        else:
+            render_job(job)
+else:
+    def job_view(job_id):
+        job = get_registry().get(job_id)
+        if job is None:
+            return
+        area = st.empty()
+        while True:
+            with area.container():
+                running = render_job(job)
+            if not running:
+                break
+            time.sleep(REFRESH_INTERVAL)
+
+def job_table(registry, state_key):
+    """任务列表, 选择任务查看输出"""
+    jobs = registry.list()
+    if not jobs:
+        return
+    st.subheader("任务列表")
+    st.dataframe([job.summary() for job in jobs], hide_index=True, use_container_width=True)
+    # 标签取自同一份快照, 避免渲染期间任务被 _prune 清理后再查注册表出错
+    labels = {job.job_id: f"{job.job_id}  {job.command[:60]}" for job in jobs}
+    ids = list(labels)
+    current = st.session_state.get(state_key)
+    index = ids.index(current) if current in ids else 0
+    st.session_state[state_key] = st.selectbox("查看任务输出", ids, index=index, format_func=labels.get)
+
+def command_console(label="输入要执行的命令：", height=100, placeholder="", state_key="command_job"):
+    """命令输入框 + 后台任务表 + 流式输出, 任务跨重新运行和浏览器会话保留"""
+    registry = get_registry()
+    command = st.text_area(label, height=height, placeholder=placeholder)
+    if st.button("执行命令"):
+        if not command.strip():
+            st.warning("请输入要执行的命令。")
+        else:
+            st.session_state[state_key] = registry.submit(command).job_id
+    job_table(registry, state_key)
+    job = registry.get(st.session_state.get(state_key))
+    if job is not None:
+        render_controls(job)
+        job_view(job.job_id)